@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+""" pytest configuration for the connector benchmarks.
+
+Run with pytest-benchmark installed, from the repository root:
+
+    python -m pytest benchmarks --benchmark-autosave
+    python -m pytest benchmarks --shape wide --driver fs
+
+The benchmarks use their own minimal Django settings (in-memory sqlite,
+temporary filesystem roots), so they don't depend on test_project.
+"""
+import tempfile
+
+import django
+import pytest
+from django.conf import settings
+
+from benchmarks.shapes import SHAPES
+
+DRIVERS = ('fs', 'model')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('elfinder')
+    group.addoption('--shape', action='append', choices=sorted(SHAPES),
+                    help='Synthetic tree shape to benchmark (repeatable).')
+    group.addoption('--driver', action='append', choices=DRIVERS,
+                    help='Volume driver to benchmark (repeatable).')
+
+
+def pytest_configure(config):
+    if settings.configured:
+        return
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY='elfinder-benchmarks',
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                               'NAME': ':memory:'}},
+        INSTALLED_APPS=['django.contrib.auth',
+                        'django.contrib.contenttypes',
+                        'django.contrib.sessions',
+                        'mptt',
+                        'elfinder'],
+        ROOT_URLCONF='elfinder.urls',
+        MEDIA_ROOT=tempfile.gettempdir(),
+        MEDIA_URL='/media/',
+        TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                    'APP_DIRS': True}],
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def pytest_generate_tests(metafunc):
+    if 'shape' in metafunc.fixturenames:
+        metafunc.parametrize('shape', metafunc.config.getoption('shape') or sorted(SHAPES),
+                             scope='module')
+    if 'driver' in metafunc.fixturenames:
+        metafunc.parametrize('driver', metafunc.config.getoption('driver') or DRIVERS,
+                             scope='module')
+
+
+@pytest.fixture(scope='module')
+def tree(driver, shape, tmp_path_factory):
+    """ A SyntheticTree of the given shape, built once per module. """
+    from benchmarks.shapes import get_shape
+    from benchmarks.trees import FileSystemTree, ModelTree
+    if driver == 'fs':
+        synthetic = FileSystemTree(get_shape(shape), tmp_path_factory.mktemp(shape))
+    else:
+        synthetic = ModelTree(get_shape(shape), 'bench-%s-%s' % (shape, tmp_path_factory.mktemp(shape).name))
+    return synthetic.build()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import tracemalloc
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory
+
+from elfinder.connector import ElFinderConnector
+
+
+class CommandError(Exception):
+    pass
+
+
+def run_command(volume, files=None, **params):
+    """ Runs a connector command against volume, like connector_view does.
+
+        Raises CommandError if the connector reports an error.
+    """
+    factory = RequestFactory()
+    if files:
+        params.update(files)
+        request = factory.post('/', params)
+    else:
+        request = factory.get('/', params)
+    connector = ElFinderConnector([volume])
+    connector.run(request)
+    if 'error' in connector.response:
+        raise CommandError(connector.response['error'])
+    return connector
+
+
+def upload_file(name, size):
+    return SimpleUploadedFile(name, b'x' * size, content_type='text/plain')
+
+
+def bench(benchmark, func, setup=None, rounds=5):
+    """ Benchmarks func(*setup()) and records its peak memory (KiB) in the
+        benchmark's extra_info.
+
+        Commands a driver does not implement are skipped.
+    """
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        func(*args)
+    except (CommandError, NotImplementedError) as e:
+        pytest.skip('not supported by the driver: %s' % (str(e) or type(e).__name__))
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    benchmark.extra_info['peak_memory_kib'] = peak // 1024
+
+    if setup is None:
+        return benchmark.pedantic(func, rounds=rounds)
+    return benchmark.pedantic(func, setup=lambda: (setup(), {}), rounds=rounds)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+""" Shapes of the synthetic volumes built by the benchmarks.
+
+A shape describes a tree built under a top-level 'data' directory:
+
+    depth: levels of directories below 'data'
+    dirs: directories per level
+    files: files per directory
+    size: bytes per file
+
+ELFINDER_BENCH_SCALE (default 1) multiplies the number of files.
+"""
+import os
+
+SHAPES = {
+    'wide': {'depth': 0, 'dirs': 0, 'files': 2000, 'size': 64},
+    'deep': {'depth': 25, 'dirs': 1, 'files': 4, 'size': 64},
+    'small_files': {'depth': 2, 'dirs': 6, 'files': 40, 'size': 16},
+    'huge_files': {'depth': 0, 'dirs': 0, 'files': 3, 'size': 8 * 1024 * 1024},
+}
+
+
+def get_shape(name):
+    shape = dict(SHAPES[name])
+    scale = float(os.environ.get('ELFINDER_BENCH_SCALE', 1))
+    shape['files'] = max(1, int(shape['files'] * scale))
+    return shape
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+""" Read-only commands: open, tree, parents, search, size, file. """
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmarks.helpers import bench, run_command
+
+
+def test_open(benchmark, tree):
+    bench(benchmark, lambda: run_command(tree.volume(), cmd='open', target=tree.data))
+
+
+def test_open_init(benchmark, tree):
+    bench(benchmark, lambda: run_command(tree.volume(), cmd='open', target='',
+                                         init='1', tree='1'))
+
+
+def test_tree(benchmark, tree):
+    bench(benchmark, lambda: run_command(tree.volume(), cmd='tree', target=tree.data))
+
+
+def test_parents(benchmark, tree):
+    bench(benchmark, lambda: run_command(tree.volume(), cmd='parents', target=tree.deepest))
+
+
+def test_search(benchmark, tree):
+    bench(benchmark, lambda: run_command(tree.volume(), cmd='search', target=tree.root,
+                                         q='file_1', reqid='bench'))
+
+
+def test_size(benchmark, tree):
+    bench(benchmark, lambda: run_command(tree.volume(), cmd='size',
+                                         **{'targets[]': [tree.data]}))
+
+
+def test_file(benchmark, tree):
+    bench(benchmark, lambda: run_command(tree.volume(), cmd='file', target=tree.file))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" Model driver commands on a large collection, with and without the
+composite indexes of the Directory and File models:
+
+    python -m pytest benchmarks/test_model_indexes.py --benchmark-group-by=func
+
+ELFINDER_BENCH_ROWS (default 1000000) is the number of files of the
+collection, spread over 1000 directories.
+"""
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from django.db import connection
+
+from benchmarks.helpers import bench, run_command
+from elfinder.models import Directory, File, FileCollection
+from elfinder.volume_drivers.model_driver import ModelVolumeDriver
+
+DIRECTORIES = 1000
+BATCH_SIZE = 10000
+
+
+@pytest.fixture(scope='module')
+def collection():
+    """ A collection of ELFINDER_BENCH_ROWS files. The MPTT fields are
+        computed here, as bulk_create bypasses django-mptt.
+    """
+    rows = int(os.environ.get('ELFINDER_BENCH_ROWS', 1000000))
+    collection = FileCollection.objects.create(name='bench-indexes')
+    root = Directory.objects.create(name='root', collection=collection)
+    tree_id = root.tree_id
+    Directory.objects.bulk_create([
+        Directory(name='dir_%04d' % index, parent=root, collection=collection,
+                  tree_id=tree_id, level=1, lft=2 + 2 * index, rght=3 + 2 * index)
+        for index in range(DIRECTORIES)])
+    Directory.objects.filter(pk=root.pk).update(rght=2 + 2 * DIRECTORIES)
+    dir_ids = list(Directory.objects.filter(parent=root).values_list('pk', flat=True))
+    for start in range(0, rows, BATCH_SIZE):
+        File.objects.bulk_create([
+            File(name='file_%07d.txt' % index, parent_id=dir_ids[index % DIRECTORIES],
+                 collection=collection, content='x' * 64, size=64)
+            for index in range(start, min(start + BATCH_SIZE, rows))])
+    return collection
+
+
+@pytest.fixture(params=['with', 'without'], scope='module')
+def indexes(request, collection):
+    """ Drops the composite indexes for the 'without' runs. """
+    models = (Directory, File)
+    if request.param == 'without':
+        with connection.schema_editor() as editor:
+            for model in models:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+    yield request.param
+    if request.param == 'without':
+        with connection.schema_editor() as editor:
+            for model in models:
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
+
+
+def get_volume(collection):
+    return ModelVolumeDriver(collection.id)
+
+
+def test_ls(benchmark, collection, indexes):
+    target = Directory.objects.filter(collection=collection, level=1).first().get_hash()
+    bench(benchmark, lambda: run_command(get_volume(collection), cmd='ls', target=target))
+
+
+def test_open(benchmark, collection, indexes):
+    target = Directory.objects.filter(collection=collection, level=1).last().get_hash()
+    bench(benchmark, lambda: run_command(get_volume(collection), cmd='open', target=target))
+
+
+def test_parents(benchmark, collection, indexes):
+    target = Directory.objects.filter(collection=collection, level=1).last().get_hash()
+    bench(benchmark, lambda: run_command(get_volume(collection), cmd='parents', target=target))
+
+
+def test_search(benchmark, collection, indexes):
+    root = get_volume(collection).get_info('')['hash']
+    bench(benchmark, lambda: run_command(get_volume(collection), cmd='search', target=root,
+                                         q='file_0000042', reqid='bench'))
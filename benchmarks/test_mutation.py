@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+""" Commands that change the volume: upload, paste, rm.
+
+Each round works on a fresh scratch directory created outside the timing.
+"""
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmarks.helpers import bench, run_command, upload_file
+
+
+def test_upload(benchmark, tree):
+    def setup():
+        return (tree.scratch_dir(), upload_file('upload.txt', tree.shape['size']))
+
+    bench(benchmark,
+          lambda target, upload: run_command(tree.volume(), cmd='upload', target=target,
+                                             files={'upload[]': upload}),
+          setup=setup)
+
+
+def test_paste_copy(benchmark, tree):
+    bench(benchmark,
+          lambda dest: run_command(tree.volume(), cmd='paste', dst=dest, cut='0',
+                                   suffix='~', **{'targets[]': [tree.data]}),
+          setup=lambda: (tree.scratch_dir(),), rounds=3)
+
+
+def test_rm(benchmark, tree):
+    def setup():
+        scratch = tree.scratch_dir()
+        tree.volume().paste([tree.data], scratch, False)
+        return (scratch,)
+
+    bench(benchmark,
+          lambda target: run_command(tree.volume(), cmd='rm', **{'targets[]': [target]}),
+          setup=setup, rounds=3)
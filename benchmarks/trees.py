@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+""" Synthetic volumes for the benchmarks (see benchmarks.shapes). """
+from elfinder.models import Directory, File, FileCollection
+from elfinder.volume_drivers.fs_driver import FileSystemVolumeDriver
+from elfinder.volume_drivers.model_driver import ModelVolumeDriver
+
+
+class SyntheticTree(object):
+    """ Builds a shape in a volume and exposes the hashes the benchmarks
+        run commands against.
+
+        root: the volume root
+        data: the top-level directory holding the shape
+        deepest: the deepest directory of the shape
+        file: a file of the shape
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.root = self.data = self.deepest = self.file = None
+        self._counter = 0
+
+    def volume(self):
+        raise NotImplementedError
+
+    def build(self):
+        volume = self.volume()
+        self.root = volume.get_info('')['hash']
+        self.data = volume.mkdir('data', self.root)['hash']
+        self.deepest = self._build_level(volume, self.data, self.shape['depth'])
+        return self
+
+    def _build_level(self, volume, parent, depth):
+        for index in range(self.shape['files']):
+            info = self.create_file(volume, parent, 'file_%d.txt' % index,
+                                    self.shape['size'])
+            if self.file is None:
+                self.file = info['hash']
+        deepest = parent
+        if depth > 0:
+            for index in range(self.shape['dirs']):
+                child = volume.mkdir('dir_%d' % index, parent)['hash']
+                child_deepest = self._build_level(volume, child, depth - 1)
+                if index == 0:
+                    deepest = child_deepest
+        return deepest
+
+    def create_file(self, volume, parent, name, size):
+        raise NotImplementedError
+
+    def scratch_dir(self):
+        """ Creates a new empty directory in the volume root. """
+        self._counter += 1
+        return self.volume().mkdir('scratch_%d' % self._counter, self.root)['hash']
+
+
+class FileSystemTree(SyntheticTree):
+    def __init__(self, shape, path):
+        super(FileSystemTree, self).__init__(shape)
+        self.path = str(path)
+        self._paths = {}
+
+    def volume(self):
+        return FileSystemVolumeDriver(fs_driver_root=self.path)
+
+    def create_file(self, volume, parent, name, size):
+        if parent not in self._paths:
+            self._paths[parent] = volume._find_path(parent)
+        path = self._paths[parent] / name
+        with path.open('wb') as fp:
+            fp.write(b'x' * size)
+        return volume._get_path_info(path)
+
+
+class ModelTree(SyntheticTree):
+    def __init__(self, shape, name):
+        super(ModelTree, self).__init__(shape)
+        self.collection = FileCollection.objects.create(name=name)
+        Directory.objects.create(name=name, collection=self.collection)
+
+    def volume(self):
+        return ModelVolumeDriver(self.collection.id)
+
+    def create_file(self, volume, parent, name, size):
+        new_file = File.objects.create(name=name,
+                                       parent=volume.get_object(parent),
+                                       collection=self.collection,
+                                       content='x' * size)
+        return new_file.get_info()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+""" Cooperative cancellation of the commands, for the 'abort' command.
+
+The client sends a reqid with every request, and `abort` with the reqid
+of the request it gave up on. A reqid is only unique for its client, so
+aborts are keyed by the user (see throttling.get_request_user) and the
+reqid: a user can only abort their own commands. The abort is recorded
+in the Django cache,
+so that it reaches the worker process running the command; the long loops
+of the volume drivers (walks, searches, copies) call
+BaseVolumeDriver.check_aborted, which raises Aborted once the command is
+aborted. The cache is only looked at every CHECK_INTERVAL seconds.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+
+# seconds between two lookups of the abort flag of a command
+CHECK_INTERVAL = 0.5
+# seconds an abort is remembered (the command may not have started yet)
+ABORT_TIMEOUT = 600
+
+
+class Aborted(Exception):
+    """ Raised in a command aborted by the client. """
+
+    def __init__(self, message='errAbort'):
+        super(Aborted, self).__init__(message)
+
+
+def _key(user, reqid):
+    # reqid comes from the client: hashed to a valid cache key
+    return 'elfinder:abort:%s' % hashlib.sha1(force_bytes('%s\0%s' % (user, reqid))).hexdigest()
+
+
+def abort(user, reqid):
+    """ Asks the command of the request reqid of user to stop. """
+    cache.set(_key(user, reqid), True, ABORT_TIMEOUT)
+
+
+def is_aborted(user, reqid):
+    return bool(cache.get(_key(user, reqid)))
+
+
+class Cancellation(object):
+    """ The abort flag of the command of the request reqid of user. """
+
+    def __init__(self, user, reqid, interval=CHECK_INTERVAL):
+        self.user = user
+        self.reqid = reqid
+        self.interval = interval
+        self.aborted = False
+        self._checked = 0
+
+    def check(self):
+        """ Raises Aborted if the command was aborted. Cheap enough to be
+            called for every entry of a walk.
+        """
+        if not self.aborted:
+            now = time.time()
+            if now - self._checked < self.interval:
+                return
+            self._checked = now
+            self.aborted = is_aborted(self.user, self.reqid)
+        if self.aborted:
+            raise Aborted()
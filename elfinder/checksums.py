@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+""" Checksums of the file contents, as '<algorithm>:<hex digest>' (e.g.
+'sha256:9f86...'), the algorithm being ELFINDER_CHECKSUM_ALGORITHM.
+
+They are computed while the bytes are written (checksum_chunks wraps the
+chunks being written), so they cost no extra read. The filesystem driver
+keeps them in an extended attribute of the file, along with the size and
+mtime they were computed for: a file changed outside elFinder simply has
+no checksum anymore. The model driver keeps them in File.checksum.
+"""
+import errno
+import hashlib
+import os
+
+from django.utils.encoding import force_bytes
+
+from elfinder.conf import settings
+
+XATTR_NAME = 'user.elfinder.checksum'
+
+# errors meaning "no (valid) attribute here", not "the call failed"
+XATTR_ERRORS = set(getattr(errno, name) for name in (
+    'ENODATA', 'ENOATTR', 'ENOTSUP', 'EOPNOTSUPP', 'EPERM', 'EACCES', 'ENOENT')
+    if hasattr(errno, name))
+
+
+def new_hasher():
+    return hashlib.new(settings.ELFINDER_CHECKSUM_ALGORITHM)
+
+
+def format_checksum(hasher):
+    return '%s:%s' % (settings.ELFINDER_CHECKSUM_ALGORITHM, hasher.hexdigest())
+
+
+def checksum_data(data):
+    hasher = new_hasher()
+    hasher.update(force_bytes(data))
+    return format_checksum(hasher)
+
+
+def checksum_chunks(chunks, hasher):
+    """ Yields the chunks, adding them to hasher on the way. """
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+
+def get_file_checksum(path):
+    """ Returns the checksum stored on the file path, or None if there is
+        none or the file changed since it was computed.
+    """
+    if not hasattr(os, 'getxattr'):
+        return None
+    try:
+        value = os.getxattr(path, XATTR_NAME).decode('ascii')
+        stat = os.stat(path)
+    except OSError as e:
+        if e.errno in XATTR_ERRORS:
+            return None
+        raise
+    checksum, _, stamp = value.rpartition('@')
+    if stamp != '%d:%d' % (stat.st_size, stat.st_mtime_ns):
+        return None
+    return checksum
+
+
+def set_file_checksum(path, checksum):
+    """ Stores checksum on the file path. Returns False if the filesystem
+        does not support extended attributes.
+    """
+    if not hasattr(os, 'setxattr'):
+        return False
+    try:
+        stat = os.stat(path)
+        value = '%s@%d:%d' % (checksum, stat.st_size, stat.st_mtime_ns)
+        os.setxattr(path, XATTR_NAME, value.encode('ascii'))
+    except OSError as e:
+        if e.errno in XATTR_ERRORS:
+            return False
+        raise
+    return True
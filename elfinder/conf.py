@@ -46,6 +46,77 @@ class LazySettings(LazyObject):
             user_settings.MEDIA_URL
         )
 
+        # [{"BACKEND": "elfinder.instrumentation.StatsdSink", "OPTIONS": {}}]
+        self.ELFINDER_METRICS_SINKS = getattr(
+            user_settings, "ELFINDER_METRICS_SINKS",
+            []
+        )
+
+        # Commands slower than this (seconds) are profiled; None disables it.
+        self.ELFINDER_PROFILE_THRESHOLD = getattr(
+            user_settings, "ELFINDER_PROFILE_THRESHOLD",
+            None
+        )
+
+        self.ELFINDER_PROFILE_DIR = getattr(
+            user_settings, "ELFINDER_PROFILE_DIR",
+            None
+        )
+
+        # 'cprofile' or 'pyinstrument'
+        self.ELFINDER_PROFILER = getattr(
+            user_settings, "ELFINDER_PROFILER",
+            "cprofile"
+        )
+
+        # Size of the thread pool running the blocking work of the async views.
+        self.ELFINDER_ASYNC_MAX_WORKERS = getattr(
+            user_settings, "ELFINDER_ASYNC_MAX_WORKERS",
+            32
+        )
+
+        # Threads building the volumes of a multi-volume 'open' concurrently.
+        self.ELFINDER_VOLUME_WORKERS = getattr(
+            user_settings, "ELFINDER_VOLUME_WORKERS",
+            4
+        )
+
+        # Threads streaming files in a paste between volumes.
+        self.ELFINDER_COPY_WORKERS = getattr(
+            user_settings, "ELFINDER_COPY_WORKERS",
+            4
+        )
+
+        # Extra or overriding MIME types by extension: {".md": "text/markdown"}
+        self.ELFINDER_MIME_TYPES = getattr(
+            user_settings, "ELFINDER_MIME_TYPES",
+            {}
+        )
+
+        # Identify files without a known extension by their first bytes.
+        self.ELFINDER_MIME_SNIFF = getattr(
+            user_settings, "ELFINDER_MIME_SNIFF",
+            False
+        )
+
+        # hashlib algorithm of the checksums of the files.
+        self.ELFINDER_CHECKSUM_ALGORITHM = getattr(
+            user_settings, "ELFINDER_CHECKSUM_ALGORITHM",
+            'sha256'
+        )
+
+        # Where the chunks of the chunked uploads are kept until they are
+        # merged (default: a directory of the system temporary directory),
+        # and the seconds after which abandoned ones are removed.
+        self.ELFINDER_UPLOAD_CHUNK_DIR = getattr(
+            user_settings, "ELFINDER_UPLOAD_CHUNK_DIR",
+            None
+        )
+        self.ELFINDER_UPLOAD_CHUNK_TTL = getattr(
+            user_settings, "ELFINDER_UPLOAD_CHUNK_TTL",
+            24 * 3600
+        )
+
         # special settings for TinyMCE connector
         self.ELFINDER_TINYMCE_PATH_TO_POPUP_JS = getattr(
             user_settings, "ELFINDER_TINYMCE_PATH_TO_POPUP_JS",
@@ -8,12 +8,24 @@ do not own. This needs to be implemented in an extendable way, rather
 than being tied to one method of permissions checking.
 """
 
-import collections
+import hashlib
+import json
 import logging
 import os
+import shutil
 
 import patoolib
 from django.utils.functional import cached_property
+from django.utils.http import parse_etags, quote_etag
+
+from elfinder.cancellation import Aborted, Cancellation
+from elfinder.cancellation import abort as request_abort
+from elfinder.conf import settings
+from elfinder.helpers import call_with_db_cleanup, get_thread_pool
+from elfinder.instrumentation import CommandMetrics, Profiler, emit_metrics
+from elfinder.throttling import get_request_user, get_throttle
+from elfinder.uploads import check_uploads, get_upload_errors
+from elfinder.volume_drivers.base import QuotaExceeded, check_name
 
 logger = logging.getLogger(__name__)
 
@@ -77,7 +89,8 @@ class ElFinderConnector(object):
             'upload': [
                 {'method': '__upload',
                  'options': ['target'],
-                 'defaults': {'overwrite': True, 'suffix': '~', 'renames[]': []},
+                 'defaults': {'overwrite': True, 'suffix': '~', 'renames[]': [],
+                              'mimes[]': []},
                  'exclude': ['chunk', 'range', 'cid', 'upload[]']},
                 {'method': '__upload_chunked', 'options': ['target', 'range', 'chunk', 'cid']},
                 {'method': '__upload_chunked_req',
@@ -94,9 +107,9 @@ class ElFinderConnector(object):
                         'options': ['target', 'targets[]', 'name', 'type']},
             'search': {'method': '__search', 'options': ['target', 'q', 'reqid']},
             'zipdl': {'method': '__zip_download', 'options': ['targets[]']},
-            'get': {'method': '__get', 'options': ['target', 'conv'],
+            'get': {'method': '__get', 'options': ['target'],
                     'defaults': {'conv': None}},
-            'abort': {'method': '__abort', 'options': ['id', 'reqid']},
+            'abort': {'method': '__abort', 'options': ['id']},
         }
 
     def get_init_params(self):
@@ -130,17 +143,69 @@ class ElFinderConnector(object):
     def allowed_http_params(self):
         return self.get_allowed_http_params()
 
+    def get_conditional_commands(self):
+        """ Returns the names of the commands whose responses only depend on
+            the state of the target directories, so they can be validated
+            with an ETag instead of being rebuilt on every request.
+        """
+        return ['open', 'tree', 'parents', 'ls']
+
+    def get_etag(self):
+        """ Returns the ETag for the response of the current command, or
+            None if the command (or one of the volumes involved) does not
+            support conditional responses.
+
+            The ETag combines the request parameters with the version tokens
+            reported by the volumes (see BaseVolumeDriver.get_version), so it
+            can be computed without building the listing itself.
+        """
+        cmd = self.data.get('cmd')
+        if cmd not in self.get_conditional_commands():
+            return None
+        target = self.data.get('target', '')
+        ancestors = cmd == 'parents' or (cmd == 'open' and self.data.get('tree') == '1')
+        if target == '':
+            volumes = list(self.volumes.values())
+        else:
+            volumes = [self.get_volume(target)]
+        versions = []
+        for volume in volumes:
+            version = volume.get_version(target, ancestors=ancestors)
+            if version is None:
+                return None
+            versions.append(version)
+        params = dict((k, v) for k, v in self.data.items() if k != 'reqid')
+        key = json.dumps([self._version, versions, params], sort_keys=True)
+        return quote_etag(hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def is_not_modified(self, etag):
+        """ Returns True if the client already holds the response identified
+            by etag (If-None-Match request header).
+        """
+        etags = parse_etags(self.request.META.get('HTTP_IF_NONE_MATCH', ''))
+        return etag in etags or '*' in etags
+
     def get_volume(self, hash):
         """ Returns the volume which contains the file/dir represented by the
             hash.
         """
-        try:
-            volume_id, target = hash.split('_')[:2]
-        except ValueError:
+        volume_id, sep, target = hash.partition('_')
+        if not sep or volume_id not in self.volumes:
             raise Exception('Invalid target hash: %s' % hash)
 
         return self.volumes[volume_id]
 
+    def map_volumes(self, func, volumes):
+        """ Returns [func(volume) for volume in volumes], running the calls
+            concurrently (ELFINDER_VOLUME_WORKERS threads) when there are
+            several volumes.
+        """
+        if len(volumes) < 2:
+            return [func(volume) for volume in volumes]
+        executor = get_thread_pool('volumes', settings.ELFINDER_VOLUME_WORKERS)
+        return list(executor.map(lambda volume: call_with_db_cleanup(func, volume),
+                                 volumes))
+
     def check_command_variables(self, options, exclude):
         """ Checks the GET variables to ensure they are valid for this command.
             _commands controls which commands must or must not be set.
@@ -167,16 +232,99 @@ class ElFinderConnector(object):
             which GET variables must be present or empty for this command.
         """
         func = getattr(self, '_' + self.__class__.__name__ + func_name, None)
-        if not isinstance(func, collections.Callable):
+        if not callable(func):
             self.response['error'] = 'Command failed'
             return
 
+        metrics = CommandMetrics(self.data['cmd'], self.volumes)
+        cancellation = self.get_cancellation()
+        for volume in self.volumes.values():
+            volume.metrics = metrics
+            volume.cancellation = cancellation
+        try:
+            with Profiler(metrics.command).profile(metrics), metrics.measure():
+                return self._run_command(func, **defaults)
+        finally:
+            metrics.error = 'error' in self.response
+            metrics.record('entries', self.count_entries())
+            emit_metrics(self, metrics)
+
+    def get_reqid(self):
+        """ Returns the id the client gave to the request, or None. It comes
+            in a header for the requests sent with GET.
+        """
+        return self.data.get('reqid') or self.request.META.get('HTTP_X_ELFINDERREQID')
+
+    def get_cancellation(self):
+        """ Returns the Cancellation through which the abort command can
+            stop the current command, or None without a reqid.
+        """
+        reqid = self.get_reqid()
+        if not reqid or self.data['cmd'] == 'abort':
+            return None
+        return Cancellation(get_request_user(self.request), reqid)
+
+    def get_throttle(self):
+        """ Returns the Throttle limiting the current command on the volume
+            of its target, or None.
+        """
+        target = self.data.get('target') or (self.data.get('targets[]') or [''])[0]
+        try:
+            volume = self.get_volume(target)
+        except Exception:
+            # The command itself reports invalid targets.
+            return None
+        return get_throttle(volume, self.data['cmd'], self.request)
+
+    def run_throttled_command(self, func_name, **defaults):
+        """ Runs the command within the limits of the 'throttle' option of
+            its volume, or answers that the server is busy.
+        """
+        throttle = self.get_throttle()
+        if throttle is None:
+            return self.run_command(func_name, **defaults)
+        retry_after = throttle.acquire()
+        if retry_after is not None:
+            self.httpStatusCode = 429
+            self.httpHeader['Retry-After'] = '%d' % retry_after
+            self.response['error'] = 'Server is busy, retry in %d seconds.' % retry_after
+            self.response['busy'] = retry_after
+            return
+        try:
+            return self.run_command(func_name, **defaults)
+        finally:
+            throttle.release()
+
+    def _run_command(self, func, **defaults):
+        try:
+            etag = self.get_etag()
+        except Exception as e:
+            # The command itself reports invalid targets.
+            logger.debug(e)
+            etag = None
+        if etag is not None:
+            self.httpHeader['ETag'] = etag
+            self.httpHeader['Cache-Control'] = 'private, no-cache'
+            if self.is_not_modified(etag):
+                self.httpStatusCode = 304
+                return
+
         try:
             return func(**defaults)
+        except Aborted as e:
+            self.response['error'] = '%s' % e
+            logger.info('%s aborted', self.data['cmd'])
         except Exception as e:
             self.response['error'] = '%s' % e
             logger.exception(e)
 
+    def count_entries(self):
+        """ Returns the number of files/dirs described in the response. """
+        count = 0
+        for key in ('files', 'tree', 'list', 'added'):
+            count += len(self.response.get(key) or ())
+        return count
+
     @staticmethod
     def _convert_bool(v):
         return bool(int(v))
@@ -224,13 +372,13 @@ class ElFinderConnector(object):
                     for command in cmd:
                         if self.check_command_variables(command['options'], command.get('exclude', ())):
                             defaults = self._get_defaults(**command.get('defaults', {}))
-                            self.run_command(command['method'], **defaults)
+                            self.run_throttled_command(command['method'], **defaults)
                             break
                     else:
                         self.response['error'] = 'Invalid arguments'
                 elif self.check_command_variables(cmd['options'], cmd.get('exclude', ())):
                     defaults = self._get_defaults(**cmd.get('defaults', {}))
-                    self.run_command(cmd['method'], **defaults)
+                    self.run_throttled_command(cmd['method'], **defaults)
                 else:
                     self.response['error'] = 'Invalid arguments'
             else:
@@ -281,9 +429,7 @@ class ElFinderConnector(object):
         """
         target = self.data['target']
         volume = self.get_volume(target)
-        self.response['tree'] = volume.get_tree(target,
-                                                ancestors=True,
-                                                siblings=True, **kwargs)
+        self.response['tree'] = volume.get_parents(target, **kwargs)
 
     def __tree(self, **kwargs):
         """ Handles the 'tree' command.
@@ -338,17 +484,26 @@ class ElFinderConnector(object):
             # for the first time and requires information about all currently
             # opened volumes.
 
+            def get_volume_files(volume):
+                return [volume.get_info('')] + volume.get_tree('',
+                                                               inc_ancestors,
+                                                               inc_siblings, **kwargs)
+
+            volumes = list(self.volumes.values())
+            # The root of each volume and its first level are built
+            # concurrently, then merged in volume order.
+            files, hashes = [], set()
+            for volume_files in self.map_volumes(get_volume_files, volumes):
+                for info in volume_files:
+                    if info['hash'] not in hashes:
+                        hashes.add(info['hash'])
+                        files.append(info)
+
             # Assume the first volume's root is the currently open directory.
-            volume = next(iter(self.volumes.values()))
+            volume = volumes[0]
             self.response.update(volume.get_options())
-            self.response['cwd'] = volume.get_info('')
-
-            # Add relevant tree information for each volume
-            for volume_id in self.volumes:
-                volume = self.volumes[volume_id]
-                self.response['files'] = volume.get_tree('',
-                                                         inc_ancestors,
-                                                         inc_siblings, **kwargs)
+            self.response['cwd'] = files[0]
+            self.response['files'] = files
         else:
             # A target was specified, so we only need to return info about
             # that directory.
@@ -406,8 +561,120 @@ class ElFinderConnector(object):
         source_volume = self.get_volume(targets[0])
         dest_volume = self.get_volume(dest)
         if source_volume != dest_volume:
-            raise Exception('Moving between volumes is not supported.')
-        self.response.update(dest_volume.paste(targets, dest, cut, **kwargs))
+            self.response.update(self.copy_between_volumes(targets, dest, cut))
+        else:
+            self.response.update(dest_volume.paste(targets, dest, cut, **kwargs))
+
+    def copy_between_volumes(self, targets, dest, cut):
+        """ Copies (or moves, if cut) targets into dest, which belongs to
+            another volume.
+
+            Directories are recreated first, then the files are streamed
+            from read_chunks to write_chunks in a bounded thread pool
+            (ELFINDER_COPY_WORKERS threads). Files that cannot be copied are
+            reported as warnings, and their top-level target is not removed
+            when moving.
+        """
+        dest_volume = self.get_volume(dest)
+        added, warnings, jobs, errors = [], [], [], []
+        failed = set()
+        existing = self._get_children(dest_volume, dest)
+        for target in targets:
+            source_volume = self.get_volume(target)
+            try:
+                info = self._plan_copy(source_volume, source_volume.get_info(target),
+                                       dest_volume, dest, jobs, target, errors, existing)
+            except Exception as e:
+                logger.exception(e)
+                warnings.append('%s' % e)
+                failed.add(target)
+                continue
+            if info is not None:
+                added.append(info)
+        for root, error in errors:
+            warnings.append(error)
+            failed.add(root)
+
+        def copy_file(job):
+            source_volume, source, parent, name, root = job
+            try:
+                dest_volume.check_aborted()
+                return dest_volume.write_chunks(name, parent,
+                                                source_volume.read_chunks(source)), None
+            except Aborted:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                return None, e
+
+        if len(jobs) > 1:
+            executor = get_thread_pool('copy', settings.ELFINDER_COPY_WORKERS)
+            results = executor.map(lambda job: call_with_db_cleanup(copy_file, job), jobs)
+        else:
+            results = [copy_file(job) for job in jobs]
+        for job, (info, error) in zip(jobs, results):
+            source_volume, source, parent, name, root = job
+            if error is not None:
+                warnings.append("Could not copy '%s': %s" % (name, error))
+                failed.add(root)
+            elif source == root:
+                added.append(info)
+
+        removed = []
+        if cut:
+            for target in targets:
+                if target in failed:
+                    continue
+                warning = self.get_volume(target).remove(target)
+                if warning:
+                    warnings.extend(warning)
+                else:
+                    removed.append(target)
+
+        result = {'added': added, 'removed': removed}
+        if warnings:
+            result['warning'] = warnings
+        return result
+
+    def _plan_copy(self, source_volume, info, dest_volume, dest, jobs, root, errors,
+                   existing):
+        """ Recreates the directory described by info (and its subdirectories)
+            in dest, merging it into a directory of the same name, and
+            appends a copy job for every file to jobs. existing maps the
+            names of the entries of dest to their info; each directory
+            merged into is listed once. The entries of the directory that
+            cannot be copied are reported in errors, as (root, message)
+            pairs.
+
+            Returns the info of the new directory, or None for a file.
+        """
+        check_name(info['name'])
+        if info['mime'] != 'directory':
+            jobs.append((source_volume, info['hash'], dest, info['name'], root))
+            return None
+        new_dir = existing.get(info['name'])
+        if new_dir is None:
+            new_dir = existing[info['name']] = dest_volume.mkdir(info['name'], dest)
+            children = {}
+        elif new_dir['mime'] == 'directory':
+            children = self._get_children(dest_volume, new_dir['hash'])
+        else:
+            raise Exception("Could not copy '%s': a file has that name" % info['name'])
+        for child in source_volume.get_tree(info['hash']):
+            if child['phash'] == info['hash']:
+                try:
+                    self._plan_copy(source_volume, child, dest_volume, new_dir['hash'],
+                                    jobs, root, errors, children)
+                except Exception as e:
+                    logger.exception(e)
+                    errors.append((root, '%s' % e))
+        return new_dir
+
+    @staticmethod
+    def _get_children(volume, target):
+        """ Returns the entries of the directory target by name. """
+        return dict((child['name'], child) for child in volume.get_tree(target)
+                    if child['phash'] == target)
 
     def __archive(self):
         target = self.data['target']
@@ -430,11 +697,27 @@ class ElFinderConnector(object):
                 files.append(orig_abs_path)
 
             patoolib.create_archive(zipfile, files)
+            self._claim_space(source_volume, zipfile, os.remove)
         for node in source_volume.get_tree(target):
             if source_volume._find_path(node['hash']) == zipfile:
                 added.append(node)
         self.response.update({"added": added})
 
+    def _claim_space(self, volume, path, remove):
+        """ Counts what was written at path (outside of the volume driver)
+            in the usage of volume, or removes it (with remove) if that
+            does not fit in the quota of the volume.
+        """
+        usage = volume.get_usage() if volume.quota is not None else None
+        if usage is None:
+            return
+        size = volume._get_size(path)
+        # Not get_free_space(): the disk space is already taken.
+        if size > volume.quota - usage:
+            remove(path)
+            raise QuotaExceeded('Quota exceeded')
+        volume.add_usage(size)
+
     def __extract(self):
         target = self.data['target']
         source_volume = self.get_volume(target)
@@ -447,6 +730,7 @@ class ElFinderConnector(object):
         )
         self.get_volume(archive_file.get('phash')).mkdir(archive_name, archive_file.get('phash'))
         patoolib.extract_archive(archive_file_path, outdir=folder_path, interactive=False)
+        self._claim_space(source_volume, folder_path, shutil.rmtree)
         added = []
         for node in source_volume.get_tree(archive_file.get('phash')):
             if source_volume._find_path(node['hash']) == folder_path:
@@ -479,7 +763,17 @@ class ElFinderConnector(object):
     def __upload(self, **kwargs):
         parent = self.data['target']
         volume = self.get_volume(parent)
-        self.response.update(volume.upload(self.request.FILES, parent, **kwargs))
+        # The files stopped while the request was read, then the ones over
+        # the limits when the volume was not known at the time.
+        errors = get_upload_errors(self.request)
+        files, rejected = check_uploads(volume, self.request.FILES, kwargs.get('mimes[]'))
+        errors.extend(rejected)
+        if files or not errors:
+            result = volume.upload(files, parent, **kwargs)
+            errors.extend(result.pop('warning', []))
+            self.response.update(result)
+        if errors:
+            self.response['warning' if self.response.get('added') else 'error'] = errors
 
     def __upload_chunked(self, **kwargs):
         parent = self.data['target']
@@ -510,9 +804,9 @@ class ElFinderConnector(object):
         self.response.update(volume.duplicate(targets))
 
     def __abort(self):
-        """Abort previous command"""
-        self.is_return_view = True
-        for volume in self.volumes:
-            self.return_view = self.volumes[volume].abort(self.data['id'])
-            if self.return_view:
-                break
+        """ Aborts the command of the request with the given reqid, of the
+            same user: the command stops at its next check_aborted.
+        """
+        request_abort(get_request_user(self.request), self.data['id'])
+        for volume in self.volumes.values():
+            volume.abort(self.data['id'])
@@ -1,7 +1,23 @@
 # -*- coding: utf-8 -*-
+import ctypes
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
 from django.utils.module_loading import import_string
 
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+# ioprio_set syscall numbers (Linux)
+IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289,
+                       'aarch64': 30, 'armv7l': 314, 'ppc64le': 273}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_BE = 2
+
 
 def get_module_class(class_path):
     """
@@ -13,3 +29,60 @@ def get_module_class(class_path):
     except ImportError as exc:
         raise ImproperlyConfigured('Error importing class path: "%s"' % exc)
     return klass
+
+
+def get_thread_pool(name, max_workers):
+    """
+    returns the thread pool (shared by the whole process) identified by
+    ``name`` and ``max_workers``
+    """
+    key = (name, max_workers)
+    with _thread_pools_lock:
+        if key not in _thread_pools:
+            _thread_pools[key] = ThreadPoolExecutor(max_workers=max_workers)
+        return _thread_pools[key]
+
+
+def call_with_db_cleanup(func, *args, **kwargs):
+    """
+    calls ``func`` in a pool thread, dropping the database connections
+    Django would close at the end of a request
+    """
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def parse_size(value):
+    """
+    returns the number of bytes of ``value``, a number or a string such as
+    ``'128M'`` (K, M, G and T suffixes, as in the ``uplMaxSize`` option)
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip().upper().rstrip('B')
+    units = 'KMGT'
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * 1024 ** (units.index(value[-1]) + 1))
+    return int(value)
+
+
+def lower_io_priority(level=7):
+    """
+    puts the calling thread in the best-effort I/O scheduling class at
+    ``level`` (0-7, 7 being the lowest), so that its disk accesses yield to
+    the ones of the requests; returns False where this is not supported
+    (only Linux is)
+    """
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None or platform.system() != 'Linux':
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        # who 0: the calling thread
+        return libc.syscall(number, IOPRIO_WHO_PROCESS, 0,
+                            (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | level) == 0
+    except (OSError, AttributeError):
+        return False
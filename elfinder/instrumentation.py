@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+""" Per-command timing and resource accounting for the connector.
+
+Every command run by ElFinderConnector is measured by a CommandMetrics
+object: wall time, database queries, bytes read/written by the volumes and
+entries returned to the client. Volume drivers can add their own counters
+through BaseVolumeDriver.record, e.g. the filesystem driver counts the
+entries it scans (fs_scanned): the system calls themselves are not
+counted, which would mean patching the os module. The metrics are sent
+through the elfinder.signals.command_executed signal and to the sinks
+configured in ELFINDER_METRICS_SINKS.
+
+Commands slower than ELFINDER_PROFILE_THRESHOLD (seconds) are profiled and
+the profile is dumped to ELFINDER_PROFILE_DIR.
+"""
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+from elfinder.conf import settings
+from elfinder.helpers import get_module_class
+from elfinder.signals import command_executed
+
+logger = logging.getLogger(__name__)
+
+
+class CommandMetrics(object):
+    """ Measurements of a single connector command. """
+    counter_names = ('queries', 'bytes_read', 'bytes_written', 'entries')
+
+    def __init__(self, command, volume_ids=()):
+        self.command = command
+        self.volume_ids = list(volume_ids)
+        self.duration = 0.0
+        self.error = False
+        self.counters = dict((name, 0) for name in self.counter_names)
+        # record is called from the thread pools of the drivers
+        self._lock = threading.Lock()
+
+    def record(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        data = {'command': self.command,
+                'volumes': self.volume_ids,
+                'duration': self.duration,
+                'error': self.error}
+        data.update(self.counters)
+        return data
+
+    @contextmanager
+    def measure(self):
+        """ Times the enclosed block and counts the queries it runs. """
+        wrappers = []
+        for connection in connections.all():
+            # Django >= 2.0
+            if hasattr(connection, 'execute_wrapper'):
+                wrapper = connection.execute_wrapper(self._count_query)
+                wrapper.__enter__()
+                wrappers.append(wrapper)
+        start = time.time()
+        try:
+            yield self
+        finally:
+            self.duration += time.time() - start
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.record('queries')
+        return execute(sql, params, many, context)
+
+
+class BaseMetricsSink(object):
+    """ Receives the metrics of every command. """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def emit(self, metrics):
+        raise NotImplementedError
+
+
+class StatsdSink(BaseMetricsSink):
+    """ Sends the metrics as statsd timers/counters over UDP.
+
+        Options: host (localhost), port (8125), prefix (elfinder).
+    """
+
+    def __init__(self, **options):
+        super(StatsdSink, self).__init__(**options)
+        self.address = (options.get('host', 'localhost'),
+                        int(options.get('port', 8125)))
+        self.prefix = options.get('prefix', 'elfinder')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, metrics):
+        name = '%s.%s' % (self.prefix, metrics.command)
+        lines = ['%s.time:%d|ms' % (name, metrics.duration * 1000)]
+        for counter, value in sorted(metrics.counters.items()):
+            lines.append('%s.%s:%d|c' % (name, counter, value))
+        if metrics.error:
+            lines.append('%s.errors:1|c' % name)
+        try:
+            self.socket.sendto('\n'.join(lines).encode('ascii'), self.address)
+        except (socket.error, UnicodeError) as e:
+            logger.debug(e)
+
+
+class PrometheusSink(BaseMetricsSink):
+    """ Aggregates the metrics in process and renders them in the Prometheus
+        text exposition format (served by elfinder.views.metrics_view).
+    """
+
+    def __init__(self, **options):
+        super(PrometheusSink, self).__init__(**options)
+        self.prefix = options.get('prefix', 'elfinder')
+        self.lock = threading.Lock()
+        self.commands = {}
+
+    def emit(self, metrics):
+        with self.lock:
+            totals = self.commands.setdefault(metrics.command, {
+                'count': 0, 'errors': 0, 'duration': 0.0})
+            totals['count'] += 1
+            totals['errors'] += int(metrics.error)
+            totals['duration'] += metrics.duration
+            for counter, value in metrics.counters.items():
+                totals[counter] = totals.get(counter, 0) + value
+
+    def render(self):
+        series = {}
+        with self.lock:
+            for command, totals in self.commands.items():
+                for name, value in totals.items():
+                    series.setdefault(name, []).append((command, value))
+        lines = []
+        for name in sorted(series):
+            metric = '%s_command_%s_total' % (self.prefix, name)
+            if name == 'duration':
+                metric = '%s_command_duration_seconds_total' % self.prefix
+            lines.append('# TYPE %s counter' % metric)
+            for command, value in sorted(series[name]):
+                lines.append('%s{command="%s"} %s' % (metric, command, value))
+        return '\n'.join(lines) + '\n'
+
+
+_sinks = None
+
+
+def get_metrics_sinks():
+    """ Returns the sinks configured in ELFINDER_METRICS_SINKS, a list of
+        dicts with a BACKEND class path and optional OPTIONS.
+    """
+    global _sinks
+    if _sinks is None:
+        sinks = []
+        for config in settings.ELFINDER_METRICS_SINKS:
+            klass = get_module_class(config['BACKEND'])
+            sinks.append(klass(**config.get('OPTIONS', {})))
+        _sinks = sinks
+    return _sinks
+
+
+def emit_metrics(connector, metrics):
+    command_executed.send(sender=connector.__class__,
+                          connector=connector,
+                          metrics=metrics)
+    for sink in get_metrics_sinks():
+        try:
+            sink.emit(metrics)
+        except Exception as e:
+            logger.exception(e)
+
+
+class Profiler(object):
+    """ Profiles a command and keeps the profile only if the command was
+        slower than ELFINDER_PROFILE_THRESHOLD.
+
+        ELFINDER_PROFILER selects 'cprofile' (default) or 'pyinstrument'.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.threshold = settings.ELFINDER_PROFILE_THRESHOLD
+        self.pyinstrument = settings.ELFINDER_PROFILER == 'pyinstrument'
+        self.profiler = None
+
+    @property
+    def enabled(self):
+        return self.threshold is not None
+
+    def start(self):
+        if self.pyinstrument:
+            from pyinstrument import Profiler as PyinstrumentProfiler
+            self.profiler = PyinstrumentProfiler()
+            self.profiler.start()
+        else:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self, duration):
+        """ Stops the profiler and returns the filename of the dumped
+            profile (None if the command was fast enough).
+        """
+        if self.pyinstrument:
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+        if duration < self.threshold:
+            return None
+        filename = os.path.join(
+            settings.ELFINDER_PROFILE_DIR or tempfile.gettempdir(),
+            'elfinder-%s-%d-%d.%s' % (self.command, time.time() * 1000, os.getpid(),
+                                      'html' if self.pyinstrument else 'prof'))
+        if self.pyinstrument:
+            with open(filename, 'w') as fp:
+                fp.write(self.profiler.output_html())
+        else:
+            self.profiler.dump_stats(filename)
+        logger.warning("Slow elFinder command '%s' (%.3fs), profile saved to %s",
+                       self.command, duration, filename)
+        return filename
+
+    @contextmanager
+    def profile(self, metrics):
+        if not self.enabled:
+            yield
+            return
+        self.start()
+        try:
+            yield
+        finally:
+            self.stop(metrics.duration)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+
+from elfinder.conf import settings as elfinder_settings
+from elfinder.models import Directory, File, FileCollection
+from elfinder.volume_drivers import get_volume_driver
+from elfinder.volume_drivers.model_driver import ModelVolumeDriver
+
+
+class Command(BaseCommand):
+    help = ("Deletes what was removed to the trash: of the filesystem volumes "
+            "with the 'trash' option (all the configured ones by default) and "
+            "of the file collections. Run it periodically, e.g. from cron, "
+            "when the 'trash_reaper' option is off.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('volumes', nargs='*',
+                            help='Names of volumes in ELFINDER_VOLUME_DRIVERS.')
+        parser.add_argument('--no-collections', action='store_true',
+                            help='Leave the trash of the file collections alone.')
+
+    def handle(self, *args, **options):
+        volumes = elfinder_settings.ELFINDER_VOLUME_DRIVERS
+        for name in options['volumes']:
+            if name not in volumes:
+                raise CommandError("Volume '%s' is not in ELFINDER_VOLUME_DRIVERS." % name)
+
+        for name in options['volumes'] or sorted(volumes):
+            try:
+                volume = get_volume_driver(name)
+            except Exception as e:
+                # e.g. model volumes, which need a collection
+                self.stderr.write('Skipping %s: %s' % (name, e))
+                continue
+            if isinstance(volume, ModelVolumeDriver):
+                continue
+            self.stdout.write('%s: %d files deleted' % (name, volume.purge_trash()))
+
+        if not options['no_collections']:
+            collection_ids = set(Directory.objects.filter(
+                deleted=True).values_list('collection', flat=True))
+            collection_ids.update(File.objects.filter(
+                deleted=True).values_list('collection', flat=True))
+            for collection in FileCollection.objects.filter(pk__in=collection_ids):
+                count = ModelVolumeDriver(collection.pk).purge_trash()
+                self.stdout.write('%s: %d files deleted' % (collection.name, count))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+
+from elfinder.conf import settings as elfinder_settings
+from elfinder.models import FileCollection
+from elfinder.volume_drivers import get_volume_driver
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the usage counters checked against the quotas: of the "
+            "filesystem volumes with a quota (all the configured ones by "
+            "default) and of the file collections. Run it periodically, e.g. "
+            "from cron, to correct what was changed outside elFinder.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('volumes', nargs='*',
+                            help='Names of volumes in ELFINDER_VOLUME_DRIVERS.')
+        parser.add_argument('--no-collections', action='store_true',
+                            help='Leave the usage of the file collections alone.')
+
+    def handle(self, *args, **options):
+        volumes = elfinder_settings.ELFINDER_VOLUME_DRIVERS
+        for name in options['volumes']:
+            if name not in volumes:
+                raise CommandError("Volume '%s' is not in ELFINDER_VOLUME_DRIVERS." % name)
+
+        for name in options['volumes'] or sorted(volumes):
+            try:
+                volume = get_volume_driver(name)
+            except Exception as e:
+                # e.g. model volumes, which need a collection
+                self.stderr.write('Skipping %s: %s' % (name, e))
+                continue
+            if volume.quota is None:
+                continue
+            self.stdout.write('%s: %d bytes' % (name, volume.reconcile_usage()))
+
+        if not options['no_collections']:
+            FileCollection.reconcile_usage()
+            for name, usage in FileCollection.objects.values_list('name', 'usage'):
+                self.stdout.write('%s: %d bytes' % (name, usage))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import json
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from elfinder.conf import settings as elfinder_settings
+from elfinder.volume_drivers import get_volume_driver
+
+
+def warm(name, task):
+    return get_volume_driver(name).warm(task)
+
+
+class Command(BaseCommand):
+    help = ("Fills the caches of the elFinder volumes (all the configured ones "
+            "by default), e.g. in a deploy step. The caches are shared through "
+            "the Django cache, so it must not be a per-process one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('volumes', nargs='*',
+                            help='Names of volumes in ELFINDER_VOLUME_DRIVERS.')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='Number of worker processes (0 warms in this process).')
+        parser.add_argument('--state-file',
+                            default=os.path.join(tempfile.gettempdir(), 'elfinder-warm.state'),
+                            help='File recording the completed tasks.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the tasks completed by the previous run.')
+
+    def handle(self, *args, **options):
+        backend = cache.__class__.__name__
+        if backend in ('LocMemCache', 'DummyCache'):
+            self.stderr.write('The %s cache backend is not shared with the server '
+                              'processes: the caches will not be reused.' % backend)
+
+        self.create_usage_counters(options['volumes'])
+        done = self.read_state(options['state_file']) if options['resume'] else set()
+        jobs = [job for job in self.get_jobs(options['volumes']) if job not in done]
+        if not jobs:
+            self.stdout.write('Nothing to warm.')
+            return
+
+        mode = 'a' if options['resume'] else 'w'
+        with open(options['state_file'], mode) as state:
+            for index, (job, entries) in enumerate(self.run(jobs, options['workers']), 1):
+                state.write(json.dumps(job) + '\n')
+                state.flush()
+                self.stdout.write('[%d/%d] %s: %s (%d entries)' % (
+                    index, len(jobs), job[0], job[1] or '/', entries))
+
+    def create_usage_counters(self, names):
+        """ Computes the usage of the volumes with a quota that have no
+            counter yet, which the requests do not do.
+        """
+        for name in names or sorted(elfinder_settings.ELFINDER_VOLUME_DRIVERS):
+            try:
+                volume = get_volume_driver(name)
+                if volume.quota is None or volume.get_usage() is not None:
+                    continue
+            except Exception:
+                # reported by get_jobs
+                continue
+            self.stdout.write('%s: usage %d bytes' % (name, volume.reconcile_usage()))
+
+    def get_jobs(self, names):
+        """ Returns the (volume name, task) pairs to run. """
+        volumes = elfinder_settings.ELFINDER_VOLUME_DRIVERS
+        for name in names:
+            if name not in volumes:
+                raise CommandError("Volume '%s' is not in ELFINDER_VOLUME_DRIVERS." % name)
+        jobs = []
+        for name in names or sorted(volumes):
+            try:
+                volume = get_volume_driver(name)
+            except Exception as e:
+                # e.g. model volumes, which need a collection
+                self.stderr.write('Skipping %s: %s' % (name, e))
+                continue
+            jobs.extend((name, task) for task in volume.get_warm_tasks())
+        return jobs
+
+    def run(self, jobs, workers):
+        """ Yields (job, entries) as the jobs complete. """
+        if workers < 1:
+            for job in jobs:
+                yield job, warm(*job)
+            return
+        # The workers must not share the connections of this process.
+        for connection in connections.all():
+            connection.close()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = dict((executor.submit(warm, *job), job) for job in jobs)
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    @staticmethod
+    def read_state(path):
+        done = set()
+        if os.path.exists(path):
+            with open(path) as state:
+                for line in state:
+                    if line.strip():
+                        done.add(tuple(json.loads(line)))
+        return done
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+import elfinder.models
+import mptt.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileCollection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Directory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('lft', models.PositiveIntegerField(editable=False)),
+                ('rght', models.PositiveIntegerField(editable=False)),
+                ('tree_id', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('level', models.PositiveIntegerField(editable=False)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='elfinder.FileCollection')),
+                ('parent', mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dirs', to='elfinder.Directory')),
+            ],
+            options={
+                'verbose_name_plural': 'directories',
+                'unique_together': {('name', 'parent')},
+            },
+            bases=(models.Model, elfinder.models.FileCollectionChildMixin),
+        ),
+        migrations.CreateModel(
+            name='File',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('content', models.TextField(blank=True, max_length=2048)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='elfinder.FileCollection')),
+                ('parent', mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='files', to='elfinder.Directory')),
+            ],
+            options={
+                'unique_together': {('name', 'parent')},
+            },
+            bases=(models.Model, elfinder.models.FileCollectionChildMixin),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:51
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+import django.utils.timezone
+
+
+def fill_file_size(apps, schema_editor):
+    File = apps.get_model('elfinder', 'File')
+    File.objects.update(size=Length('content'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elfinder', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='mtime',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='mtime',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_file_size, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(fields=['collection', 'parent', 'name'], name='elfinder_dir_coll_parent_name'),
+        ),
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(fields=['tree_id', 'lft', 'rght'], name='elfinder_dir_tree_lft_rght'),
+        ),
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(fields=['collection', 'name'], name='elfinder_dir_coll_name'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['collection', 'parent', 'name'], name='elfinder_file_coll_parent_name'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['collection', 'name'], name='elfinder_file_coll_name'),
+        ),
+    ]
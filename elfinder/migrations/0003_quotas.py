@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:01
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_usage(apps, schema_editor):
+    File = apps.get_model('elfinder', 'File')
+    FileCollection = apps.get_model('elfinder', 'FileCollection')
+    sizes = File.objects.filter(collection=OuterRef('pk')).order_by().values(
+        'collection').annotate(total=Sum('size')).values('total')
+    FileCollection.objects.update(
+        usage=Coalesce(Subquery(sizes, output_field=models.BigIntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elfinder', '0002_indexes_and_file_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VolumeUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('volume_id', models.CharField(max_length=255, unique=True)),
+                ('usage', models.BigIntegerField(default=0)),
+                ('reconciled', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='filecollection',
+            name='quota',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filecollection',
+            name='usage',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_usage, migrations.RunPython.noop),
+    ]
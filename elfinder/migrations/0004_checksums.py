@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:10
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.encoding import force_bytes
+
+
+def fill_checksums(apps, schema_editor):
+    # As elfinder.checksums.checksum_data computed them for this migration.
+    algorithm = getattr(settings, 'ELFINDER_CHECKSUM_ALGORITHM', 'sha256')
+    File = apps.get_model('elfinder', 'File')
+    for file in File.objects.only('content').iterator():
+        hasher = hashlib.new(algorithm)
+        hasher.update(force_bytes(file.content))
+        File.objects.filter(pk=file.pk).update(
+            checksum='%s:%s' % (algorithm, hasher.hexdigest()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elfinder', '0003_quotas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='checksum',
+            field=models.CharField(blank=True, editable=False, max_length=160),
+        ),
+        migrations.RunPython(fill_checksums, migrations.RunPython.noop),
+    ]
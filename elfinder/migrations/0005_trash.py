@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elfinder', '0004_checksums'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='deleted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='deleted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elfinder', '0005_trash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filecollection',
+            name='tree_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elfinder', '0006_tree_version'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='directory',
+            name='elfinder_dir_coll_name',
+        ),
+        migrations.RemoveIndex(
+            model_name='file',
+            name='elfinder_file_coll_name',
+        ),
+    ]
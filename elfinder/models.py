@@ -1,6 +1,16 @@
-from django.db import models
+import threading
+from calendar import timegm
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
 from mptt.models import MPTTModel, TreeForeignKey
 
+from elfinder.checksums import checksum_data
+
 
 class FileCollectionChildMixin(object):
     """ Provides common methods for Files/Directories.
@@ -28,10 +38,22 @@ class Directory(MPTTModel, FileCollectionChildMixin):
                             null=True, blank=True,
                             related_name='dirs')
     collection = models.ForeignKey('FileCollection', on_delete=models.CASCADE)
+    mtime = models.DateTimeField(default=timezone.now, editable=False)
+    # removed to the trash: detached from the tree of the collection until
+    # the trash is purged (see ModelVolumeDriver.remove)
+    deleted = models.BooleanField(default=False, editable=False)
 
     class Meta:
         verbose_name_plural = 'directories'
         unique_together = ('name', 'parent')
+        indexes = [
+            # listings
+            models.Index(fields=['collection', 'parent', 'name'],
+                         name='elfinder_dir_coll_parent_name'),
+            # MPTT ancestor/descendant queries
+            models.Index(fields=['tree_id', 'lft', 'rght'],
+                         name='elfinder_dir_tree_lft_rght'),
+        ]
 
     class MPTTMeta(object):
         order_insertion_by = ['name']
@@ -39,6 +61,10 @@ class Directory(MPTTModel, FileCollectionChildMixin):
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.mtime = timezone.now()
+        super(Directory, self).save(*args, **kwargs)
+
     def get_hash(self):
         return '%s_d%s' % (self.collection.get_volume_id(), self.id)
 
@@ -56,7 +82,9 @@ class Directory(MPTTModel, FileCollectionChildMixin):
                'read': 1,
                'write': 1,
                'size': 0,
-               'dirs': 0 if (self.dirs.count() == 0) else 1
+               'ts': timegm(self.mtime.utctimetuple()),
+               # The tree only holds directories.
+               'dirs': 0 if self.is_leaf_node() else 1
                }
 
         if not self.parent:
@@ -73,6 +101,12 @@ class FileCollection(models.Model):
         # TODO delete files/dirs when deleting file collection
     """
     name = models.CharField(max_length=255, unique=True)
+    # in bytes; None for no quota
+    quota = models.BigIntegerField(null=True, blank=True)
+    # sum of the sizes of the files, maintained by File.save and deletions
+    usage = models.BigIntegerField(default=0, editable=False)
+    # bumped with every change of its directories and files
+    tree_version = models.BigIntegerField(default=0, editable=False)
 
     def __unicode__(self):
         return self.name
@@ -80,6 +114,37 @@ class FileCollection(models.Model):
     def get_volume_id(self):
         return 'fc%s' % self.id
 
+    @classmethod
+    def reconcile_usage(cls, collection_id=None):
+        """ Recomputes the usage of the collections (all of them by
+            default) from the sizes of their files, in one statement.
+        """
+        sizes = File.objects.filter(collection=OuterRef('pk')).order_by().values(
+            'collection').annotate(total=Sum('size')).values('total')
+        collections = cls.objects.all()
+        if collection_id is not None:
+            collections = collections.filter(pk=collection_id)
+        collections.update(usage=Coalesce(Subquery(sizes, output_field=models.BigIntegerField()), 0))
+
+    def get_tree_version(self):
+        """ Returns a token that changes whenever a Directory or File of this
+            collection is saved or deleted. Used to build ETags for listings.
+            It is read from the database, so all the processes agree on it.
+        """
+        return '%d' % type(self).objects.filter(pk=self.pk).values_list(
+            'tree_version', flat=True).get()
+
+    @classmethod
+    def touch_tree_version(cls, collection_id):
+        """ Bumps the tree version, in the transaction of the change (once
+            for a batch_usage block).
+        """
+        touched = getattr(_usage_batches, 'touched', None)
+        if touched is not None:
+            touched.add(collection_id)
+        else:
+            cls.objects.filter(pk=collection_id).update(tree_version=F('tree_version') + 1)
+
 
 class File(models.Model, FileCollectionChildMixin):
     """ A File in a FileCollection.
@@ -89,13 +154,43 @@ class File(models.Model, FileCollectionChildMixin):
                             null=True, blank=True, related_name='files')
     content = models.TextField(max_length=2048, blank=True)
     collection = models.ForeignKey('FileCollection', on_delete=models.CASCADE)
+    # len(content), so that listings don't need to load the contents
+    size = models.PositiveIntegerField(default=0, editable=False)
+    mtime = models.DateTimeField(default=timezone.now, editable=False)
+    # checksum of the content (see elfinder.checksums)
+    checksum = models.CharField(max_length=160, blank=True, editable=False)
+    # removed to the trash (see Directory.deleted)
+    deleted = models.BooleanField(default=False, editable=False)
 
     class Meta:
         unique_together = ('name', 'parent')
+        indexes = [
+            models.Index(fields=['collection', 'parent', 'name'],
+                         name='elfinder_file_coll_parent_name'),
+        ]
 
     def __unicode__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(File, cls).from_db(db, field_names, values)
+        # what the row counts in the usage of the collection
+        instance._stored = (instance.pk, instance.collection_id, instance.size)
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.size = len(self.content)
+        self.checksum = checksum_data(self.content)
+        self.mtime = timezone.now()
+        stored_pk, stored_collection_id, stored_size = getattr(self, '_stored', (None, None, 0))
+        with transaction.atomic():
+            super(File, self).save(*args, **kwargs)
+            if stored_pk is not None and stored_pk == self.pk:
+                add_usage(stored_collection_id, -stored_size)
+            add_usage(self.collection_id, self.size)
+        self._stored = (self.pk, self.collection_id, self.size)
+
     def get_hash(self):
         return '%s_f%s' % (self.collection.get_volume_id(), self.id)
 
@@ -103,11 +198,82 @@ class File(models.Model, FileCollectionChildMixin):
         """ Returns an object to represent this object in elFinder. Populates
             'cwd' in response to 'open' command.
         """
-        return {'name': self.name,
+        info = {'name': self.name,
                 'hash': self.get_hash(),
                 'phash': self.get_parent_hash(),
                 'mime': 'text/plain',
-                'size': len(self.content),
+                'size': self.size,
+                'ts': timegm(self.mtime.utctimetuple()),
                 'read': True,
                 'write': True,
                 'rm': True}
+        if self.checksum:
+            info['checksum'] = self.checksum
+        return info
+
+
+class VolumeUsage(models.Model):
+    """ Bytes used by a volume with a quota that is not a FileCollection
+        (e.g. a filesystem volume), by volume id.
+    """
+    volume_id = models.CharField(max_length=255, unique=True)
+    usage = models.BigIntegerField(default=0)
+    reconciled = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return self.volume_id
+
+
+_usage_batches = threading.local()
+
+
+@contextmanager
+def batch_usage():
+    """ Sums the usage changes of the enclosed block, which should run in
+        a transaction, and applies them, with the tree version bumps, with
+        one update per collection at its end (e.g. for the files deleted
+        with a directory).
+    """
+    outer = getattr(_usage_batches, 'deltas', None)
+    if outer is None:
+        _usage_batches.deltas = deltas = {}
+        _usage_batches.touched = touched = set()
+    try:
+        yield
+    finally:
+        if outer is None:
+            _usage_batches.deltas = _usage_batches.touched = None
+    if outer is None:
+        for collection_id in set(deltas) | touched:
+            changes = {}
+            if deltas.get(collection_id):
+                changes['usage'] = F('usage') + deltas[collection_id]
+            if collection_id in touched:
+                changes['tree_version'] = F('tree_version') + 1
+            if changes:
+                FileCollection.objects.filter(pk=collection_id).update(**changes)
+
+
+def add_usage(collection_id, delta):
+    """ Adds delta bytes to the usage of the collection. """
+    if not delta or collection_id is None:
+        return
+    deltas = getattr(_usage_batches, 'deltas', None)
+    if deltas is not None:
+        deltas[collection_id] = deltas.get(collection_id, 0) + delta
+    else:
+        FileCollection.objects.filter(pk=collection_id).update(usage=F('usage') + delta)
+
+
+def _touch_collection_tree_version(sender, instance, **kwargs):
+    FileCollection.touch_tree_version(instance.collection_id)
+
+
+def _release_file_usage(sender, instance, **kwargs):
+    add_usage(instance.collection_id, -instance.size)
+
+
+for _model in (Directory, File):
+    post_save.connect(_touch_collection_tree_version, sender=_model)
+    post_delete.connect(_touch_collection_tree_version, sender=_model)
+post_delete.connect(_release_file_usage, sender=File)
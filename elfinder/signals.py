@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+from django.dispatch import Signal
+
+# Sent by ElFinderConnector after every command.
+# Arguments: connector, metrics (elfinder.instrumentation.CommandMetrics)
+command_executed = Signal()
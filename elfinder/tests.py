@@ -1,8 +1,30 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.datastructures import MultiValueDict
+from django.utils.six import StringIO
 from django.core.urlresolvers import reverse
+from elfinder.cancellation import Aborted
+from elfinder.conf import settings as elfinder_settings
+from elfinder.connector import ElFinderConnector
 from elfinder.models import FileCollection, Directory, File
+from elfinder.throttling import get_throttle
+from elfinder.uploads import UploadLimitHandler
+from elfinder.volume_drivers import fs_driver
+from elfinder.volume_drivers.base import QuotaExceeded
+from elfinder.volume_drivers.fs_driver import FileSystemVolumeDriver, PathIndex, VolumeCache
+from elfinder.volume_drivers.fs_mime import MimeResolver
+from elfinder.volume_drivers.fs_watch import ChangeJournal
 from elfinder.volume_drivers.model_driver import ModelVolumeDriver
+import collections
+import hashlib
+import os
 import tempfile
+import threading
 import shutil
 import json
 import logging
@@ -189,6 +211,17 @@ class elFinderParentsCmd(elFinderCmdTest):
                 'target': 'fc1_d1'}
         response = self.get_json_response(vars)
 
+    def test_same_as_tree(self):
+        volume = ModelVolumeDriver(1)
+        for directory in Directory.objects.filter(collection_id=1):
+            tree = volume.get_tree(directory.get_hash(), ancestors=True, siblings=True)
+            expected = dict((info['hash'], info) for info in tree
+                            if info['mime'] == 'directory' and
+                            info['phash'] != directory.get_hash())
+            self.assertEqual(dict((info['hash'], info)
+                                  for info in volume.get_parents(directory.get_hash())),
+                             expected)
+
 
 class elFinderTreeCmd(elFinderCmdTest):
     def test_valid_tree(self):
@@ -314,7 +347,103 @@ class elFinderUploadCmd(elFinderCmdTest):
         fh.close()
         self.assertEqual(response.json['error'],
                          'File with this Name and Parent already exists.')
-        
+
+
+class elFinderUploadLimits(elFinderCmdTest):
+    def setUp(self):
+        super(elFinderUploadLimits, self).setUp()
+        self.volumes = elfinder_settings.ELFINDER_VOLUME_DRIVERS
+        elfinder_settings.ELFINDER_VOLUME_DRIVERS = {
+            'default': {'BACKEND': 'elfinder.volume_drivers.model_driver.ModelVolumeDriver',
+                        'OPTIONS': {'upload_max_size': '1K', 'upload_allow': ['image']}}}
+
+    def tearDown(self):
+        elfinder_settings.ELFINDER_VOLUME_DRIVERS = self.volumes
+
+    def upload(self, files, url_volume=True, **variables):
+        url = reverse('elfinder_connector', args=[self.collection.id])
+        if url_volume:
+            url += '?volume=default'
+        variables.update({'cmd': 'upload', 'target': 'fc1_d4', 'upload[]': files})
+        response = self.client.post(url, variables)
+        return json.loads(response.content)
+
+    def get_file(self, name, size):
+        upload = StringIO(u'x' * size)
+        upload.name = name
+        return upload
+
+    def test_max_size(self):
+        for url_volume in (True, False):
+            response = self.upload([self.get_file('big.png', 1025)], url_volume)
+            self.assertEqual(response['error'], ['errUploadFile', 'big.png', 'errUploadFileSize'])
+        self.assertFalse(File.objects.filter(name='big.png').exists())
+        self.assertEqual(self.volume.get_options()['uplMaxSize'], '128M')
+
+    def test_mime(self):
+        for url_volume in (True, False):
+            response = self.upload([self.get_file('notes.txt', 10), self.get_file('dot.png', 10)],
+                                   url_volume)
+            self.assertEqual([info['name'] for info in response['added']], ['dot.png'])
+            self.assertEqual(response['warning'], ['errUploadFile', 'notes.txt', 'errUploadMime'])
+            File.objects.filter(name='dot.png').delete()
+        response = self.upload([self.get_file('dot.png', 10)], url_volume=False,
+                               **{'mimes[]': ['image/gif']})
+        self.assertEqual(response['error'], ['errUploadFile', 'dot.png', 'errUploadMime'])
+
+    def test_query_string_names_only_uploads(self):
+        from elfinder.views import VolumeDriver
+        request = RequestFactory().post('/?volume=other', 'cmd=open&volume=default',
+                                        content_type='application/x-www-form-urlencoded')
+        self.assertEqual(VolumeDriver(request).name, 'default')
+        request = RequestFactory().post('/?volume=other', {'cmd': 'upload', 'volume': 'default',
+                                                           'upload[]': self.get_file('a.png', 1)})
+        self.assertEqual(VolumeDriver(request).name, 'other')
+
+    def test_access_checked_before_upload_handler(self):
+        from django.contrib.auth.models import AnonymousUser
+        from elfinder.views import connector_view
+        elfinder_settings.ELFINDER_VOLUME_DRIVERS['default']['OPTIONS']['login_required'] = True
+        request = RequestFactory().post('/?volume=default', {
+            'cmd': 'upload', 'target': 'fc1_d4', 'upload[]': self.get_file('dot.png', 10)})
+        request.user = AnonymousUser()
+        response = connector_view(request, self.collection.id)
+        self.assertEqual(json.loads(response.content), {'error': 'Login required!'})
+        self.assertEqual([handler for handler in request.upload_handlers
+                          if isinstance(handler, UploadLimitHandler)], [])
+
+    def test_free_space(self):
+        volume = ModelVolumeDriver(1, upload_max_size=0)
+        volume.get_free_space = lambda: 15
+        handler = UploadLimitHandler(volume)
+        handler.new_file('upload[]', 'a.png', 'image/png', None)
+        self.assertEqual(handler.receive_data_chunk(b'x' * 10, 0), b'x' * 10)
+        handler.new_file('upload[]', 'b.png', 'image/png', None)
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(b'x' * 10, 0)
+        self.assertEqual(handler.errors, ['errUploadFile', 'b.png', 'errUploadTotalSize'])
+
+
+class elFinderDuplicateCmd(elFinderCmdTest):
+    def test_duplicate_file(self):
+        vars = {'cmd': 'duplicate',
+                'targets[]': ['fc1_f2']}
+        response = self.get_json_response(vars)
+        self.assertEqual(response.json['added'][0]['name'], 'A Christmas Carol copy 1')
+        response = self.get_json_response(vars)
+        self.assertEqual(response.json['added'][0]['name'], 'A Christmas Carol copy 2')
+
+    def test_duplicate_dir(self):
+        vars = {'cmd': 'duplicate',
+                'targets[]': ['fc1_d2']}
+        response = self.get_json_response(vars)
+        added = response.json['added'][0]
+        self.assertEqual(added['name'], 'D copy 1')
+        copy = Directory.objects.get(pk=int(added['hash'].split('_d')[1]))
+        self.assertEqual(sorted(d.name for d in copy.get_descendants()),
+                         ['Dickens, Charles', 'Doyle, Arthur Conan'])
+        self.assertEqual(File.objects.filter(parent__in=copy.get_descendants()).count(), 3)
+
 
 class elFinderFileCmd(elFinderCmdTest):
     def setUp(self):
@@ -342,3 +471,1305 @@ class elFinderFileCmd(elFinderCmdTest):
             response = self.get_json_response(vars, fail_on_error=False)
             expected_error = 'Invalid target hash: '
             self.assertTrue(response.json['error'].startswith(expected_error))
+
+class elFinderConditionalResponse(elFinderCmdTest):
+    def test_not_modified(self):
+        vars = {'cmd': 'open',
+                'target': 'fc1_d2'}
+        response = self.get_command_response(vars)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.post(reverse('elfinder_connector',
+                                            args=[self.collection.id]),
+                                    vars, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_modified_after_write(self):
+        vars = {'cmd': 'ls',
+                'target': 'fc1_d1'}
+        etag = self.get_command_response(vars)['ETag']
+        self.get_json_response({'cmd': 'mkdir',
+                                'target': 'fc1_d1',
+                                'name': 'etag dir'})
+        response = self.client.post(reverse('elfinder_connector',
+                                            args=[self.collection.id]),
+                                    vars, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_modified_by_other_process(self):
+        vars = {'cmd': 'ls',
+                'target': 'fc1_d1'}
+        etag = self.get_command_response(vars)['ETag']
+        # the version lives in the database, not in a per-process cache
+        cache.clear()
+        self.assertEqual(self.client.post(reverse('elfinder_connector',
+                                                  args=[self.collection.id]),
+                                          vars, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        FileCollection.touch_tree_version(self.collection.id)
+        response = self.client.post(reverse('elfinder_connector',
+                                            args=[self.collection.id]),
+                                    vars, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class elFinderFileSystemVersion(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'sub'))
+        with open(os.path.join(self.tmp_dir, 'file'), 'wb') as fp:
+            fp.write(b'x')
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_changes_below_the_listing(self):
+        version = self.volume.get_version('', ancestors=True)
+        self.assertEqual(self.volume.get_version('', ancestors=True), version)
+        # a subdirectory gains an entry: its 'dirs' flag changes
+        os.mkdir(os.path.join(self.tmp_dir, 'sub', 'child'))
+        self.assertNotEqual(self.volume.get_version('', ancestors=True), version)
+        version = self.volume.get_version('', ancestors=True)
+        # a file is edited in place
+        with open(os.path.join(self.tmp_dir, 'file'), 'ab') as fp:
+            fp.write(b'y')
+        self.assertNotEqual(self.volume.get_version('', ancestors=True), version)
+
+
+class elFinderInstrumentation(elFinderCmdTest):
+    def test_record_from_threads(self):
+        from elfinder.instrumentation import CommandMetrics
+        metrics = CommandMetrics('size')
+
+        def record():
+            for index in range(1000):
+                metrics.record('fs_scanned')
+        threads = [threading.Thread(target=record) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.counters['fs_scanned'], 4000)
+
+    def test_command_executed_signal(self):
+        from elfinder.signals import command_executed
+        received = []
+
+        def receiver(sender, metrics, **kwargs):
+            received.append(metrics)
+
+        command_executed.connect(receiver)
+        try:
+            self.get_json_response({'cmd': 'ls',
+                                    'target': 'fc1_d1'})
+        finally:
+            command_executed.disconnect(receiver)
+        self.assertEqual(len(received), 1)
+        metrics = received[0]
+        self.assertEqual(metrics.command, 'ls')
+        self.assertFalse(metrics.error)
+        self.assertEqual(metrics.counters['entries'], 2)
+        self.assertTrue(metrics.counters['queries'] > 0)
+
+
+class SyscallCounter(object):
+    """ Counts the calls made to the os functions that hit the filesystem
+        (pathlib goes through them too) while the context is active.
+    """
+    functions = ('stat', 'lstat', 'access', 'listdir', 'scandir',
+                 'rename', 'mkdir', 'rmdir', 'unlink', 'remove')
+
+    def __enter__(self):
+        self.calls = collections.Counter()
+        self.originals = {}
+        for name in self.functions:
+            original = getattr(os, name)
+            self.originals[name] = original
+            setattr(os, name, self._wrap(name, original))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, original in self.originals.items():
+            setattr(os, name, original)
+
+    def _wrap(self, name, original):
+        def wrapper(*args, **kwargs):
+            self.calls[name] += 1
+            return original(*args, **kwargs)
+        return wrapper
+
+    @property
+    def count(self):
+        return sum(self.calls.values())
+
+
+class elFinderCommandCostTest(TestCase):
+    """ Base class for asserting upper bounds on the DB queries and
+        filesystem calls of connector commands as directories grow.
+
+        Each test measures a command for every size in `sizes` and checks
+        the growth per entry, so N+1 patterns fail the test.
+    """
+    sizes = (5, 50)
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.factory = RequestFactory()
+
+    def run_command(self, volume, **params):
+        connector = ElFinderConnector([volume])
+        connector.run(self.factory.get('/', params))
+        self.assertFalse('error' in connector.response,
+                         'Connector returned an error: %s' % connector.response.get('error'))
+        return connector.response
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(context.captured_queries)
+
+    def count_syscalls(self, func):
+        with SyscallCounter() as counter:
+            func()
+        return counter.count
+
+    def assertCostPerEntry(self, costs, max_per_entry):
+        """ costs maps each size to the measured cost. """
+        small, large = min(costs), max(costs)
+        growth = (costs[large] - costs[small]) / float(large - small)
+        self.assertTrue(growth <= max_per_entry,
+                        'Cost grows by %.2f per entry (max %s): %s' % (growth, max_per_entry, costs))
+
+
+class elFinderModelQueryCount(elFinderCommandCostTest):
+    def build_dir(self, size):
+        """ Creates a collection whose root holds `size` directories and
+            `size` files. Returns the volume and the root hash.
+        """
+        collection = FileCollection.objects.create(name='cost %d' % size)
+        root = Directory.objects.create(name='root', collection=collection)
+        for index in range(size):
+            Directory.objects.create(name='dir %d' % index, parent=root,
+                                     collection=collection)
+            File.objects.create(name='file %d' % index, parent=root,
+                                collection=collection)
+        volume = ModelVolumeDriver(collection.id)
+        return volume, volume.get_info('')['hash']
+
+    def build_path(self, depth):
+        """ Creates a collection with a path `depth` directories deep.
+            Returns the volume and the hash of the deepest directory.
+        """
+        collection = FileCollection.objects.create(name='depth %d' % depth)
+        parent = Directory.objects.create(name='root', collection=collection)
+        for index in range(depth):
+            parent = Directory.objects.create(name='dir %d' % index, parent=parent,
+                                              collection=collection)
+        return ModelVolumeDriver(collection.id), parent.get_hash()
+
+    def measure(self, build, **params):
+        costs = {}
+        for size in self.sizes:
+            volume, target = build(size)
+            costs[size] = self.count_queries(
+                lambda: self.run_command(volume, target=target, **params))
+        return costs
+
+    def test_open(self):
+        costs = self.measure(self.build_dir, cmd='open')
+        self.assertCostPerEntry(costs, 0)
+
+    def test_ls(self):
+        costs = self.measure(self.build_dir, cmd='ls')
+        self.assertCostPerEntry(costs, 0)
+
+    def test_parents(self):
+        costs = self.measure(self.build_path, cmd='parents')
+        self.assertCostPerEntry(costs, 0)
+
+    def test_subdirectory(self):
+        volume, root = self.build_dir(1)
+        target = Directory.objects.get(name='dir 0', collection=volume.collection_id).get_hash()
+        # the root and the collection are cached: no query resolves them
+        self.run_command(ModelVolumeDriver(volume.collection_id), cmd='open', target=target)
+        for cmd, queries in (('open', 4), ('ls', 3)):
+            volume = ModelVolumeDriver(volume.collection_id)
+            self.assertEqual(self.count_queries(
+                lambda: self.run_command(volume, cmd=cmd, target=target)), queries)
+
+    def test_collection_cache(self):
+        volume, root = self.build_dir(1)
+        volume.get_info('')
+        volume = ModelVolumeDriver(volume.collection_id)
+        self.assertEqual(self.count_queries(volume.get_volume_id), 0)
+        self.assertEqual(self.count_queries(lambda: volume.get_info('')), 1)
+        self.assertEqual(self.count_queries(lambda: volume.get_object('')), 0)
+
+        FileCollection.objects.filter(pk=volume.collection_id).get().save()
+        volume = ModelVolumeDriver(volume.collection_id)
+        self.assertEqual(self.count_queries(lambda: volume.collection), 1)
+
+    def test_collection_saved_by_other_process(self):
+        from elfinder.volume_drivers import model_driver
+        volume, root = self.build_dir(1)
+        self.assertEqual(volume.collection.name, 'cost 1')
+        FileCollection.objects.filter(pk=volume.collection_id).update(name='Renamed')
+        # another process saved it: the stamp changed, the signal did not run here
+        model_driver.shared_cache.set(model_driver._get_collection_stamp_key(
+            FileCollection, volume.collection_id), 'other', None)
+        volume = ModelVolumeDriver(volume.collection_id)
+        self.assertEqual(volume.collection.name, 'Renamed')
+
+
+class elFinderFileSystemSyscallCount(elFinderCommandCostTest):
+    def setUp(self):
+        super(elFinderFileSystemSyscallCount, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build_dir(self, size):
+        """ Creates a volume whose 'target' directory holds `size` files and
+            `size` directories. Returns the volume and the target path.
+        """
+        root = os.path.join(self.tmp_dir, 'wide %d' % size)
+        target = os.path.join(root, 'target')
+        os.makedirs(target)
+        for index in range(size):
+            os.mkdir(os.path.join(target, 'dir %d' % index))
+            open(os.path.join(target, 'file %d' % index), 'w').close()
+        return FileSystemVolumeDriver(fs_driver_root=root), target
+
+    def build_unrelated(self, size):
+        """ Creates a volume with `size` directories next to 'target', which
+            holds a single file. Returns the volume and the file path.
+        """
+        root = os.path.join(self.tmp_dir, 'unrelated %d' % size)
+        os.makedirs(os.path.join(root, 'target'))
+        for index in range(size):
+            os.makedirs(os.path.join(root, 'other %d' % index, 'child'))
+        path = os.path.join(root, 'target', 'file')
+        open(path, 'w').close()
+        return FileSystemVolumeDriver(fs_driver_root=root), path
+
+    def measure(self, build, **params):
+        costs = {}
+        for size in self.sizes:
+            volume, path = build(size)
+            target = volume._get_path_object(volume.root.joinpath(path)).get_hash()
+            costs[size] = self.count_syscalls(
+                lambda: self.run_command(volume, target=target, **params))
+        return costs
+
+    def test_open(self):
+        costs = self.measure(self.build_dir, cmd='open')
+        self.assertCostPerEntry(costs, 40)
+
+    def test_ls(self):
+        costs = self.measure(self.build_dir, cmd='ls')
+        self.assertCostPerEntry(costs, 40)
+
+    def build_parents(self, size):
+        """ Creates a volume where each ancestor of 'target' holds `size`
+            files and `size` directories. Returns the volume and the target
+            path.
+        """
+        root = os.path.join(self.tmp_dir, 'parents %d' % size)
+        target = root
+        for level in range(3):
+            target = os.path.join(target, 'level %d' % level)
+            os.makedirs(target)
+            for index in range(size):
+                os.mkdir(os.path.join(target, 'dir %d' % index))
+                open(os.path.join(target, 'file %d' % index), 'w').close()
+        return FileSystemVolumeDriver(fs_driver_root=root), target
+
+    def test_parents(self):
+        """ Parents lists the directories along the path, not the files. """
+        costs = {}
+        for size in self.sizes:
+            volume, path = self.build_parents(size)
+            # resolving the target is measured by test_target_resolution
+            target = volume._get_path_info(volume.root.joinpath(path))['hash']
+            costs[size] = self.count_syscalls(
+                lambda: self.run_command(volume, cmd='parents', target=target))
+        # two levels of sibling directories are listed
+        self.assertCostPerEntry(costs, 2 * 20)
+
+    def test_target_resolution(self):
+        """ Resolving a hash must not walk unrelated parts of the volume.
+            Fails while _find_path walks the volume for the hashes missing
+            from the index.
+        """
+        costs = self.measure(self.build_unrelated, cmd='ls')
+        self.assertCostPerEntry(costs, 0)
+
+
+class elFinderAsyncVolumeDriver(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp_dir, 'file.txt'), 'wb') as fh:
+            fh.write(b'x' * 100000)
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir)
+        self.target = self.volume._get_path_object(
+            self.volume.root.joinpath('file.txt')).get_hash()
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_method(self):
+        from elfinder.volume_drivers.async_driver import AsyncVolumeDriver
+        volume = AsyncVolumeDriver(self.volume)
+        info = self.run_async(volume.get_info(self.target))
+        self.assertEqual(info['name'], 'file.txt')
+
+    def test_read_chunks(self):
+        from elfinder.volume_drivers.async_driver import AsyncVolumeDriver
+        chunks = AsyncVolumeDriver(self.volume).read_chunks(self.target)
+        size = 0
+        while True:
+            try:
+                size += len(self.run_async(chunks.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(size, 100000)
+
+
+class elFinderFileSystemStatFanOut(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'dir'))
+        for index in range(20):
+            with open(os.path.join(self.tmp_dir, 'dir', 'file %d' % index), 'w') as fh:
+                fh.write('x' * index)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_volume(self, workers):
+        return FileSystemVolumeDriver(fs_driver_root=self.tmp_dir,
+                                      stat_workers=workers,
+                                      volume_driver_name='fan-out test')
+
+    def test_same_results(self):
+        sequential, concurrent = self.get_volume(0), self.get_volume(4)
+        target = sequential.get_info('')['hash']
+        self.assertEqual(sequential.get_tree(target), concurrent.get_tree(target))
+        self.assertEqual(sequential.search('file', target), concurrent.search('file', target))
+        self.assertEqual(sequential.size([target]), concurrent.size([target]))
+
+    def test_size(self):
+        volume = self.get_volume(4)
+        size = volume.size([volume.get_info('')['hash']])
+        self.assertEqual(size['size'], sum(range(20)))
+        self.assertEqual(size['fileCnt'], 20)
+        self.assertEqual(size['dirCnt'], 2)
+
+
+class elFinderMultiVolumeTest(TestCase):
+    """ Base class for tests running the connector over two fs volumes. """
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.volumes = {}
+        index = 0
+        # fs volume ids are derived from the root path, so pick two roots
+        # whose ids differ.
+        while len(self.volumes) < 2:
+            root = os.path.join(self.tmp_dir, 'volume %d' % index)
+            os.makedirs(os.path.join(root, 'child'))
+            volume = FileSystemVolumeDriver(fs_driver_root=root)
+            self.volumes.setdefault(volume.get_volume_id(), volume)
+            index += 1
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_command(self, **params):
+        connector = ElFinderConnector(list(self.volumes.values()))
+        connector.run(RequestFactory().get('/', params))
+        return connector.response
+
+
+class elFinderMultiVolumeOpen(elFinderMultiVolumeTest):
+    def test_open_all_roots(self):
+        connector = ElFinderConnector(list(self.volumes.values()))
+        connector.run(RequestFactory().get('/', {'cmd': 'open', 'target': ''}))
+        self.assertFalse('error' in connector.response)
+        files = connector.response['files']
+        roots = [info for info in files if info['phash'] == '']
+        self.assertEqual(len(roots), 2)
+        self.assertEqual(len([info for info in files if info['name'] == 'child']), 2)
+        self.assertEqual(len(files), len(set(info['hash'] for info in files)))
+        self.assertEqual(connector.response['cwd'], roots[0])
+
+    def test_unknown_volume(self):
+        connector = ElFinderConnector(list(self.volumes.values()))
+        connector.run(RequestFactory().get('/', {'cmd': 'ls', 'target': 'zz_d1'}))
+        self.assertEqual(connector.response['error'], 'Invalid target hash: zz_d1')
+
+
+class elFinderCrossVolumePaste(elFinderMultiVolumeTest):
+    def setUp(self):
+        super(elFinderCrossVolumePaste, self).setUp()
+        self.source, self.dest = list(self.volumes.values())
+        child = self.source.root.joinpath('child')
+        child.joinpath('sub').mkdir()
+        child.joinpath('a.txt').write_bytes(b'a' * 1000)
+        child.joinpath('sub', 'b.txt').write_bytes(b'b' * 10)
+        self.target = self.source._get_path_object(child).get_hash()
+        self.dest_root = self.dest.get_info('')['hash']
+        # Both volumes have a 'child' directory.
+        shutil.rmtree(str(self.dest.root.joinpath('child')))
+
+    def paste(self, cut):
+        return self.run_command(**{'cmd': 'paste', 'targets[]': [self.target],
+                                   'dst': self.dest_root, 'cut': cut, 'suffix': '~'})
+
+    def test_copy(self):
+        response = self.paste('0')
+        self.assertFalse('error' in response or 'warning' in response, response)
+        self.assertEqual([info['name'] for info in response['added']], ['child'])
+        self.assertEqual(response['removed'], [])
+        copied = self.dest.root.joinpath('child')
+        self.assertEqual(copied.joinpath('a.txt').read_bytes(), b'a' * 1000)
+        self.assertEqual(copied.joinpath('sub', 'b.txt').read_bytes(), b'b' * 10)
+        self.assertTrue(self.source.root.joinpath('child', 'a.txt').exists())
+
+    def test_move(self):
+        response = self.paste('1')
+        self.assertEqual(response['removed'], [self.target])
+        self.assertFalse(self.source.root.joinpath('child').exists())
+        self.assertTrue(self.dest.root.joinpath('child', 'sub', 'b.txt').exists())
+
+    def test_merge_into_existing_directory(self):
+        self.dest.root.joinpath('child', 'sub').mkdir(parents=True)
+        self.dest.root.joinpath('child', 'old.txt').write_bytes(b'old')
+        listed = []
+        get_tree = self.dest.get_tree
+        self.dest.get_tree = lambda target, **kwargs: listed.append(target) or get_tree(target)
+        response = self.paste('0')
+        self.assertFalse('error' in response or 'warning' in response, response)
+        # the destination, 'child' and 'child/sub', each listed once
+        self.assertEqual(len(listed), 3)
+        self.assertEqual(len(set(listed)), 3)
+        copied = self.dest.root.joinpath('child')
+        self.assertEqual(copied.joinpath('old.txt').read_bytes(), b'old')
+        self.assertEqual(copied.joinpath('sub', 'b.txt').read_bytes(), b'b' * 10)
+
+    def test_invalid_names_are_refused(self):
+        from elfinder.volume_drivers.base import check_name
+        for name in ('', '.', '..', 'a/b', 'a\\b'):
+            self.assertRaises(Exception, check_name, name)
+        self.assertRaises(Exception, self.dest.write_chunks, '..', self.dest_root, [b'x'])
+
+
+class elFinderFileSystemCopy(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        for index, path in enumerate(['a.txt', 'b.bin', os.path.join('sub', 'c.txt')]):
+            path = os.path.join(self.src, path)
+            with open(path, 'wb') as fh:
+                fh.write(os.urandom(1000 * index))
+            os.utime(path, (1000000000, 1000000000 + index))
+        os.symlink('a.txt', os.path.join(self.src, 'link'))
+        os.utime(os.path.join(self.src, 'sub'), (1000000000, 1000000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertSameFile(self, src, dst):
+        with open(src, 'rb') as fsrc, open(dst, 'rb') as fdst:
+            self.assertEqual(fsrc.read(), fdst.read())
+        self.assertEqual(os.stat(src).st_mtime, os.stat(dst).st_mtime)
+
+    def test_copy_file(self):
+        from elfinder.volume_drivers.fs_copy import copy_file
+        dst = os.path.join(self.tmp_dir, 'copy.bin')
+        copy_file(os.path.join(self.src, 'b.bin'), dst)
+        self.assertSameFile(os.path.join(self.src, 'b.bin'), dst)
+
+    def test_short_copy_falls_back(self):
+        from elfinder.volume_drivers import fs_copy
+
+        def short_copy(fsrc, fdst, size):
+            fdst.write(fsrc.read(size // 2))
+            return size // 2
+
+        kernel_methods = fs_copy._kernel_methods
+        fs_copy._kernel_methods = lambda: [('short', short_copy)]
+        try:
+            dst = os.path.join(self.tmp_dir, 'copy.bin')
+            fs_copy.copy_file(os.path.join(self.src, 'b.bin'), dst)
+        finally:
+            fs_copy._kernel_methods = kernel_methods
+        self.assertSameFile(os.path.join(self.src, 'b.bin'), dst)
+
+    def test_copy_tree(self):
+        from elfinder.volume_drivers.fs_copy import copy_tree
+        dst = os.path.join(self.tmp_dir, 'dst')
+        copy_tree(self.src, dst, workers=4)
+        for path in ['a.txt', 'b.bin', os.path.join('sub', 'c.txt')]:
+            self.assertSameFile(os.path.join(self.src, path), os.path.join(dst, path))
+        self.assertEqual(os.readlink(os.path.join(dst, 'link')), 'a.txt')
+        self.assertEqual(os.stat(os.path.join(dst, 'sub')).st_mtime, 1000000000)
+
+
+class elFinderFileSystemDuplicate(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'dir.name'))
+        for name in ['file.txt', 'file copy 1.txt', os.path.join('dir.name', 'child')]:
+            open(os.path.join(self.tmp_dir, name), 'w').close()
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_hash(self, name):
+        return self.volume._get_path_object(self.volume.root.joinpath(name)).get_hash()
+
+    def test_duplicate(self):
+        added = self.volume.duplicate([self.get_hash('file.txt'),
+                                       self.get_hash('file.txt'),
+                                       self.get_hash('dir.name')])['added']
+        self.assertEqual([info['name'] for info in added],
+                         ['file copy 2.txt', 'file copy 3.txt', 'dir.name copy 1'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'dir.name copy 1', 'child')))
+
+
+class elFinderFileSystemEdit(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.tmp_dir, name), 'wb') as fp:
+            fp.write(data)
+        return self.volume._get_path_object(self.volume.root.joinpath(name)).get_hash()
+
+    def test_get_utf8(self):
+        target = self.write('utf8.txt', u'caf\xe9\n'.encode('utf-8'))
+        self.assertEqual(self.volume.get(target), {'content': u'caf\xe9\n'})
+
+    def test_get_large_file(self):
+        content = u'файл\n' * (1024 * 1024 // 8)
+        target = self.write('large.txt', content.encode('utf-8'))
+        self.assertEqual(self.volume.get(target)['content'], content)
+
+    def test_get_with_encoding(self):
+        target = self.write('latin1.txt', u'caf\xe9\n'.encode('latin-1'))
+        self.assertEqual(self.volume.get(target, conv='latin-1'),
+                         {'content': u'caf\xe9\n', 'encoding': 'latin-1'})
+
+    def test_get_too_large(self):
+        target = self.write('big.txt', b'x' * 11)
+        self.volume.kwargs['edit_max_size'] = 10
+        self.assertRaises(Exception, self.volume.get, target)
+
+    def test_putfile(self):
+        target = self.write('file.txt', b'old')
+        os.chmod(os.path.join(self.tmp_dir, 'file.txt'), 0o640)
+        info = self.volume.putfile(target, u'caf\xe9')
+        self.assertEqual(info['size'], 5)
+        with open(os.path.join(self.tmp_dir, 'file.txt'), 'rb') as fp:
+            self.assertEqual(fp.read(), u'caf\xe9'.encode('utf-8'))
+        self.assertEqual(os.stat(os.path.join(self.tmp_dir, 'file.txt')).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.tmp_dir), ['file.txt'])
+
+    def test_putfile_data_uri(self):
+        target = self.write('image.png', b'')
+        self.volume.putfile(target, 'data:image/png;base64,AAEC', encoding='scheme')
+        with open(os.path.join(self.tmp_dir, 'image.png'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'\x00\x01\x02')
+
+    def test_putfile_text_starting_with_data(self):
+        target = self.write('config.yml', b'')
+        self.volume.putfile(target, u'data: 1\n')
+        with open(os.path.join(self.tmp_dir, 'config.yml'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'data: 1\n')
+
+
+class elFinderNameDecoding(TestCase):
+    def setUp(self):
+        self.detected = []
+        self.detect_encoding = fs_driver.detect_encoding
+
+        def detect_encoding(value):
+            self.detected.append(value)
+            return 'cp1251'
+        fs_driver.detect_encoding = detect_encoding
+        fs_driver._name_encodings.clear()
+
+    def tearDown(self):
+        fs_driver.detect_encoding = self.detect_encoding
+        fs_driver._name_encodings.clear()
+
+    def test_utf8_is_not_detected(self):
+        decode = fs_driver.WrapperBase.bytes_safe_decode
+        self.assertEqual(decode(u'файл'.encode('utf-8'), directory='/tmp'), u'файл')
+        self.assertEqual(decode(u'file', directory='/tmp'), u'file')
+        self.assertEqual(self.detected, [])
+
+    def test_detected_encoding_is_memoised(self):
+        decode = fs_driver.WrapperBase.bytes_safe_decode
+        self.assertEqual(decode(u'файл'.encode('cp1251'), directory='/tmp'), u'файл')
+        self.assertEqual(decode(u'папка'.encode('cp1251'), directory='/tmp'), u'папка')
+        self.assertEqual(len(self.detected), 1)
+
+
+class elFinderMimeResolver(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def test_extension(self):
+        resolver = MimeResolver({'md': 'text/markdown'})
+        self.assertEqual(resolver.guess('/x/README.MD'), 'text/markdown')
+        self.assertEqual(resolver.guess('/x/image.png'), 'image/png')
+        self.assertEqual(resolver.guess('/x/archive.tar.gz'), 'application/x-tar')
+        self.assertEqual(resolver.guess('/x/Makefile'), None)
+
+    def test_sniff(self):
+        resolver = MimeResolver(sniff=True)
+        self.assertEqual(resolver.guess(self.write('image', b'\x89PNG\r\n\x1a\n...')), 'image/png')
+        self.assertEqual(resolver.guess(self.write('Makefile', b'all:\n\ttrue\n')), 'text/plain')
+        self.assertEqual(resolver.guess(self.write('page', b'\n<!DOCTYPE html>')), 'text/html')
+        self.assertEqual(resolver.guess(self.write('empty', b'')), None)
+        self.assertEqual(resolver.guess(self.write('notes.txt', b'\x89PNG')), 'text/plain')
+
+    def test_sniff_cache(self):
+        resolver = MimeResolver(sniff=True)
+        path = self.write('data', b'%PDF-1.4')
+        os.utime(path, (0, 0))
+        self.assertEqual(resolver.guess(path), 'application/pdf')
+        with open(path, 'r+b') as fp:
+            fp.write(b'GIF89a')
+        os.utime(path, (0, 0))
+        self.assertEqual(resolver.guess(path), 'application/pdf')
+        os.utime(path, (1, 1))
+        self.assertEqual(resolver.guess(path), 'image/gif')
+
+
+class elFinderFileSystemChanges(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'dir', 'child'))
+        with open(os.path.join(self.tmp_dir, 'dir', 'child', 'file'), 'wb') as fp:
+            fp.write(b'1234')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_journal_overflow(self):
+        journal = ChangeJournal(size=2)
+        journal.add('/a')
+        journal.add('/a')
+        journal.add('/b')
+        self.assertEqual(journal.consume(), (['/a', '/b'], False))
+        for path in ('/a', '/b', '/c'):
+            journal.add(path)
+        self.assertEqual(journal.consume(), ([], True))
+        self.assertEqual(journal.consume(), ([], False))
+
+    def test_invalidate(self):
+        cache = VolumeCache('/v')
+        cache.set_paths({'a': '/v/dir', 'b': '/v/dir/child/file', 'c': '/v/other'})
+        cache.set_sizes(dict((path, 1) for path in ('/v', '/v/dir', '/v/dir/child', '/v/other')))
+        cache.invalidate(['/v/dir/child'])
+        self.assertEqual(sorted(cache.paths), ['a', 'c'])
+        self.assertEqual(sorted(cache.sizes), ['/v/other'])
+        # a directory that is only known through its descendants
+        cache.set_paths({'d': '/v/other/sub/file'})
+        cache.invalidate(['/v/other/sub'])
+        self.assertEqual(sorted(cache.paths), ['a', 'c'])
+        cache.invalidate(['/v'])
+        self.assertEqual(len(cache.paths), 0)
+        self.assertEqual(cache.paths._children, {})
+
+    def test_path_index_is_bounded(self):
+        index = PathIndex(2)
+        index.set('a', '/v/a', 1)
+        index.set('b', '/v/dir/b', 2)
+        self.assertEqual(index.get('a'), 1)
+        index.set('c', '/v/c', 3)
+        # the least recently used entry is dropped, and unindexed
+        self.assertEqual(sorted(index), ['a', 'c'])
+        self.assertFalse('/v/dir' in index._children)
+        # a path is stored under one key
+        index.set('d', '/v/a', 4)
+        self.assertEqual(sorted(index), ['c', 'd'])
+
+    def test_start_watching_drops_shared_sizes(self):
+        path = os.path.join(self.tmp_dir, 'dir')
+        VolumeCache(self.tmp_dir).set_sizes({path: (4, 1, 1)}, shared=True)
+        cache = VolumeCache(self.tmp_dir)
+        self.assertEqual(cache.get_size(path), (4, 1, 1))
+        cache = VolumeCache(self.tmp_dir)
+        cache.start_watching()
+        self.assertEqual(cache.get_size(path), None)
+
+    def test_walk_shares_only_the_found_path(self):
+        volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir)
+        path = volume.root.joinpath('dir', 'child', 'file')
+        target = volume._get_path_object(path).get_hash()
+        other = volume._get_path_object(volume.root.joinpath('dir')).get_hash()
+        self.assertEqual(volume._walk_for_path(target, volume.root), path)
+        shared = VolumeCache(self.tmp_dir)
+        self.assertEqual(shared.get_path(target), path)
+        self.assertEqual(shared.get_path(other), None)
+
+    def test_index(self):
+        volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir)
+        target = volume._get_path_object(volume.root.joinpath('dir', 'child', 'file')).get_hash()
+        self.assertEqual(volume._find_path(target), volume.root.joinpath('dir', 'child', 'file'))
+        self.assertTrue(target in volume.cache.paths)
+        shutil.rmtree(os.path.join(self.tmp_dir, 'dir'))
+        self.assertEqual(volume._find_path(target), None)
+        self.assertFalse(target in volume.cache.paths)
+
+    def test_watched_sizes(self):
+        volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir, watch=True)
+        if volume.watcher is None:
+            self.skipTest('inotify is not available')
+        self.addCleanup(volume.watcher.stop)
+        target = volume._get_path_object(volume.root.joinpath('dir')).get_hash()
+        # the directories are watched by the thread, not by the request
+        self.assertEqual(volume.size([target])['size'], 4)
+        self.assertTrue(volume.watcher.ready.wait(5))
+        self.assertEqual(volume.size([target])['size'], 4)
+        self.assertTrue(str(volume.root.joinpath('dir')) in volume.cache.sizes)
+        with open(os.path.join(self.tmp_dir, 'dir', 'child', 'other'), 'wb') as fp:
+            fp.write(b'56')
+        self.assertEqual(volume.size([target])['size'], 6)
+
+
+class elFinderWarmCommand(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'volume', 'dir', 'child'))
+        with open(os.path.join(self.tmp_dir, 'volume', 'dir', 'child', 'file'), 'wb') as fp:
+            fp.write(b'1234')
+        self.state_file = os.path.join(self.tmp_dir, 'state')
+        self.volumes = elfinder_settings.ELFINDER_VOLUME_DRIVERS
+        elfinder_settings.ELFINDER_VOLUME_DRIVERS = {
+            'warm': {'BACKEND': 'elfinder.volume_drivers.fs_driver.FileSystemVolumeDriver',
+                     'OPTIONS': {'fs_driver_root': os.path.join(self.tmp_dir, 'volume'),
+                                 'watch': True}}}
+
+    def tearDown(self):
+        elfinder_settings.ELFINDER_VOLUME_DRIVERS = self.volumes
+        shutil.rmtree(self.tmp_dir)
+
+    def warm(self, **options):
+        out = StringIO()
+        call_command('elfinder_warm', 'warm', workers=0, state_file=self.state_file,
+                     stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_warm(self):
+        self.assertEqual(self.warm(), '[1/2] warm: / (1 entries)\n'
+                                      '[2/2] warm: dir (2 entries)\n')
+        volume = FileSystemVolumeDriver(fs_driver_root=os.path.join(self.tmp_dir, 'volume'))
+        volume.cache.paths.clear()
+        volume.cache.sizes.clear()
+        path = volume.root.joinpath('dir', 'child', 'file')
+        self.assertEqual(volume.cache.get_path(volume._get_path_object(path).get_hash()), path)
+        self.assertEqual(volume.cache.get_size(str(volume.root.joinpath('dir'))), (4, 1, 1))
+
+    def test_resume(self):
+        self.warm()
+        self.assertEqual(self.warm(resume=True), 'Nothing to warm.\n')
+        self.assertEqual(len(self.warm().splitlines()), 2)
+
+
+class elFinderModelSearch(elFinderCmdTest):
+    def test_search(self):
+        volume = ModelVolumeDriver(1)
+        names = sorted(info['name'] for info in volume.search('carol DOYLE', 'fc1_d2'))
+        self.assertEqual(names, ['A Christmas Carol', 'Doyle, Arthur Conan'])
+        self.assertEqual(volume.search('carol', 'fc1_d3'), [])
+
+    def test_file_size(self):
+        volume = ModelVolumeDriver(1)
+        info = volume.putfile('fc1_f2', u'caf\xe9')
+        self.assertEqual(info['size'], 4)
+        self.assertEqual(File.objects.get(pk=2).size, 4)
+
+
+class elFinderModelQuota(elFinderCmdTest):
+    def assertUsage(self):
+        usage = FileCollection.objects.get(pk=1).usage
+        FileCollection.reconcile_usage(1)
+        self.assertEqual(usage, FileCollection.objects.get(pk=1).usage)
+        return usage
+
+    def test_usage(self):
+        self.assertEqual(self.assertUsage(), 3662)
+        self.volume.putfile('fc1_f2', u'x' * 10)
+        self.volume.duplicate(['fc1_d2'])
+        self.volume.paste(['fc1_f2'], 'fc1_d3', cut=False)
+        usage = self.assertUsage()
+        self.volume.remove('fc1_d4')
+        self.assertLess(self.assertUsage(), usage)
+
+    def test_quota(self):
+        FileCollection.objects.filter(pk=1).update(quota=3662 + 5)
+        self.assertEqual(self.volume.get_free_space(), 5)
+        with self.assertRaises(QuotaExceeded):
+            self.volume.duplicate(['fc1_d2'])
+        info = self.volume.putfile('fc1_f2', File.objects.get(pk=2).content + u'12345')
+        self.assertEqual(self.volume.get_free_space(), 0)
+        with self.assertRaises(QuotaExceeded):
+            self.volume.putfile(info['hash'], File.objects.get(pk=2).content + u'1')
+
+        upload = StringIO(u'x')
+        upload.name = 'new_file.txt'
+        response = self.get_json_response({'cmd': 'upload', 'target': 'fc1_d4',
+                                           'upload[]': upload}, fail_on_error=False)
+        self.assertEqual(response.json['error'],
+                         ['errUploadFile', 'new_file.txt', 'errUploadTotalSize'])
+
+    def test_command(self):
+        FileCollection.objects.filter(pk=1).update(usage=0)
+        call_command('elfinder_usage', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(FileCollection.objects.get(pk=1).usage, 3662)
+
+    def test_binary_content_is_refused(self):
+        with self.assertRaises(Exception):
+            self.volume.write_chunks('image.png', 'fc1_d4', [b'\x89PNG\xff\xfe'])
+        self.assertFalse(File.objects.filter(name='image.png').exists())
+
+
+class elFinderFileSystemQuota(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'dir'))
+        with open(os.path.join(self.tmp_dir, 'dir', 'file'), 'wb') as fp:
+            fp.write(b'x' * 10)
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir, quota=25)
+        self.volume.reconcile_usage()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_hash(self, *names):
+        return self.volume._get_path_object(self.volume.root.joinpath(*names)).get_hash()
+
+    def test_quota(self):
+        self.assertEqual(self.volume.get_usage(), 10)
+        self.assertEqual(self.volume.get_free_space(), 15)
+        added = self.volume.duplicate([self.get_hash('dir')])['added']
+        self.assertEqual(self.volume.get_usage(), 20)
+        with self.assertRaises(QuotaExceeded):
+            self.volume.duplicate([self.get_hash('dir')])
+        with self.assertRaises(QuotaExceeded):
+            self.volume.write_chunks('big', self.get_hash('dir'), [b'x' * 4, b'x' * 4])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'dir', 'big')))
+        self.volume.putfile(self.get_hash('dir', 'file'), u'x' * 5)
+        self.volume.remove(added[0]['hash'])
+        self.assertEqual(self.volume.get_usage(), 5)
+        self.assertEqual(self.volume.reconcile_usage(), 5)
+        self.assertEqual(self.volume.get_usage(), 5)
+
+    def test_paste_over_file(self):
+        os.mkdir(os.path.join(self.tmp_dir, 'other'))
+        self.volume.write_chunks('file', self.get_hash('other'), [b'x' * 4])
+        self.assertEqual(self.volume.get_usage(), 14)
+        # the replaced file is subtracted, both by a copy and by a move
+        self.volume.paste([self.get_hash('dir', 'file')], self.get_hash('other'), False)
+        self.assertEqual(self.volume.get_usage(), 20)
+        self.volume.paste([self.get_hash('other', 'file')], self.get_hash('dir'), True)
+        self.assertEqual(self.volume.get_usage(), 10)
+        self.assertEqual(self.volume.reconcile_usage(), 10)
+
+    def test_upload_warnings(self):
+        files = MultiValueDict({'upload[]': [SimpleUploadedFile('big', b'x' * 20),
+                                             SimpleUploadedFile('small', b'x' * 2)]})
+        result = self.volume.upload(files, self.get_hash('dir'))
+        self.assertEqual([info['name'] for info in result['added']], ['small'])
+        self.assertEqual(result['warning'], ['errUploadFile', 'big', 'errUploadTotalSize'])
+        self.assertEqual(self.volume.get_usage(), 12)
+
+    def test_unknown_usage(self):
+        volume = FileSystemVolumeDriver(fs_driver_root=os.path.join(self.tmp_dir, 'dir'),
+                                        quota=5)
+        self.assertEqual(volume.get_usage(), None)
+        # only the disk space is left
+        self.assertGreater(volume.get_free_space(), 5)
+        volume.write_chunks('new', '', [b'x' * 10])
+        self.assertEqual(volume.get_usage(), None)
+        self.assertEqual(volume.reconcile_usage(), 20)
+        self.assertEqual(volume.get_free_space(), 0)
+
+    def test_volume_keys(self):
+        other = FileSystemVolumeDriver(fs_driver_root=os.path.join(self.tmp_dir, 'dir'))
+        self.assertNotEqual(self.volume.get_volume_key(), other.get_volume_key())
+        self.assertEqual(len(self.volume.get_volume_key()), 43)
+
+
+class elFinderThrottling(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.request = RequestFactory().get('/')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        cache.clear()
+
+    def run_command(self, volume, **params):
+        connector = ElFinderConnector([volume])
+        connector.run(RequestFactory().get('/', params))
+        return connector
+
+    def test_concurrency(self):
+        volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir,
+                                        throttle={'user_concurrency': 1})
+        root = volume.get_info('')['hash']
+        running = get_throttle(volume, 'size', self.request)
+        self.assertIsNone(running.acquire())
+        connector = self.run_command(volume, cmd='size', **{'targets[]': [root]})
+        self.assertEqual(connector.httpStatusCode, 429)
+        self.assertEqual(connector.response['busy'], 5)
+        self.assertEqual(connector.httpHeader['Retry-After'], '5')
+        # other commands are not limited
+        self.assertFalse('error' in self.run_command(volume, cmd='ls', target=root).response)
+        running.release()
+        connector = self.run_command(volume, cmd='size', **{'targets[]': [root]})
+        self.assertFalse('error' in connector.response)
+        # the slot was given back
+        self.assertIsNone(running.acquire())
+
+    def test_expired_slot_is_not_released(self):
+        volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir,
+                                        throttle={'concurrency': 1})
+        late = get_throttle(volume, 'size', self.request)
+        self.assertIsNone(late.acquire())
+        # the slot of the late command expired and was taken by another
+        cache.delete_many([slot for slot, token in late.slots])
+        other = get_throttle(volume, 'size', self.request)
+        self.assertIsNone(other.acquire())
+        late.release()
+        self.assertEqual(get_throttle(volume, 'size', self.request).acquire(), 5)
+
+    def test_rate(self):
+        volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir,
+                                        throttle={'rate': '2/h'})
+        root = volume.get_info('')['hash']
+        for attempt in range(2):
+            connector = self.run_command(volume, cmd='search', target=root, q='x', reqid='1')
+            self.assertFalse('error' in connector.response)
+        connector = self.run_command(volume, cmd='search', target=root, q='x', reqid='1')
+        self.assertEqual(connector.httpStatusCode, 429)
+        self.assertEqual(connector.response['busy'], 1800)
+
+
+class elFinderAbort(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'dir', 'sub'))
+        for name in ('a.txt', 'sub/b.txt'):
+            with open(os.path.join(self.tmp_dir, 'dir', name), 'w') as fp:
+                fp.write('text')
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir)
+        self.root = self.volume.get_info('')['hash']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        cache.clear()
+
+    def run_command(self, request):
+        connector = ElFinderConnector([self.volume])
+        connector.run(request)
+        return connector
+
+    def test_abort(self):
+        connector = self.run_command(RequestFactory().post('/', {'cmd': 'abort', 'id': '42'}))
+        self.assertEqual(connector.response, {})
+        request = RequestFactory().get('/', {'cmd': 'search', 'target': self.root,
+                                             'q': 'txt', 'reqid': '42'})
+        self.assertEqual(self.run_command(request).response['error'], 'errAbort')
+        # other requests run
+        request = RequestFactory().get('/', {'cmd': 'search', 'target': self.root,
+                                             'q': 'txt', 'reqid': '43'})
+        self.assertEqual(len(self.run_command(request).response['files']), 2)
+
+    def test_abort_other_user(self):
+        self.run_command(RequestFactory().post('/', {'cmd': 'abort', 'id': '42'},
+                                               REMOTE_ADDR='10.0.0.2'))
+        request = RequestFactory().get('/', {'cmd': 'search', 'target': self.root,
+                                             'q': 'txt', 'reqid': '42'})
+        self.assertEqual(len(self.run_command(request).response['files']), 2)
+
+    def test_reqid_header(self):
+        self.run_command(RequestFactory().post('/', {'cmd': 'abort', 'id': '42'}))
+        request = RequestFactory().get('/', {'cmd': 'size', 'targets[]': [self.root]},
+                                       HTTP_X_ELFINDERREQID='42')
+        self.assertEqual(self.run_command(request).response['error'], 'errAbort')
+
+    def test_copy_tree(self):
+        from elfinder.volume_drivers.fs_copy import copy_tree
+        calls = []
+
+        def check():
+            calls.append(1)
+            if len(calls) > 1:
+                raise Aborted()
+        dst = os.path.join(self.tmp_dir, 'copy')
+        self.assertRaises(Aborted, copy_tree,
+                          os.path.join(self.tmp_dir, 'dir'), dst, workers=1, check=check)
+        # the partial copy is removed
+        self.assertFalse(os.path.exists(dst))
+
+
+class elFinderChecksums(TestCase):
+    fixtures = ['testdata.json']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.chunk_dir = tempfile.mkdtemp()
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.tmp_dir, checksums=True,
+                                             upload_chunk_dir=self.chunk_dir)
+        self.root = self.volume.get_info('')['hash']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        shutil.rmtree(self.chunk_dir)
+
+    def run_command(self, volume, **data):
+        connector = ElFinderConnector([volume])
+        connector.run(RequestFactory().post('/', data))
+        return connector.response
+
+    def upload(self, name, content, volume=None, target=None):
+        upload = SimpleUploadedFile(name, content)
+        return self.run_command(volume or self.volume, cmd='upload',
+                                target=target or self.root, **{'upload[]': upload})
+
+    def test_upload(self):
+        info = self.upload('a.txt', b'abc')['added'][0]
+        self.assertEqual(info['checksum'], 'sha256:' + hashlib.sha256(b'abc').hexdigest())
+        path = os.path.join(self.tmp_dir, 'a.txt')
+        inode = os.stat(path).st_ino
+        # the identical upload is not written
+        self.assertEqual(self.upload('a.txt', b'abc')['added'][0], info)
+        self.assertEqual(os.stat(path).st_ino, inode)
+        info = self.upload('a.txt', b'abd')['added'][0]
+        self.assertEqual(info['checksum'], 'sha256:' + hashlib.sha256(b'abd').hexdigest())
+        # a file changed outside elFinder has no checksum anymore
+        with open(path, 'ab') as fp:
+            fp.write(b'e')
+        self.assertFalse('checksum' in self.volume.get_info(info['hash']))
+
+    def test_chunked_upload(self):
+        def send(start, data):
+            return self.run_command(self.volume, cmd='upload', target=self.root, cid='1',
+                                    chunk='big.bin.%d_1.part' % (start // 4),
+                                    range='%d,%d,6' % (start, len(data)),
+                                    **{'upload[]': SimpleUploadedFile('blob', data)})
+        self.assertEqual(self.volume.get_options()['options']['uploadMaxConn'], 3)
+        response = send(4, b'ef')
+        self.assertEqual(response['_received'], 0)
+        self.assertFalse('_chunkmerged' in response)
+        response = send(0, b'abcd')
+        self.assertEqual(response['_received'], 6)
+        self.assertEqual(response['_name'], 'big.bin')
+        # a part sent again is not merged twice
+        self.assertFalse('_chunkmerged' in send(0, b'abcd'))
+        response = self.run_command(self.volume, cmd='upload', target=self.root,
+                                    chunk=response['_chunkmerged'], **{'upload[]': 'big.bin'})
+        info = response['added'][0]
+        self.assertEqual(info['size'], 6)
+        self.assertEqual(info['checksum'], 'sha256:' + hashlib.sha256(b'abcdef').hexdigest())
+        with open(os.path.join(self.tmp_dir, 'big.bin'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'abcdef')
+        # the parts are removed once merged
+        self.assertEqual(os.listdir(self.chunk_dir), [])
+
+    def test_merge_other_upload(self):
+        self.run_command(self.volume, cmd='upload', target=self.root, cid='1',
+                         chunk='big.bin.0_0.part', range='0,2,2',
+                         **{'upload[]': SimpleUploadedFile('blob', b'ab')})
+        key = os.listdir(self.chunk_dir)[0]
+        # another user, or another name, cannot merge the parts
+        for name, remote_addr in (('big.bin', '10.0.0.2'), ('other.bin', '127.0.0.1')):
+            request = RequestFactory().get('/', {
+                'cmd': 'upload', 'target': self.root, 'chunk': '%s_1_2' % key,
+                'upload[]': name}, REMOTE_ADDR=remote_addr)
+            self.volume.request = request
+            connector = ElFinderConnector([self.volume])
+            connector.run(request)
+            self.assertTrue('error' in connector.response, connector.response)
+        self.assertEqual(os.listdir(self.chunk_dir), [key])
+
+    def test_concurrent_parts(self):
+        store = self.volume.chunk_store
+        key = store.get_key('concurrent')
+        makedirs = os.makedirs
+
+        def concurrent_makedirs(path, *args, **kwargs):
+            # another request stores a part first
+            makedirs(path)
+            makedirs(path, *args, **kwargs)
+        os.makedirs = concurrent_makedirs
+        try:
+            self.assertTrue(store.save(key, 0, 2, [b'ab']))
+        finally:
+            os.makedirs = makedirs
+        start = threading.Event()
+        errors = []
+
+        def save(index):
+            start.wait()
+            try:
+                store.save(key, index * 2, 2, [b'ab'])
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=save, args=(index,)) for index in range(1, 8)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(store.received(key), 16)
+
+    def test_chunk_failure(self):
+        self.run_command(self.volume, cmd='upload', target=self.root, cid='1',
+                         chunk='big.bin.0_1.part', range='0,2,4',
+                         **{'upload[]': SimpleUploadedFile('blob', b'ab')})
+        self.assertEqual(len(os.listdir(self.chunk_dir)), 1)
+        response = self.run_command(self.volume, cmd='upload', target=self.root, cid='1',
+                                    chunk='big.bin.0_1.part',
+                                    **{'upload[]': 'chunkfail', 'mimes[]': 'chunkfail'})
+        self.assertEqual(response['warning'], ['errUploadFile', 'big.bin', 'errUploadTemp'])
+        self.assertEqual(os.listdir(self.chunk_dir), [])
+
+    def test_model_upload(self):
+        volume = ModelVolumeDriver(1)
+        info = self.upload('notes.txt', b'abc', volume, 'fc1_d4')['added'][0]
+        self.assertTrue(info['checksum'].startswith('sha256:'))
+        # uploading the same content again is not an error
+        response = self.upload('notes.txt', b'abc', volume, 'fc1_d4')
+        self.assertEqual(response['added'][0]['hash'], info['hash'])
+        response = self.upload('notes.txt', b'abd', volume, 'fc1_d4')
+        self.assertEqual(response['error'], 'File with this Name and Parent already exists.')
+
+
+class elFinderFileSystemTrash(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'root')
+        os.makedirs(os.path.join(self.root, 'dir', 'sub'))
+        for name in ('a.txt', 'sub/b.txt'):
+            with open(os.path.join(self.root, 'dir', name), 'w') as fp:
+                fp.write('text')
+        self.volume = FileSystemVolumeDriver(fs_driver_root=self.root, trash=True,
+                                             trash_reaper=False, quota='1M')
+        self.volume.reconcile_usage()
+        self.trash = os.path.join(self.tmp_dir, '.root.trash')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        cache.clear()
+
+    def test_remove(self):
+        self.assertEqual(self.volume.get_usage(), 8)
+        target = self.volume.get_tree('')[1]['hash']
+        connector = ElFinderConnector([self.volume])
+        connector.run(RequestFactory().get('/', {'cmd': 'rm', 'targets[]': [target]}))
+        self.assertEqual(connector.response['removed'], [target])
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'dir')))
+        self.assertEqual(len(os.listdir(self.trash)), 1)
+        # counted until purged
+        self.assertEqual(self.volume.get_usage(), 8)
+        self.assertEqual(self.volume.purge_trash(), 2)
+        self.assertEqual(os.listdir(self.trash), [])
+        self.assertEqual(self.volume.get_usage(), 0)
+
+    def test_command(self):
+        self.volume.remove(self.volume.get_tree('')[1]['hash'])
+        volumes = elfinder_settings.ELFINDER_VOLUME_DRIVERS
+        elfinder_settings.ELFINDER_VOLUME_DRIVERS = {
+            'trash': {'BACKEND': 'elfinder.volume_drivers.fs_driver.FileSystemVolumeDriver',
+                      'OPTIONS': {'fs_driver_root': self.root, 'trash': True}}}
+        try:
+            call_command('elfinder_purge_trash', 'trash', '--no-collections',
+                         stdout=StringIO(), stderr=StringIO())
+        finally:
+            elfinder_settings.ELFINDER_VOLUME_DRIVERS = volumes
+        self.assertEqual(os.listdir(self.trash), [])
+
+
+class elFinderModelTrash(elFinderCmdTest):
+    def setUp(self):
+        super(elFinderModelTrash, self).setUp()
+        self.volume = ModelVolumeDriver(1, trash=True, trash_reaper=False)
+
+    def test_remove(self):
+        usage = FileCollection.objects.get(pk=1).usage
+        files = File.objects.count()
+        self.volume.remove('fc1_d4')
+        self.volume.remove('fc1_f4')
+        names = [info['name'] for info in ModelVolumeDriver(1).get_tree('')]
+        self.assertFalse(Directory.objects.get(pk=4).name in names)
+        self.assertRaises(Exception, self.volume.get_object, 'fc1_d4')
+        self.assertRaises(Exception, self.volume.get_object, 'fc1_f4')
+        # the root is still found, and the trash still counted
+        self.assertEqual(ModelVolumeDriver(1).root_directory.pk, 1)
+        self.assertEqual(FileCollection.objects.get(pk=1).usage, usage)
+
+        purged = self.volume.purge_trash()
+        self.assertEqual(File.objects.count(), files - purged)
+        self.assertFalse(Directory.objects.filter(pk=4).exists())
+        self.assertFalse(Directory.objects.filter(deleted=True).exists())
+        purged_usage = FileCollection.objects.get(pk=1).usage
+        self.assertLess(purged_usage, usage)
+        FileCollection.reconcile_usage(1)
+        self.assertEqual(FileCollection.objects.get(pk=1).usage, purged_usage)
+
+    def test_descendants_of_trashed_directory(self):
+        subdirs = list(Directory.objects.get(pk=2).get_descendants())
+        files = list(File.objects.filter(parent__in=subdirs))
+        self.assertTrue(subdirs and files)
+        self.volume.remove('fc1_d2')
+        for subdir in subdirs:
+            self.assertRaises(Exception, self.volume.get_info, subdir.get_hash())
+            self.assertRaises(Exception, self.volume.mkdir, 'new', subdir.get_hash())
+        for file in files:
+            self.assertRaises(Exception, self.volume.get_info, file.get_hash())
+
+    def test_command(self):
+        self.volume.remove('fc1_d4')
+        volumes = elfinder_settings.ELFINDER_VOLUME_DRIVERS
+        elfinder_settings.ELFINDER_VOLUME_DRIVERS = {}
+        try:
+            call_command('elfinder_purge_trash', stdout=StringIO(), stderr=StringIO())
+        finally:
+            elfinder_settings.ELFINDER_VOLUME_DRIVERS = volumes
+        self.assertFalse(Directory.objects.filter(deleted=True).exists())
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+""" Limits on the expensive commands of a volume, configured by the
+'throttle' option of the volume::
+
+    'OPTIONS': {
+        'throttle': {
+            'commands': ['search', 'size', 'archive', 'extract', 'zipdl'],
+            'concurrency': 4,       # running at once on the volume
+            'user_concurrency': 1,  # running at once for a user
+            'rate': '30/m',         # started by a user (token bucket)
+            'burst': 5,             # tokens of the bucket (default: 30)
+        }
+    }
+
+The state lives in the Django cache, so that the limits hold across the
+worker processes when the cache is shared. Concurrency slots are cache
+keys of their own, expiring after 'timeout' seconds (default 300) should
+a worker die while holding one. A slot (or lock) holds a token of its
+holder, which only deletes it while it still holds that token: a command
+running past the timeout does not free the slot taken since by another.
+The Django cache has no compare-and-delete, so the check and the delete
+are two calls; a slot taken between them is lost to the limit, never
+shared.
+
+A command over a limit is refused with a 'busy' error (HTTP 429, with a
+Retry-After header) that the client can retry: after 'retry_after' seconds
+(default 5) for the concurrency limits, when the next token is due for the
+rate limit.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+
+HEAVY_COMMANDS = ('search', 'size', 'archive', 'extract', 'zipdl')
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# attempts to take the lock of a token bucket, LOCK_WAIT seconds apart
+LOCK_ATTEMPTS = 10
+LOCK_WAIT = 0.005
+
+
+def _delete_if_held(key, token):
+    """ Deletes key if it still holds token. """
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def parse_rate(rate):
+    """ Returns (requests, seconds) for a rate such as '30/m'. """
+    count, period = rate.split('/')
+    return int(count), PERIODS[period.strip()[0]]
+
+
+class TokenBucket(object):
+    """ Token bucket stored in the cache under key: holds up to `burst`
+        tokens, refilled at count tokens per period seconds.
+    """
+
+    def __init__(self, key, count, period, burst=None):
+        self.key = key
+        self.rate = float(count) / period
+        self.burst = burst or count
+
+    def consume(self):
+        """ Takes a token. Returns None on success, or the number of
+            seconds until a token is available.
+        """
+        lock_key = self.key + ':lock'
+        token = uuid.uuid4().hex
+        for attempt in range(LOCK_ATTEMPTS):
+            if cache.add(lock_key, token, 5):
+                break
+            time.sleep(LOCK_WAIT)
+        else:
+            # Rather than queueing requests behind a busy cache.
+            return None
+        try:
+            now = time.time()
+            tokens, stamp = cache.get(self.key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            cache.set(self.key, (tokens - 1, now), int(self.burst / self.rate) + 1)
+            return None
+        finally:
+            _delete_if_held(lock_key, token)
+
+
+class Throttle(object):
+    """ The limits of one command run: slots of the concurrency limits and
+        a token of the rate limit, taken by `acquire` and given back (the
+        slots) by `release`.
+    """
+
+    def __init__(self, prefix, user, concurrency=None, user_concurrency=None,
+                 rate=None, burst=None, timeout=300, retry_after=5):
+        self.prefix = prefix
+        self.user = user
+        self.limits = []
+        if concurrency:
+            self.limits.append(('%s:running' % prefix, concurrency))
+        if user_concurrency:
+            self.limits.append(('%s:running:%s' % (prefix, user), user_concurrency))
+        self.bucket = None
+        if rate:
+            count, period = parse_rate(rate)
+            self.bucket = TokenBucket('%s:bucket:%s' % (prefix, user), count, period, burst)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.slots = []
+
+    def acquire(self):
+        """ Returns None if the command can run, or the number of seconds
+            after which the client should retry.
+        """
+        for key, limit in self.limits:
+            slot = self._take_slot(key, limit)
+            if slot is None:
+                self.release()
+                return self.retry_after
+            self.slots.append(slot)
+        if self.bucket is not None:
+            wait = self.bucket.consume()
+            if wait is not None:
+                self.release()
+                return max(1, int(wait + 0.999))
+        return None
+
+    def release(self):
+        for slot, token in self.slots:
+            _delete_if_held(slot, token)
+        self.slots = []
+
+    def _take_slot(self, key, limit):
+        """ Returns (slot key, token) of a free slot, or None. """
+        token = uuid.uuid4().hex
+        for index in range(limit):
+            slot = '%s:%d' % (key, index)
+            if cache.add(slot, token, self.timeout):
+                return slot, token
+        return None
+
+
+def get_request_user(request):
+    """ Identifies the user of request: the user id, or the client address
+        for anonymous users.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user:%s' % user.pk
+    return 'ip:%s' % request.META.get('REMOTE_ADDR', '')
+
+
+def get_throttle(volume, command, request):
+    """ Returns the Throttle of command on volume for the user of request,
+        or None if the command is not limited.
+    """
+    options = volume.kwargs.get('throttle')
+    if not options or command not in options.get('commands', HEAVY_COMMANDS):
+        return None
+    return Throttle('elfinder:throttle:%s' % volume.get_volume_key(),
+                    get_request_user(request),
+                    concurrency=options.get('concurrency'),
+                    user_concurrency=options.get('user_concurrency'),
+                    rate=options.get('rate'),
+                    burst=options.get('burst'),
+                    timeout=options.get('timeout', 300),
+                    retry_after=options.get('retry_after', 5))
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+""" Upload limits of the volumes: the largest file (uplMaxSize), the free
+space of the volume and the allowed MIME types.
+
+UploadLimitHandler enforces them while Django reads the request body, so
+an upload is stopped at the first chunk over a limit instead of being
+written to a temporary file first. The views install it when the volume
+is known before the body is read (the connector URL names it). Otherwise,
+check_uploads applies the same limits to the parsed files, before the
+volume writes them.
+
+The rejections are reported as elFinder error messages, e.g.
+['errUploadFile', 'big.iso', 'errUploadFileSize'].
+
+ChunkStore keeps the parts of the chunked uploads until they are merged.
+"""
+import errno
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+from django.utils.datastructures import MultiValueDict
+from django.utils.encoding import force_bytes
+
+from elfinder.conf import settings
+from elfinder.volume_drivers.base import mime_matches
+
+UPLOAD_FIELD = 'upload[]'
+# the file name of the parts of chunked uploads, whose type is checked on
+# the name of the whole file instead
+CHUNK_FILE_NAME = 'blob'
+
+# "<file name>.<index>_<last index>.part"
+CHUNK_NAME = re.compile(r'^(?P<name>.+)\.(?P<index>\d+)_(?P<last>\d+)\.part$', re.S)
+# "<start>,<length>,<file size>"
+CHUNK_RANGE = re.compile(r'^(\d+),(\d+),(\d+)$')
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """ Checks the files uploaded to volume as they are received and passes
+        the accepted chunks on to the next handlers.
+
+        A file of a type that is not allowed is skipped. A file over the
+        size limit, or over the free space of the volume, stops the upload
+        without reading the rest of the request.
+    """
+
+    def __init__(self, volume, request=None):
+        super(UploadLimitHandler, self).__init__(request)
+        self.volume = volume
+        self.errors = []
+        self.received = 0
+        self._free_space = None
+        self._rejected = None
+
+    @property
+    def free_space(self):
+        if self._free_space is None:
+            self._free_space = self.volume.get_free_space()
+            if self._free_space is None:
+                self._free_space = float('inf')
+        return self._free_space
+
+    def new_file(self, field_name, file_name, content_type, content_length, *args, **kwargs):
+        super(UploadLimitHandler, self).new_file(field_name, file_name, content_type,
+                                                 content_length, *args, **kwargs)
+        # The other handlers have not opened their file yet: rejections
+        # are raised with the first chunk.
+        self._rejected = None
+        if field_name != UPLOAD_FIELD:
+            return
+        max_size = self.volume.upload_max_size
+        if max_size and content_length and content_length > max_size:
+            self._rejected = 'errUploadFileSize'
+        elif file_name != CHUNK_FILE_NAME and not self.volume.is_upload_allowed(
+                self.volume.get_upload_mime(file_name, content_type)):
+            self._rejected = 'errUploadMime'
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.field_name != UPLOAD_FIELD:
+            return raw_data
+        if self._rejected == 'errUploadMime':
+            self.reject('errUploadMime')
+            raise SkipFile()
+        max_size = self.volume.upload_max_size
+        if self._rejected or (max_size and start + len(raw_data) > max_size):
+            self.reject('errUploadFileSize')
+            raise StopUpload(connection_reset=True)
+        self.received += len(raw_data)
+        if self.received > self.free_space:
+            self.reject('errUploadTotalSize')
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        # The next handler returns the file.
+        return None
+
+    def reject(self, error):
+        self.errors.extend(['errUploadFile', self.file_name, error])
+
+
+def get_upload_errors(request):
+    """ Returns the rejections of the UploadLimitHandler of request. """
+    errors = []
+    for handler in getattr(request, 'upload_handlers', ()):
+        if isinstance(handler, UploadLimitHandler):
+            errors.extend(handler.errors)
+    return errors
+
+
+def check_uploads(volume, files, mimes=None):
+    """ Returns (accepted, errors): the uploaded files that are within the
+        limits of volume (and of the MIME types of the client, mimes) and
+        the errors for the others.
+    """
+    accepted = MultiValueDict()
+    errors = []
+    max_size = volume.upload_max_size
+    free_space = volume.get_free_space()
+    total = 0
+    for upload in files.getlist(UPLOAD_FIELD):
+        mime = volume.get_upload_mime(upload.name, upload.content_type)
+        if max_size and upload.size > max_size:
+            error = 'errUploadFileSize'
+        elif not volume.is_upload_allowed(mime) or (mimes and not mime_matches(mime, mimes)):
+            error = 'errUploadMime'
+        elif free_space is not None and total + upload.size > free_space:
+            error = 'errUploadTotalSize'
+        else:
+            total += upload.size
+            accepted.appendlist(UPLOAD_FIELD, upload)
+            continue
+        errors.extend(['errUploadFile', upload.name, error])
+    return accepted, errors
+
+
+def parse_chunk(chunk, bytes_range):
+    """ Returns (file name, start, length, file size) of a chunk of a
+        chunked upload, from its chunk and range parameters.
+    """
+    name = CHUNK_NAME.match(chunk)
+    byte_range = CHUNK_RANGE.match(bytes_range.strip())
+    if name is None or byte_range is None or '/' in chunk or '\\' in chunk:
+        raise Exception('Invalid chunk: %s' % chunk)
+    start, length, size = [int(value) for value in byte_range.groups()]
+    if start + length > size:
+        raise Exception('Invalid chunk: %s' % chunk)
+    return name.group('name'), start, length, size
+
+
+class ChunkStore(object):
+    """ The parts of chunked uploads, in a directory per uploaded file.
+
+        A part is written to a temporary file which is renamed to its byte
+        range once complete, so the parts that are there are whole: an
+        interrupted upload resumes from them, and a part sent again is not
+        written twice. The directory of an upload is removed when it is
+        merged, or once it is older than ttl seconds.
+    """
+
+    def __init__(self, directory=None, ttl=None):
+        self.directory = directory or settings.ELFINDER_UPLOAD_CHUNK_DIR or \
+            os.path.join(tempfile.gettempdir(), 'elfinder-chunks')
+        self.ttl = settings.ELFINDER_UPLOAD_CHUNK_TTL if ttl is None else ttl
+
+    @staticmethod
+    def get_key(*parts):
+        """ Returns the key of the upload identified by parts (e.g. the
+            volume, the user, the cid of the client and the file name).
+        """
+        return hashlib.sha1(force_bytes('\0'.join('%s' % part for part in parts))).hexdigest()
+
+    def _path(self, key, *names):
+        if not re.match(r'^[0-9a-f]{40}$', key):
+            raise Exception('Invalid chunked upload: %s' % key)
+        return os.path.join(self.directory, key, *names)
+
+    def save(self, key, start, length, chunks):
+        """ Stores the part of the upload key at start. Returns False if it
+            was already there.
+        """
+        path = self._path(key, '%d-%d' % (start, length))
+        if os.path.exists(path):
+            return False
+        try:
+            os.makedirs(self._path(key))
+        except OSError as e:
+            # the other parts may be stored concurrently
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=self._path(key), prefix='.part')
+        try:
+            written = 0
+            with os.fdopen(fd, 'wb') as fp:
+                for chunk in chunks:
+                    written += len(chunk)
+                    fp.write(chunk)
+            if written != length:
+                raise Exception('Incomplete chunk: %d of %d bytes' % (written, length))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+    def _parts(self, key):
+        try:
+            names = os.listdir(self._path(key))
+        except OSError:
+            return []
+        parts = []
+        for name in names:
+            if not name.startswith('.'):
+                start, length = name.split('-')
+                parts.append((int(start), int(length)))
+        return sorted(parts)
+
+    def received(self, key):
+        """ Returns the number of bytes received from the start of the
+            upload key, without gaps.
+        """
+        received = 0
+        for start, length in self._parts(key):
+            if start > received:
+                break
+            received = max(received, start + length)
+        return received
+
+    def claim(self, key):
+        """ Returns True for the first caller only, so that a single request
+            reports the upload complete.
+        """
+        try:
+            os.close(os.open(self._path(key, '.complete'), os.O_CREAT | os.O_EXCL))
+        except OSError:
+            return False
+        return True
+
+    def read(self, key, size):
+        """ Yields the bytes of the upload key, which must be complete. """
+        position = 0
+        for start, length in self._parts(key):
+            if start + length <= position:
+                continue
+            if start > position:
+                break
+            with open(self._path(key, '%d-%d' % (start, length)), 'rb') as fp:
+                fp.seek(position - start)
+                while True:
+                    data = fp.read(64 * 1024)
+                    if not data:
+                        break
+                    position += len(data)
+                    yield data
+        if position != size:
+            raise Exception('Incomplete chunked upload.')
+
+    def discard(self, key):
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def purge(self):
+        """ Removes the uploads not written to for ttl seconds. """
+        limit = time.time() - self.ttl
+        try:
+            keys = os.listdir(self.directory)
+        except OSError:
+            return
+        for key in keys:
+            path = os.path.join(self.directory, key)
+            try:
+                if os.stat(path).st_mtime < limit:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
@@ -1,5 +1,5 @@
 from django.conf.urls import url
-from elfinder.views import index, connector_view
+from elfinder.views import index, connector_view, metrics_view
 from elfinder.views_tinymce import tinymce_filebrowser_script_view, tinymce_filebrowser_dialog_view
 
 urlpatterns = [
@@ -8,6 +8,7 @@ urlpatterns = [
 
     url(r'^$', index, name='elfinder_index'),
     url(r'^connector/$', connector_view, name='elfinder_connector'),
+    url(r'^metrics/$', metrics_view, name='elfinder_metrics'),
 
     url(r'^tinymce/filebrowser-script/$', tinymce_filebrowser_script_view, name='elfinder_tinymce_filebrowser_script'),
     url(r'^tinymce/filebrowser-dialog/$', tinymce_filebrowser_dialog_view, name='elfinder_tinymce_filebrowser_dialog'),
@@ -1,8 +1,9 @@
 import json
 
+from django.conf import settings as user_settings
 from django.contrib.auth.decorators import user_passes_test
 from django.core.serializers.json import DjangoJSONEncoder
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render
 from django.utils.functional import cached_property
 from django.views.decorators.cache import never_cache
@@ -10,6 +11,8 @@ from django.views.decorators.csrf import ensure_csrf_cookie
 
 from elfinder.conf import settings
 from elfinder.connector import ElFinderConnector
+from elfinder.instrumentation import PrometheusSink, get_metrics_sinks
+from elfinder.uploads import UploadLimitHandler
 from elfinder.volume_drivers import get_volume_driver
 
 
@@ -22,12 +25,34 @@ class VolumeDriver(object):
 
     @cached_property
     def name(self):
+        """ The volume named by the view, else by the request. Uploads
+            (multipart requests) may name it in the query string, so that
+            it is known before their body is read.
+        """
         if self._name is None:
+            if self.is_upload and 'volume' in self.request.GET:
+                return self.request.GET['volume']
             request_method = getattr(self.request, self.request.method)
             return request_method.get('volume', 'default')
         else:
             return self._name
 
+    @property
+    def is_upload(self):
+        return (self.request.method == 'POST' and
+                self.request.content_type == 'multipart/form-data')
+
+    def add_upload_handler(self):
+        """ Enforces the upload limits of the volume while the request body
+            is read, when the volume is known without reading it (named by
+            the view or in the query string).
+        """
+        if not self.is_upload:
+            return
+        if self._name is None and 'volume' not in self.request.GET:
+            return
+        self.request.upload_handlers.insert(0, UploadLimitHandler(self.volume, self.request))
+
     @cached_property
     def volume(self):
         volume = get_volume_driver(self.name,
@@ -91,6 +116,9 @@ def connector_view(request, coll_id=None):
 
     if not volume_driver:  # not has access
         return volume_driver.login_view
+    # The access check does not read the body when the volume is named
+    # without it, which is when the handler is installed.
+    volume_driver.add_upload_handler()
 
     finder = ElFinderConnector([volume_driver.volume])
     try:
@@ -107,6 +135,12 @@ def connector_view(request, coll_id=None):
 
     response = HttpResponse(content_type=finder.httpHeader['Content-type'])
     response.status_code = finder.httpStatusCode
+    for header, value in finder.httpHeader.items():
+        if header != 'Content-type':
+            response[header] = value
+    if response.status_code == 304:
+        # Not modified: the client reuses its cached listing.
+        return response
     if finder.httpHeader['Content-type'] == 'application/json':
         response.content = json.dumps(finder.httpResponse,
                                       cls=DjangoJSONEncoder,
@@ -126,3 +160,20 @@ def read_file(request, volume, file_hash, template="elfinder/read_file.html"):
     return render(request, template,
                   context={'file': file_hash},
                   using=settings.ELFINDER_TEMPLATE_ENGINE)
+
+
+def metrics_view(request):
+    """ Serves the connector metrics in the Prometheus text format, when a
+        PrometheusSink is configured in ELFINDER_METRICS_SINKS.
+
+        Only available to staff users and INTERNAL_IPS.
+    """
+    user = getattr(request, 'user', None)
+    is_staff = user is not None and user.is_staff
+    if not (is_staff or request.META.get('REMOTE_ADDR') in user_settings.INTERNAL_IPS):
+        raise Http404
+    for sink in get_metrics_sinks():
+        if isinstance(sink, PrometheusSink):
+            return HttpResponse(sink.render(),
+                                content_type='text/plain; version=0.0.4')
+    raise Http404
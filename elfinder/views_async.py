@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+""" Async connector view for ASGI deployments (Django >= 3.1).
+
+Use elfinder.urls_async instead of elfinder.urls to route the connector
+through it.
+"""
+from django.http import StreamingHttpResponse
+
+from elfinder import views
+from elfinder.volume_drivers.async_driver import iterate_in_executor, run_in_executor
+
+
+async def connector_view(request, coll_id=None):
+    """ Async variant of elfinder.views.connector_view.
+
+        The command runs in the bounded thread pool of the async drivers,
+        and streamed responses (e.g. the 'file' command) are read chunk by
+        chunk in the pool, so transfers do not pin a thread each.
+    """
+    response = await run_in_executor(views.connector_view, request, coll_id=coll_id)
+    # Async streaming content is only supported by Django >= 4.2.
+    if isinstance(response, StreamingHttpResponse) and hasattr(response, 'is_async') \
+            and not response.is_async:
+        response.streaming_content = iterate_in_executor(response.streaming_content)
+    return response
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+""" Async access to the (synchronous) volume drivers.
+
+The blocking work is run in a bounded thread pool (ELFINDER_ASYNC_MAX_WORKERS
+threads) shared by the whole process, so the event loop of an ASGI server is
+never blocked by filesystem or database calls. Requires Python >= 3.6.
+"""
+import asyncio
+import functools
+
+from elfinder.conf import settings
+from elfinder.helpers import call_with_db_cleanup, get_thread_pool
+
+
+def get_executor():
+    return get_thread_pool('async', settings.ELFINDER_ASYNC_MAX_WORKERS)
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """ Runs func(*args, **kwargs) in the thread pool. """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(),
+                                      functools.partial(call_with_db_cleanup, func, *args, **kwargs))
+
+
+_exhausted = object()
+
+
+async def iterate_in_executor(iterator):
+    """ Async iterator over a blocking iterator, each item being fetched in
+        the thread pool.
+    """
+    iterator = iter(iterator)
+    try:
+        while True:
+            item = await run_in_executor(next, iterator, _exhausted)
+            if item is _exhausted:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await run_in_executor(close)
+
+
+class AsyncVolumeDriver(object):
+    """ Async facade over a BaseVolumeDriver.
+
+        Every method of the wrapped driver is available as a coroutine run
+        in the thread pool, e.g. `await AsyncVolumeDriver(volume).get_info(target)`.
+        read_chunks returns an async iterator.
+    """
+
+    def __init__(self, volume):
+        self.volume = volume
+
+    def __getattr__(self, name):
+        attr = getattr(self.volume, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, **kwargs):
+            return await run_in_executor(attr, *args, **kwargs)
+        return method
+
+    async def read_chunks(self, target):
+        chunks = await run_in_executor(self.volume.read_chunks, target)
+        async for chunk in iterate_in_executor(chunks):
+            yield chunk
@@ -1,16 +1,78 @@
+import logging
+import mimetypes
+import os
+
 from django.urls import reverse
 from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 from django.utils.six import string_types
 
+from elfinder.helpers import call_with_db_cleanup, get_thread_pool, parse_size
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(Exception):
+    """ Raised when a write would take a volume over its quota. """
+
+
+def check_name(name):
+    """ Raises an exception unless name is a single path component, e.g.
+        for the names coming from another volume. Returns name.
+    """
+    if name in ('', '.', '..') or '/' in name or '\\' in name or '\0' in name:
+        raise Exception("Invalid name: '%s'" % name)
+    return name
+
+
+def mime_matches(mime, patterns):
+    """ Returns True if mime is one of patterns, which may also list major
+        types ('image' or 'image/*').
+    """
+    major = mime.split('/')[0]
+    return any(pattern in (mime, major, major + '/*') for pattern in patterns)
+
 
 class BaseVolumeDriver(object):
     content_encoding = 'UTF-8'
+    # parallel chunk uploads of a file (uploadMaxConn), -1 when chunked
+    # uploads are not supported
+    upload_max_conn = -1
 
     def __init__(self, request=None, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
         self.request = request
+        # CommandMetrics of the command being run (set by the connector).
+        self.metrics = None
+        # Cancellation of the command being run (set by the connector).
+        self.cancellation = None
+
+    def record(self, name, value=1):
+        """ Adds value to the named counter of the command being run
+            (e.g. 'bytes_read', 'bytes_written').
+        """
+        if self.metrics is not None:
+            self.metrics.record(name, value)
+
+    def check_aborted(self):
+        """ Raises cancellation.Aborted if the client aborted the command
+            being run. Called from the long loops of the drivers.
+        """
+        if self.cancellation is not None:
+            self.cancellation.check()
+
+    def get_warm_tasks(self):
+        """ Returns the units of work (picklable values, run by `warm`)
+            filling the caches of the volume, for `manage.py elfinder_warm`.
+        """
+        return []
+
+    def warm(self, task):
+        """ Fills the caches of the volume for one of the tasks returned by
+            `get_warm_tasks` and returns the number of entries processed.
+        """
+        raise NotImplementedError
 
     def get_volume_id(self):
         """ Returns the volume ID for the volume, which is used as a prefix
@@ -18,6 +80,14 @@ class BaseVolumeDriver(object):
         """
         raise NotImplementedError
 
+    def get_volume_key(self):
+        """ Returns the key of the volume in the state shared by the
+            processes: usage counters, throttles, locks and upload chunks.
+            The volume ID is short, to prefix the hashes, and may be the
+            same for two volumes.
+        """
+        return self.get_volume_id()
+
     def _get_connector_url(self):
         """:return url of driver connector"""
         view_name = self.kwargs.get('connector_url_view_name',
@@ -51,14 +121,99 @@ class BaseVolumeDriver(object):
     def get_options(self):
         """Volume config defaults"""
         options = {
-            'uplMaxSize': '128M',
+            'uplMaxSize': self.kwargs.get('upload_max_size', '128M'),
             'options': {'separator': '/',
                         'disabled': [],
-                        'copyOverwrite': 1}
+                        'copyOverwrite': 1,
+                        'uploadMaxConn': self.upload_max_conn}
         }
         options.update(self.kwargs.get('js_api_options', {}))
         return options
 
+    @cached_property
+    def upload_max_size(self):
+        """ The largest file (in bytes) that can be uploaded to the volume,
+            as advertised to the client by uplMaxSize; None if unlimited.
+        """
+        size = self.get_options().get('uplMaxSize')
+        if not size:
+            return None
+        return parse_size(size) or None
+
+    @cached_property
+    def quota(self):
+        """ The quota of the volume in bytes, None if unlimited: the 'quota'
+            option ('10G'), or what the 'quota_func' option (a callable or
+            its dotted path) returns for the request, e.g. per user. The
+            request is None outside of the connector.
+        """
+        quota_func = self.kwargs.get('quota_func')
+        if quota_func is not None:
+            if isinstance(quota_func, string_types):
+                quota_func = import_string(quota_func)
+            quota = quota_func(self.request)
+        else:
+            quota = self.kwargs.get('quota')
+        return parse_size(quota) if quota is not None else None
+
+    def get_usage(self):
+        """ Returns the number of bytes used by the volume, from a counter
+            maintained by its writes (not by walking it), or None if the
+            counter was not created yet (see `reconcile_usage`).
+        """
+        raise NotImplementedError
+
+    def add_usage(self, delta):
+        """ Adds delta bytes to the usage counter of the volume. Drivers
+            call it for their writes; others (e.g. the connector extracting
+            an archive) call it when they write to the volume directly.
+        """
+
+    def reconcile_usage(self):
+        """ Recomputes the usage counter from the contents of the volume
+            and returns the usage, for `manage.py elfinder_usage`.
+        """
+        return None
+
+    def get_free_space(self):
+        """ Returns the number of bytes that can still be written to the
+            volume, or None if it is not limited (or its usage is unknown).
+        """
+        if self.quota is None:
+            return None
+        usage = self.get_usage()
+        if usage is None:
+            logger.warning('The usage of the volume %s is unknown: its quota is not '
+                           'enforced until manage.py elfinder_usage runs.',
+                           self.get_volume_id())
+            return None
+        return max(self.quota - usage, 0)
+
+    def check_free_space(self, size):
+        """ Raises QuotaExceeded if size more bytes do not fit in the volume. """
+        if size <= 0:
+            return
+        free_space = self.get_free_space()
+        if free_space is not None and size > free_space:
+            raise QuotaExceeded('Quota exceeded')
+
+    def get_upload_mime(self, name, content_type=None):
+        """ Returns the MIME type checked against the allow-lists for an
+            uploaded file (the type declared by the client is only used
+            when the name does not tell).
+        """
+        return mimetypes.guess_type(name)[0] or content_type or 'application/octet-stream'
+
+    def is_upload_allowed(self, mime):
+        """ Checks mime against the 'upload_allow' and 'upload_deny' options
+            (lists of types, such as 'image/png', or of major types, such
+            as 'image'). Denied types win; all types are allowed by default.
+        """
+        if mime_matches(mime, self.kwargs.get('upload_deny') or ()):
+            return False
+        allow = self.kwargs.get('upload_allow')
+        return allow is None or mime_matches(mime, allow)
+
     def get_index_template(self, template):
         """Template that render the index view."""
         return self.kwargs.get('index_template', template)
@@ -74,6 +229,19 @@ class BaseVolumeDriver(object):
         """
         raise NotImplementedError
 
+    def get_version(self, target, ancestors=False):
+        """ Returns a token that changes whenever the listing of the target
+            directory changes. It is used by the connector to build ETags for
+            'open', 'tree', 'parents' and 'ls' responses.
+
+            :param target: The hash of the directory.
+            :param ancestors: The listing also includes the ancestors of the
+            target (and their siblings).
+            :returns: str -- the version token, or None if the volume does not
+            support conditional responses.
+        """
+        return None
+
     def zip_download(self, targets, dl=False):
         """ Prepare files for download
 
@@ -94,6 +262,17 @@ class BaseVolumeDriver(object):
         """
         raise NotImplementedError
 
+    def get_parents(self, target, **kwargs):
+        """ Gets a list of dicts describing the directories the client needs
+            to draw the tree down to target: target, its ancestors and
+            their sibling directories (the 'parents' command).
+
+            :param target: The hash of the directory.
+            :returns: list -- a list of dicts describing directories.
+        """
+        tree = self.get_tree(target, ancestors=True, siblings=True, **kwargs)
+        return [info for info in tree if info['mime'] == 'directory']
+
     def read_file_view(self, request, hash):
         """ Django view function, used to display files in response to the
             'file' command.
@@ -104,6 +283,26 @@ class BaseVolumeDriver(object):
         """
         raise NotImplementedError
 
+    def read_chunks(self, target):
+        """ Returns an iterator over the contents of the target file, as
+            chunks of bytes. The target is resolved before the iterator is
+            returned, so invalid targets raise immediately.
+
+            :param target: The hash of the file.
+        """
+        raise NotImplementedError
+
+    def write_chunks(self, name, parent, chunks):
+        """ Creates (or overwrites) the file name in the parent directory with
+            the given contents.
+
+            :param name: The name of the file.
+            :param parent: The hash of the parent directory.
+            :param chunks: An iterable of chunks of bytes.
+            :returns: dict -- a dict describing the file.
+        """
+        raise NotImplementedError
+
     def get(self, target, conv):
         """ Returns the content as String (As UTF-8)
         :param target : hash of the file
@@ -165,7 +364,28 @@ class BaseVolumeDriver(object):
     def duplicate(self, targets):
         """Creates a copy of the directory / file. Copy name is generated as follows:
         basedir_name_filecopy+serialnumber.extension (if any)
+
+        :param targets: A list of hashes of files/dirs to duplicate.
+        :returns: dict -- a dict describing the copies ('added').
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def get_duplicate_name(name, existing, is_dir=False):
+        """ Returns the first free 'name copy N.ext' name and adds it to
+            existing (the set of names already used in the directory).
         """
+        if is_dir:
+            base, ext = name, ''
+        else:
+            base, ext = os.path.splitext(name)
+        number = 1
+        while True:
+            new_name = '%s copy %d%s' % (base, number, ext)
+            if new_name not in existing:
+                existing.add(new_name)
+                return new_name
+            number += 1
 
     def list(self, target):
         """ Lists the contents of a directory.
@@ -213,6 +433,26 @@ class BaseVolumeDriver(object):
         """
         raise NotImplementedError
 
+    def purge_trash(self):
+        """ Deletes for good what remove put in the trash of the volume
+            ('trash' option). Returns the number of files deleted.
+        """
+        return 0
+
+    def schedule_purge(self):
+        """ Purges the trash in a background thread, unless the
+            'trash_reaper' option is off (e.g. to purge from cron with
+            `manage.py elfinder_purge_trash` instead).
+        """
+        if self.kwargs.get('trash_reaper', True):
+            get_thread_pool('trash', 1).submit(call_with_db_cleanup, self._purge_in_background)
+
+    def _purge_in_background(self):
+        try:
+            self.purge_trash()
+        except Exception as e:
+            logger.exception(e)
+
     def upload(self, files, parent):
         """ Uploads one or more files in to the parent directory.
 
@@ -223,7 +463,7 @@ class BaseVolumeDriver(object):
             :returns: TODO
         """
 
-    def upload_chunked(self, files, target, cid, chunk, bytes_range):
+    def upload_chunked(self, files, target, cid, chunk, bytes_range, **kwargs):
         """
         Chunking arguments:
         chunk : chunk name "filename.[NUMBER]_[TOTAL].part"
@@ -231,8 +471,11 @@ class BaseVolumeDriver(object):
         range : Bytes range of file "Start byte,Chunk length,Total bytes
         """
 
-    def upload_chunked_req(self, files, parent, chunk):
+    def upload_chunked_req(self, files, parent, chunk, **kwargs):
         """Chunk merge request (When receive _chunkmerged, _name)"""
 
     def abort(self, reqid):
-        """Aborts an operation in progress."""
\ No newline at end of file
+        """ Aborts an operation in progress. The commands checking
+            check_aborted stop by themselves; this is for the drivers
+            which can do more (e.g. cancel a remote transfer).
+        """
\ No newline at end of file
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+""" File copies for the filesystem driver.
+
+copy_file tries, in order: a reflink clone (FICLONE, instant on CoW
+filesystems such as btrfs and XFS), os.copy_file_range and os.sendfile
+(the kernel copies the bytes), and finally a plain read/write loop.
+Methods that fail between two devices are not retried for them; a method
+that copies fewer bytes than the size of the file is given up for that
+file only.
+
+copy_tree copies the files of a directory tree in a thread pool. Both
+preserve the mode and modification times of what they copy.
+"""
+import errno
+import os
+import shutil
+import threading
+
+from elfinder.helpers import get_thread_pool
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+CHUNK_SIZE = 1024 * 1024
+
+# errors meaning "this method is not available here", not "the copy failed"
+UNSUPPORTED_ERRORS = set(getattr(errno, name) for name in (
+    'ENOSYS', 'ENOTSUP', 'EOPNOTSUPP', 'EXDEV', 'EINVAL', 'ENOTTY', 'EBADF')
+    if hasattr(errno, name))
+
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+
+def _is_supported(method, devices):
+    return (method, devices) not in _unsupported
+
+
+def _set_unsupported(method, devices):
+    with _unsupported_lock:
+        _unsupported.add((method, devices))
+
+
+def _reflink(fsrc, fdst, size):
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    # A clone is all or nothing.
+    return size
+
+
+def _copy_file_range(fsrc, fdst, size):
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(size - copied, 1 << 30))
+        if count == 0:
+            break
+        copied += count
+    return copied
+
+
+def _sendfile(fsrc, fdst, size):
+    copied = 0
+    while copied < size:
+        count = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, min(size - copied, 1 << 30))
+        if count == 0:
+            break
+        copied += count
+    return copied
+
+
+def _kernel_methods():
+    methods = []
+    if fcntl is not None:
+        methods.append(('reflink', _reflink))
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', _copy_file_range))
+    if hasattr(os, 'sendfile'):
+        methods.append(('sendfile', _sendfile))
+    return methods
+
+
+def copy_file(src, dst):
+    """ Copies the contents, mode and times of the file src to dst. """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        stat = os.fstat(fsrc.fileno())
+        devices = (stat.st_dev, os.fstat(fdst.fileno()).st_dev)
+        for method, copy in _kernel_methods():
+            if not _is_supported(method, devices):
+                continue
+            try:
+                if copy(fsrc, fdst, stat.st_size) == stat.st_size:
+                    break
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                _set_unsupported(method, devices)
+            # A partial copy may have happened before the error or the
+            # short count.
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        else:
+            shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+    shutil.copystat(src, dst)
+
+
+def copy_tree(src, dst, workers=4, check=None):
+    """ Copies the directory src to dst (which must not exist).
+
+        Directories are created first, then the files are copied by
+        `workers` threads. Symbolic links are recreated, not followed.
+
+        check, if given, is called before each file is copied; when it
+        raises, the copy stops, dst is removed and the exception re-raised.
+    """
+    directories = []
+    files = []
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.normpath(os.path.join(dst, os.path.relpath(dirpath, src)))
+        os.mkdir(target_dir)
+        directories.append((dirpath, target_dir))
+        for name in dirnames:
+            source = os.path.join(dirpath, name)
+            # os.walk does not descend into links to directories.
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), os.path.join(target_dir, name))
+        for name in filenames:
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+            else:
+                files.append((source, target))
+
+    # the exception raised by check, once it has
+    stopped = []
+
+    def copy(paths):
+        if stopped:
+            return None
+        if check is not None:
+            try:
+                check()
+            except Exception as e:
+                stopped.append(e)
+                return None
+        try:
+            copy_file(*paths)
+        except (IOError, OSError) as e:
+            return '%s: %s' % (paths[0], e)
+
+    if workers > 1 and len(files) > 1:
+        errors = get_thread_pool('fs-copy', workers).map(copy, files)
+    else:
+        errors = [copy(paths) for paths in files]
+    errors = [error for error in errors if error]
+    if stopped:
+        shutil.rmtree(dst, ignore_errors=True)
+        raise stopped[0]
+
+    # Copying the files changed the mtimes of the new directories.
+    for source, target in reversed(directories):
+        shutil.copystat(source, target)
+    if errors:
+        raise shutil.Error(errors)
@@ -1,19 +1,41 @@
 # coding: utf-8
-import mimetypes as mimes
-
+import base64
 import chardet
+import collections
+import errno
+import functools
 import hashlib
+import mmap
 import os
 import re
 import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import uuid
 from datetime import datetime
 from django.conf import settings
+from django.core.cache import cache as shared_cache
 from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
 from django.utils.encoding import smart_text, smart_str, force_bytes
+from django.utils.functional import cached_property
 from django.utils.six import binary_type
 
+from elfinder.cancellation import Aborted
+from elfinder.checksums import (checksum_chunks, checksum_data, format_checksum,
+                                get_file_checksum, new_hasher, set_file_checksum)
 from elfinder.conf import settings as elfinder_settings
-from elfinder.volume_drivers.base import BaseVolumeDriver
+from elfinder.helpers import get_thread_pool, lower_io_priority
+from elfinder.throttling import get_request_user
+from elfinder.uploads import CHUNK_NAME, ChunkStore, parse_chunk
+from elfinder.volume_drivers.base import BaseVolumeDriver, QuotaExceeded, check_name
+from elfinder.volume_drivers.fs_copy import copy_file, copy_tree
+from elfinder.volume_drivers.fs_mime import get_mime_resolver
+from elfinder.volume_drivers.fs_watch import get_watcher
 
 try:
     import urllib.parse as urllib
@@ -25,11 +47,42 @@ try:
 except ImportError:
     import pathlib2 as pathlib
 
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+try:
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+
+# bytes looked at to detect an encoding
+ENCODING_SAMPLE_SIZE = 64 * 1024
+# files larger than this are mapped in memory instead of read
+MMAP_THRESHOLD = 1024 * 1024
+# directories whose detected name encoding is remembered
+NAME_ENCODING_CACHE_SIZE = 1024
+
+_name_encodings = {}
+
 
 class FileExists(IOError):
     pass
 
 
+def detect_encoding(value):
+    """ Returns the encoding of the bytes value, detected on its first
+        ENCODING_SAMPLE_SIZE bytes (with charset-normalizer if installed,
+        chardet otherwise), or None.
+    """
+    sample = bytes(value[:ENCODING_SAMPLE_SIZE])
+    if charset_normalizer is not None:
+        match = charset_normalizer.from_bytes(sample).best()
+        return match.encoding if match is not None else None
+    return chardet.detect(sample).get('encoding')
+
+
 class WrapperBase(object):
     def __init__(self, root, **options):
         self.root = root
@@ -58,12 +111,36 @@ class WrapperBase(object):
         return DirectoryWrapper(self.path.parent, self.root, **self.options).get_hash()
 
     @staticmethod
-    def bytes_safe_decode(value, encoding='utf-8'):
-        if isinstance(value, binary_type):
-            spec = chardet.detect(value)
-            encoding = spec.get('encoding', encoding) or encoding
-            value = smart_text(value, encoding=encoding)
-        return value
+    def bytes_safe_decode(value, encoding='utf-8', directory=None):
+        """ Decodes a binary file name. UTF-8 and the filesystem encoding
+            are tried first; the encoding is only detected when both fail,
+            and is then remembered for the other names of `directory`.
+        """
+        if not isinstance(value, binary_type):
+            return value
+        fs_encoding = sys.getfilesystemencoding() or encoding
+        for candidate in (encoding, fs_encoding, _name_encodings.get(directory)):
+            if candidate:
+                try:
+                    return value.decode(candidate)
+                except (UnicodeDecodeError, LookupError):
+                    pass
+        detected = detect_encoding(value)
+        if detected:
+            try:
+                value = value.decode(detected)
+            except (UnicodeDecodeError, LookupError):
+                pass
+            else:
+                if directory is not None:
+                    if len(_name_encodings) >= NAME_ENCODING_CACHE_SIZE:
+                        _name_encodings.clear()
+                    _name_encodings[directory] = detected
+                return value
+        try:
+            return value.decode(fs_encoding, 'surrogateescape')
+        except LookupError:  # Python 2
+            return smart_text(value, encoding=encoding, errors='replace')
 
     def _real_hash(self, path):
         enc_path = force_bytes(str(path),
@@ -94,6 +171,9 @@ class FileWrapper(WrapperBase):
     @path.setter
     def path(self, path):
         self._file_path = path
+        self.close()
+
+    def close(self):
         if self._file is not None:
             self._file.close()
             self._file = None
@@ -123,11 +203,59 @@ class FileWrapper(WrapperBase):
 
     contents = property(get_contents, set_contents)
 
+    def read_text(self, encoding=None):
+        """ Returns (text, encoding). Without encoding, UTF-8 is tried first,
+            then the detected encoding; text is None if the contents could
+            not be decoded. Large files are decoded straight from a memory
+            map, without an intermediate copy.
+        """
+        with self.path.open('rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if size == 0:
+                return '', encoding or 'utf-8'
+            if size >= MMAP_THRESHOLD:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = fp.read()
+            try:
+                encodings = [encoding] if encoding else ['utf-8', detect_encoding(data)]
+                for encoding in encodings:
+                    if not encoding:
+                        continue
+                    try:
+                        return str(data, encoding) if isinstance(data, mmap.mmap) \
+                            else data.decode(encoding), encoding
+                    except (UnicodeDecodeError, LookupError):
+                        pass
+                return None, None
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+
+    def replace_contents(self, data):
+        """ Atomically replaces the contents: data is written to a temporary
+            file next to this one, which is then renamed over it.
+        """
+        self.close()
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent),
+                                        prefix='.%s.' % self.path.name)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+                fp.flush()
+                os.fsync(fp.fileno())
+            shutil.copymode(str(self.path), tmp_path)
+            os.rename(tmp_path, str(self.path))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
     def get_info(self):
         path = self.path
         spath = str(path)
         info = {
-            'name': self.bytes_safe_decode(path.name),
+            'name': self.bytes_safe_decode(path.name, directory=str(path.parent)),
             'hash': self.get_hash(),
             'date': datetime.fromtimestamp(path.stat().st_mtime).strftime("%d %b %Y %H:%M"),
             'size': self.get_size(),
@@ -138,7 +266,7 @@ class FileWrapper(WrapperBase):
             'phash': self.get_parent_hash() or '',
         }
         if settings.DEBUG:
-            info['abs_path'] = self.bytes_safe_decode(spath)
+            info['abs_path'] = self.bytes_safe_decode(spath, directory=str(path.parent))
 
         mime, is_image = self.get_mime(spath)
         # if is_image and self.imglib and False:
@@ -168,7 +296,7 @@ class FileWrapper(WrapperBase):
         return urllib.quote_plus(fs_driver_url + rel_path, safe="/")
 
     def get_mime(self, path):
-        mime = mimes.guess_type(path)[0] or 'Unknown'
+        mime = get_mime_resolver().guess(path) or 'Unknown'
         if mime.startswith('image/'):
             return mime, True
         else:
@@ -209,7 +337,7 @@ class DirectoryWrapper(WrapperBase):
         path = self.path
         spath = str(path)
         info = {
-            'name': self.bytes_safe_decode(path.name),
+            'name': self.bytes_safe_decode(path.name, directory=str(path.parent)),
             'hash': self.get_hash(),
             'date': datetime.fromtimestamp(path.stat().st_mtime).strftime("%d %b %Y %H:%M"),
             'mime': 'directory',
@@ -225,7 +353,7 @@ class DirectoryWrapper(WrapperBase):
             info['size'] = self.get_size()
 
         if settings.DEBUG:
-            info['abs_path'] = self.bytes_safe_decode(spath)
+            info['abs_path'] = self.bytes_safe_decode(spath, directory=str(path.parent))
         return info
 
     def get_size(self):
@@ -256,7 +384,251 @@ class DirectoryWrapper(WrapperBase):
             raise Exception("Directory '%s' already exists" % os.path.basename(dir_path))
 
 
+class PathIndex(object):
+    """ A mapping with at most `size` entries, each stored under a path,
+        that drops the least recently used ones. The paths are indexed by
+        directory, so that `forget_tree` only visits the forgotten entries.
+        Thread-safe.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._values = collections.OrderedDict()  # key -> (path, value)
+        self._keys = {}  # path -> key
+        # directory -> its children that are stored or have stored descendants
+        self._children = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(list(self._values))
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                item = self._values.pop(key)
+            except KeyError:
+                return default
+            self._values[key] = item
+            return item[1]
+
+    def set(self, key, path, value):
+        path = str(path)
+        with self._lock:
+            self.pop(key)
+            if path in self._keys:
+                self.pop(self._keys[path])
+            self._values[key] = (path, value)
+            self._keys[path] = key
+            self._link(path)
+            while len(self._values) > self.size:
+                self.pop(next(iter(self._values)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                path, value = self._values.pop(key)
+            except KeyError:
+                return default
+            del self._keys[path]
+            self._unlink(path)
+            return value
+
+    def forget_tree(self, path):
+        """ Drops the entries stored under path or its descendants. """
+        path = str(path)
+        with self._lock:
+            pending = [path]
+            while pending:
+                current = pending.pop()
+                pending.extend(self._children.pop(current, ()))
+                if current in self._keys:
+                    self.pop(self._keys[current])
+            self._unlink(path)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._keys.clear()
+            self._children.clear()
+
+    def _link(self, path):
+        parent = os.path.dirname(path)
+        while parent != path:
+            linked = parent in self._children or parent in self._keys
+            self._children.setdefault(parent, set()).add(path)
+            if linked:
+                return
+            path, parent = parent, os.path.dirname(parent)
+
+    def _unlink(self, path):
+        if path in self._children or path in self._keys:
+            return
+        parent = os.path.dirname(path)
+        while parent != path:
+            children = self._children.get(parent)
+            if children is None:
+                return
+            children.discard(path)
+            if children:
+                return
+            del self._children[parent]
+            if parent in self._keys:
+                return
+            path, parent = parent, os.path.dirname(parent)
+
+
+class VolumeCache(object):
+    """ Caches of a volume root: the path of each hash, and the size and
+        counts of directories. They are kept in the process and, so that
+        other processes (e.g. `manage.py elfinder_warm`) can fill them, in
+        the Django cache.
+
+        A hash is derived from its path, so an indexed path is valid as long
+        as it exists. Directory sizes are only cached for watched volumes,
+        where the changes feed invalidates them; the shared ones are also
+        checked against the inode of the directory, and dropped whenever a
+        process starts watching the root (see `start_watching`). In the
+        process, each cache keeps the `max_entries` most recently used.
+    """
+    # entries written to the Django cache at once
+    batch_size = 1000
+    # entries of each cache kept in the process
+    max_entries = 100000
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.paths = PathIndex(self.max_entries)
+        self.sizes = PathIndex(self.max_entries)
+        self.watched = False
+        self._lock = threading.Lock()
+        self._prefix = 'elfinder:fs:%s' % hashlib.md5(force_bytes(self.root)).hexdigest()
+
+    def _key(self, kind, name):
+        return '%s:%s:%s' % (self._prefix, kind, hashlib.md5(force_bytes(name)).hexdigest())
+
+    def _set_many(self, values):
+        values = list(values.items())
+        for start in range(0, len(values), self.batch_size):
+            shared_cache.set_many(dict(values[start:start + self.batch_size]), None)
+
+    def get_path(self, fhash):
+        path = self.paths.get(fhash)
+        if path is None:
+            path = shared_cache.get(self._key('path', fhash))
+            if path is not None:
+                path = pathlib.Path(path)
+                self.paths.set(fhash, path, path)
+        return path
+
+    def set_paths(self, paths, shared=False):
+        """ paths maps hashes to paths. """
+        for fhash, path in paths.items():
+            self.paths.set(fhash, path, path)
+        if shared:
+            self._set_many(dict((self._key('path', fhash), str(path))
+                                for fhash, path in paths.items()))
+
+    def forget_path(self, fhash):
+        self.paths.pop(fhash)
+        shared_cache.delete(self._key('path', fhash))
+
+    def get_generation(self):
+        """ Returns the token of the shared sizes, replaced by `clear`. """
+        key = '%s:generation' % self._prefix
+        generation = shared_cache.get(key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            shared_cache.add(key, generation, None)
+            generation = shared_cache.get(key, generation)
+        return generation
+
+    def get_size(self, path):
+        size = self.sizes.get(path)
+        if size is not None:
+            return size
+        value = shared_cache.get(self._key('size:%s' % self.get_generation(), path))
+        if value is None:
+            return None
+        inode, size = value[0], tuple(value[1:])
+        try:
+            if os.lstat(path).st_ino != inode:
+                return None
+        except OSError:
+            return None
+        self.sizes.set(path, path, size)
+        return size
+
+    def set_sizes(self, sizes, shared=False):
+        """ sizes maps directory paths to (size, file count, directory count). """
+        for path, size in sizes.items():
+            self.sizes.set(path, path, size)
+        if shared:
+            generation = self.get_generation()
+            values = {}
+            for path, size in sizes.items():
+                try:
+                    inode = os.lstat(path).st_ino
+                except OSError:
+                    continue
+                values[self._key('size:%s' % generation, path)] = (inode,) + tuple(size)
+            self._set_many(values)
+
+    def invalidate(self, paths):
+        """ Forgets what is cached about paths, their descendants and
+            (for sizes) their ancestors.
+        """
+        changed = set(paths)
+        ancestors = set()
+        for path in changed:
+            parent = os.path.dirname(path)
+            while parent not in ancestors and parent != path:
+                ancestors.add(parent)
+                path, parent = parent, os.path.dirname(parent)
+        for path in changed:
+            self.paths.forget_tree(path)
+            self.sizes.forget_tree(path)
+        for path in ancestors:
+            self.sizes.pop(path)
+        # Shared sizes of removed descendants fail the inode check.
+        generation = self.get_generation()
+        shared_cache.delete_many([self._key('size:%s' % generation, path)
+                                  for path in changed | ancestors])
+
+    def start_watching(self):
+        """ Called when the process starts watching the root: the shared
+            sizes may have missed the changes made while no process did.
+        """
+        with self._lock:
+            if self.watched:
+                return
+            self.watched = True
+        self.clear()
+
+    def clear(self):
+        self.paths.clear()
+        self.sizes.clear()
+        shared_cache.set('%s:generation' % self._prefix, uuid.uuid4().hex, None)
+
+
+_volume_caches = {}
+_volume_caches_lock = threading.Lock()
+
+
+def get_volume_cache(root):
+    with _volume_caches_lock:
+        if str(root) not in _volume_caches:
+            _volume_caches[str(root)] = VolumeCache(root)
+        return _volume_caches[str(root)]
+
+
 class FileSystemVolumeDriver(BaseVolumeDriver):
+    upload_max_conn = 3
 
     def __init__(self, fs_driver_root=settings.MEDIA_ROOT, *args, **kwargs):
         super(FileSystemVolumeDriver, self).__init__(*args, **kwargs)
@@ -264,77 +636,414 @@ class FileSystemVolumeDriver(BaseVolumeDriver):
                                              elfinder_settings.ELFINDER_FS_DRIVER_URL)
         self.root = pathlib.Path(fs_driver_root).resolve()
 
+    @cached_property
+    def cache(self):
+        return get_volume_cache(self.root)
+
+    @cached_property
+    def checksums(self):
+        """ Whether the checksums of the files are computed as they are
+            written and listed in their info ('checksums' option).
+        """
+        return bool(self.kwargs.get('checksums', False))
+
+    @cached_property
+    def trash_dir(self):
+        """ Where remove moves directories with the 'trash' option: the
+            given path, or a directory next to the root for True. It must be
+            on the filesystem of the root, for the move to be a rename.
+        """
+        trash = self.kwargs.get('trash')
+        if not trash:
+            return None
+        if trash is True:
+            return self.root.parent / ('.%s.trash' % self.root.name)
+        return pathlib.Path(trash)
+
+    @cached_property
+    def chunk_store(self):
+        return ChunkStore(self.kwargs.get('upload_chunk_dir'))
+
+    @cached_property
+    def watcher(self):
+        """ With the 'watch' option, the inotify watcher feeding the changes
+            made to the volume (by anyone) to the caches.
+        """
+        if not self.kwargs.get('watch'):
+            return None
+        return get_watcher(str(self.root), int(self.kwargs.get('watch_queue_size', 10000)))
+
+    def _is_watched(self):
+        """ Whether the watcher watches the whole volume, so that the
+            directory sizes can be cached.
+        """
+        if self.watcher is None or not self.watcher.ready.is_set():
+            return False
+        self.cache.start_watching()
+        return True
+
+    def _sync_cache(self):
+        if self.watcher is None:
+            return
+        self.watcher.poll()
+        paths, overflowed = self.watcher.journal.consume()
+        if overflowed:
+            self.cache.clear()
+        elif paths:
+            self.cache.invalidate(paths)
+
     def get_volume_id(self):
         return DirectoryWrapper(self.root, self.root, **self.kwargs).get_hash().split("_")[0]
 
+    def get_volume_key(self):
+        return 'fs_%s' % hashlib.sha1(force_bytes(str(self.root))).hexdigest()
+
+    def get_free_space(self):
+        """ The space left by the quota, or on the filesystem of the root
+            (for unprivileged users) if that is less.
+        """
+        free_space = super(FileSystemVolumeDriver, self).get_free_space()
+        try:
+            stat = os.statvfs(str(self.root))
+        except (AttributeError, OSError):  # Windows
+            return free_space
+        disk_space = stat.f_bavail * stat.f_frsize
+        return disk_space if free_space is None else min(free_space, disk_space)
+
+    def get_usage(self):
+        """ The usage of volumes with a quota is counted in the database
+            (VolumeUsage). The counter is created by `reconcile_usage`, out
+            of the requests (`manage.py elfinder_usage` or `elfinder_warm`).
+        """
+        # The models are only needed by volumes with a quota.
+        from elfinder.models import VolumeUsage
+        return VolumeUsage.objects.filter(volume_id=self.get_volume_key()).values_list(
+            'usage', flat=True).first()
+
+    def add_usage(self, delta):
+        if self.quota is None or not delta:
+            return
+        from elfinder.models import VolumeUsage
+        VolumeUsage.objects.filter(volume_id=self.get_volume_key()).update(
+            usage=F('usage') + delta)
+
+    def reconcile_usage(self):
+        """ Walks the volume and sets the counter to its size. The walk may
+            or may not see the writes made while it runs; they are counted
+            right by the next run.
+        """
+        from elfinder.models import VolumeUsage
+        size = self._walk_directory_size(str(self.root))[0]
+        VolumeUsage.objects.update_or_create(volume_id=self.get_volume_key(), defaults={
+            'usage': size, 'reconciled': timezone.now()})
+        return size
+
+    def _get_size(self, path):
+        """ Returns the bytes held by the file or directory at path. """
+        path = str(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            return self._get_directory_size(path)[0]
+        return self._get_file_size(path)
+
+    def get_upload_mime(self, name, content_type=None):
+        return (get_mime_resolver().guess_extension(name) or content_type or
+                'application/octet-stream')
+
     def get_info(self, target):
         path = self._find_path(target)
         return self._get_path_info(path)
 
-    def search(self, text, target):
+    def get_version(self, target, ancestors=False):
+        """ The version is derived from the stats of the target directory
+            (and its ancestors) and of the entries they hold: the mtime of a
+            directory changes whenever an entry is added, removed or renamed
+            in it, and those of its entries when they are edited in place or
+            when a subdirectory gains or loses entries. Only the
+            subdirectories of the ancestors are listed by the client, so
+            only theirs are stated.
+        """
+        path = self._find_path(target)
+        if path is None or not path.is_dir():
+            return None
+        paths = [path]
+        if ancestors:
+            proc_path = path
+            while proc_path != self.root and proc_path != proc_path.parent:
+                proc_path = proc_path.parent
+                paths.append(proc_path)
+        version = []
+        for index, item in enumerate(paths):
+            dir_stat = item.stat()
+            entries = hashlib.md5()
+            for name, entry in sorted(self._stat_entries(str(item), dirs_only=index > 0)):
+                entries.update(force_bytes('%s\0%d\0%r\0%d\0' % (
+                    name, entry.st_ino, entry.st_mtime, entry.st_size)))
+            version.append('%s-%r-%s' % (dir_stat.st_ino, dir_stat.st_mtime, entries.hexdigest()))
+        return ':'.join(version)
+
+    @staticmethod
+    def _stat_entries(path, dirs_only=False):
+        """ Returns (name, lstat) of the entries of the directory path, or
+            of its subdirectories only.
+        """
+        stats = []
+        scandir = getattr(os, 'scandir', None)
+        if scandir is not None:
+            for entry in scandir(path):
+                try:
+                    # is_dir uses the type read with the entry, without a call
+                    if not dirs_only or entry.is_dir(follow_symlinks=False):
+                        stats.append((entry.name, entry.stat(follow_symlinks=False)))
+                except OSError:
+                    continue
+            return stats
+        for name in os.listdir(path):
+            try:
+                entry_stat = os.lstat(os.path.join(path, name))
+            except OSError:
+                continue
+            if not dirs_only or stat.S_ISDIR(entry_stat.st_mode):
+                stats.append((name, entry_stat))
+        return stats
+
+    def search(self, text, target, reqid=None):
         """Search for files"""
         path = self._find_path(target)
         ptext = "|".join([re.escape(v) for v in text.split() if v])
         pattern = re.compile("(?:%s)" % ptext, re.I | re.U)
-        result = []
+        matches = []
         for dirpath, dirnames, filenames in os.walk(str(path)):
-            for dirname in dirnames:
-                if pattern.search(dirname):
-                    info = DirectoryWrapper(path.joinpath(dirpath, dirname), self.root, **self.kwargs).get_info()
-                    result.append(info)
-            for filename in filenames:
-                if pattern.search(filename):
-                    info = FileWrapper(path.joinpath(dirpath, filename),
-                                       self.root,
-                                       self.fs_driver_url).get_info()
-                    result.append(info)
-        return result
+            self.check_aborted()
+            for name in dirnames + filenames:
+                if pattern.search(name):
+                    matches.append(path.joinpath(dirpath, name))
+        return self._map(self._get_path_info, matches)
 
     def get_tree(self, target, ancestors=False, siblings=False, **kwargs):
         path = self._find_path(target)
 
-        tree = [self._get_path_info(path)]
-        tree.extend([self._get_path_info(self.root / child) for child in path.iterdir()])
+        paths = [path]
+        paths.extend([self.root / child for child in path.iterdir()])
 
         if ancestors:
-            proc_path = path
-            while proc_path != self.root:
-                tree.append(self._get_path_info(proc_path))
-                proc_path, head = proc_path.parent, proc_path.name
-                for ancestor_sibling in proc_path.iterdir():
-                    ancestor_sibling_abs = self.root / proc_path / ancestor_sibling
-                    if ancestor_sibling_abs.is_dir():
-                        tree.append(self._get_path_info(ancestor_sibling_abs))
+            paths.extend(self._get_ancestor_dirs(path))
 
         if siblings and not (path == self.root):
-            parent_path, curr_dir = path.parent, path.name
-            for sibling in parent_path.iterdir():
-                if sibling == curr_dir:
-                    continue
-                sibling_abs = self.root / parent_path / sibling
-                tree.append(self._get_path_info(sibling_abs))
-        # print
-        # print "*******************************************"
-        # print
-        # for t in tree:
-        #     print t
-        # print
-        return tree
+            for sibling in path.parent.iterdir():
+                if sibling != path:
+                    paths.append(self.root / sibling)
+        return self._map(self._get_path_info, self._unique(paths))
+
+    def get_parents(self, target, **kwargs):
+        path = self._find_path(target)
+        return self._map(self._get_path_info, self._unique([path] + self._get_ancestor_dirs(path)))
+
+    def _get_ancestor_dirs(self, path):
+        """ Returns the ancestors of path up to the root, and the directories
+            they contain. Only directories are looked at.
+        """
+        dirs = []
+        while path != self.root and path != path.parent:
+            path = path.parent
+            dirs.append(path)
+            for entry in scandir(str(path)):
+                if entry.is_dir():
+                    dirs.append(path / entry.name)
+        return dirs
+
+    @staticmethod
+    def _unique(paths):
+        """ Drops repeated paths (and so repeated hashes), keeping the order. """
+        unique = []
+        seen = set()
+        for path in paths:
+            if path not in seen:
+                seen.add(path)
+                unique.append(path)
+        return unique
+
+    def size(self, targets):
+        total_size = file_count = dir_count = 0
+        sizes = {}
+        for target in targets:
+            path = self._find_path(target)
+            if path.is_dir():
+                size, files, dirs = self._get_directory_size(str(path))
+                file_count += files
+                dir_count += dirs + 1
+            else:
+                size = path.lstat().st_size
+                file_count += 1
+            sizes[target] = size
+            total_size += size
+        return {'size': total_size,
+                'fileCnt': file_count,
+                'dirCnt': dir_count,
+                'sizes': sizes}
+
+    def _get_directory_size(self, path):
+        """ Returns (size, file count, directory count) of what path holds. """
+        self._sync_cache()
+        watched = self._is_watched()
+        if watched:
+            cached = self.cache.get_size(path)
+            if cached is not None:
+                return cached
+        size, file_count, dir_count = self._walk_directory_size(path)
+        # unless the watcher overflowed meanwhile
+        if watched and self.watcher.ready.is_set():
+            self.cache.set_sizes({path: (size, file_count, dir_count)})
+        return size, file_count, dir_count
+
+    def _walk_directory_size(self, path):
+        size = file_count = dir_count = 0
+        for dirpath, dirnames, filenames in os.walk(path):
+            self.check_aborted()
+            dir_count += len(dirnames)
+            file_count += len(filenames)
+            file_paths = [os.path.join(dirpath, filename) for filename in filenames]
+            size += sum(self._map(self._get_file_size, file_paths))
+        return size, file_count, dir_count
+
+    def get_warm_tasks(self):
+        """ One task per directory of the root, plus '' for the entries of
+            the root itself.
+        """
+        root = str(self.root)
+        return [''] + sorted(name for name in os.listdir(root)
+                             if os.path.isdir(os.path.join(root, name)) and
+                             not os.path.islink(os.path.join(root, name)))
+
+    def warm(self, task):
+        """ Indexes the hashes of the entries under the directory task of the
+            root and, on watched volumes, computes the sizes of its
+            directories. Returns the number of entries.
+        """
+        if not task:
+            paths = [self.root / name for name in os.listdir(str(self.root))]
+            self.cache.set_paths(dict((self._get_path_object(path).get_hash(), path)
+                                      for path in paths), shared=True)
+            return len(paths)
+
+        index = {}
+        sizes = {}
+        for dirpath, dirnames, filenames in os.walk(str(self.root / task), topdown=False):
+            self.check_aborted()
+            size, file_count, dir_count = 0, len(filenames), len(dirnames)
+            for name in dirnames:
+                # links to directories are not walked
+                child = sizes.get(os.path.join(dirpath, name), (0, 0, 0))
+                size += child[0]
+                file_count += child[1]
+                dir_count += child[2]
+            for name in filenames:
+                size += self._get_file_size(os.path.join(dirpath, name))
+            sizes[dirpath] = (size, file_count, dir_count)
+            for name in dirnames + filenames:
+                path = self.root.joinpath(dirpath, name)
+                index[self._get_path_object(path).get_hash()] = path
+        self.cache.set_paths(index, shared=True)
+        if self.kwargs.get('watch'):
+            self.cache.set_sizes(sizes, shared=True)
+        return len(index)
 
     def read_file_view(self, request, hash):
-        file_path = self._find_path(hash)
-        from django.http import HttpResponse
-        resp = HttpResponse(content_type='application/force-download')
-        file = FileWrapper(file_path, self.root,
+        from django.http import StreamingHttpResponse
+        return StreamingHttpResponse(self.read_chunks(hash),
+                                     content_type='application/force-download')
+
+    def read_chunks(self, target):
+        file = FileWrapper(self._find_path(target), self.root,
                            fs_driver_url=self.fs_driver_url)
-        for chunk in file.get_chunks():
-            resp.write(chunk)
+        chunks = file.get_chunks()
+
+        def iterate():
+            try:
+                for chunk in chunks:
+                    self.record('bytes_read', len(chunk))
+                    yield chunk
+            finally:
+                file.close()
+        return iterate()
+
+    def write_chunks(self, name, parent, chunks):
+        new_abs_path = self.root / self._find_path(parent) / check_name(name)
+        # Written next to the destination and renamed once complete, so
+        # a failed copy never leaves a truncated file behind.
+        tmp_path = new_abs_path.with_name('.%s.part' % name)
+        replaced = self._get_file_size(str(new_abs_path))
+        free_space = self.get_free_space()
+        written = 0
+        hasher = new_hasher() if self.checksums else None
+        if hasher is not None:
+            chunks = checksum_chunks(chunks, hasher)
+        try:
+            with tmp_path.open('wb') as fp:
+                for chunk in chunks:
+                    self.check_aborted()
+                    written += len(chunk)
+                    if free_space is not None and written - replaced > free_space:
+                        raise QuotaExceeded('Quota exceeded')
+                    fp.write(chunk)
+                    self.record('bytes_written', len(chunk))
+            os.rename(str(tmp_path), str(new_abs_path))
+        except Exception:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+        if hasher is not None:
+            set_file_checksum(str(new_abs_path), format_checksum(hasher))
+        self.add_usage(written - replaced)
+        return self._get_path_info(new_abs_path)
+
+    @cached_property
+    def edit_max_size(self):
+        """ Largest file (in bytes) get and put accept. """
+        return int(self.kwargs.get('edit_max_size', 10 * 1024 * 1024))
+
+    def get(self, target, conv=None):
+        file = FileWrapper(self._find_path(target), self.root,
+                           fs_driver_url=self.fs_driver_url)
+        if file.get_size() > self.edit_max_size:
+            raise Exception('File is too large to edit.')
+        # conv is '1'/'0' (detect the encoding) or the encoding to use
+        encoding = conv if conv not in (None, '', '0', '1') else None
+        content, encoding = file.read_text(encoding)
+        if content is None:
+            if conv == '1':
+                return {'content': False}
+            return {'doconv': 'unknown'}
+        result = {'content': content}
+        if encoding.lower().replace('_', '-') not in ('utf-8', 'ascii'):
+            result['encoding'] = encoding
+        return result
 
-        return resp
+    def putfile(self, target, content, encoding=None, **kwargs):
+        file = FileWrapper(self._find_path(target), self.root,
+                           fs_driver_url=self.fs_driver_url)
+        # The client sends binary contents as data URIs, with encoding
+        # 'scheme'; text that merely starts with 'data:' is saved as is.
+        if encoding == 'scheme':
+            header, _, data = content.partition(',')
+            if not header.startswith('data:') or not header.endswith(';base64'):
+                raise Exception('Unsupported content scheme.')
+            data = base64.b64decode(data)
+        else:
+            data = content.encode(encoding or 'utf-8')
+        if len(data) > self.edit_max_size:
+            raise Exception('File is too large to edit.')
+        delta = len(data) - file.get_size()
+        self.check_free_space(delta)
+        file.replace_contents(data)
+        if self.checksums:
+            set_file_checksum(str(file.path), checksum_data(data))
+        self.record('bytes_written', len(data))
+        self.add_usage(delta)
+        return file.get_info()
 
     def mkdir(self, name, parent):
         parent_path = self._find_path(parent)
-        new_abs_path = self.root / parent_path / name
+        new_abs_path = self.root / parent_path / check_name(name)
         return DirectoryWrapper.mkdir(new_abs_path, self.root, **self.kwargs).get_info()
 
     def mkfile(self, name, parent):
@@ -350,106 +1059,318 @@ class FileSystemVolumeDriver(BaseVolumeDriver):
             "removed": [target],
         }
 
+    def duplicate(self, targets):
+        added = []
+        # names used in each parent directory, listed once
+        names = {}
+        for target in targets:
+            self.check_aborted()
+            path = self._find_path(target)
+            parent = path.parent
+            if parent not in names:
+                names[parent] = set(os.listdir(str(parent)))
+            is_dir = path.is_dir()
+            new_path = parent / self.get_duplicate_name(path.name, names[parent], is_dir)
+            size = self._get_size(path) if self.quota is not None else 0
+            self.check_free_space(size)
+            if is_dir:
+                copy_tree(str(path), str(new_path), workers=int(self.kwargs.get('copy_workers', 4)),
+                          check=self.check_aborted)
+            else:
+                copy_file(str(path), str(new_path))
+            self.add_usage(size)
+            added.append(self._get_path_info(new_path))
+        return {'added': added}
+
     def list(self, target):
         dir_list = []
         for item in self.get_tree(target):
             dir_list.append(item['name'])
         return dir_list
 
-    def paste(self, targets, dest, cut):
+    def paste(self, targets, dest, cut, **kwargs):
         """ Moves/copies target files/directories from source to dest. """
         dest_dir = self._get_path_object(self._find_path(dest))
         added = []
         removed = []
         if dest_dir.is_dir():
             for target in targets:
+                self.check_aborted()
                 orig_abs_path = self._find_path(target)
                 orig_obj = self._get_path_object(orig_abs_path)
                 new_abs_path = self.root / dest_dir.path / orig_abs_path.name
                 if cut:
+                    # a rename when both paths are on the same device
                     _fnc = shutil.move
                     removed.append(orig_obj.get_info()['hash'])
+                elif orig_obj.is_dir():
+                    _fnc = functools.partial(copy_tree, workers=int(self.kwargs.get('copy_workers', 4)),
+                                             check=self.check_aborted)
                 else:
-                    if orig_obj.is_dir():
-                        _fnc = shutil.copytree
-                    else:
-                        _fnc = shutil.copy
+                    _fnc = copy_file
+                # a move within the volume does not change its usage, except
+                # for the file it replaces
+                size = replaced = 0
+                if self.quota is not None:
+                    if not cut:
+                        size = self._get_size(orig_abs_path)
+                    if not new_abs_path.is_dir():
+                        replaced = self._get_file_size(str(new_abs_path))
+                self.check_free_space(size - replaced)
                 _fnc(str(orig_abs_path), str(new_abs_path))
+                self.add_usage(size - replaced)
                 added.append(self._get_path_info(new_abs_path))
 
         return {"added": added,
                 "removed": removed}
 
     def remove(self, target):
-        obj = self._get_path_object(self._find_path(target))
+        path = self._find_path(target)
+        if self.trash_dir is not None and path.is_dir() and not path.is_symlink() \
+                and self._move_to_trash(path):
+            self.schedule_purge()
+            return
+        obj = self._get_path_object(path)
+        size = self._get_size(path) if self.quota is not None else 0
         obj.remove()
-
-    def upload(self, files, parent):
+        self.add_usage(-size)
+
+    def _move_to_trash(self, path):
+        """ Renames the directory path into the trash, where it counts in
+            the usage of the volume until purged. Returns False if the trash
+            is on another filesystem.
+        """
+        trash_dir = str(self.trash_dir)
+        if not os.path.isdir(trash_dir):
+            os.makedirs(trash_dir)
+        try:
+            os.rename(str(path), os.path.join(trash_dir, uuid.uuid4().hex))
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return False
+        return True
+
+    def purge_trash(self):
+        """ Deletes the directories of the trash bottom-up, with the I/O
+            priority of the thread lowered and a pause ('trash_pause'
+            seconds) every 'trash_batch_size' files. One process purges a
+            volume at a time.
+        """
+        if self.trash_dir is None or not self.trash_dir.is_dir():
+            return 0
+        lock = 'elfinder:trash:%s' % self.get_volume_key()
+        if not shared_cache.add(lock, 1, 3600):
+            return 0
+        lower_io_priority()
+        batch_size = int(self.kwargs.get('trash_batch_size', 1000))
+        pause = float(self.kwargs.get('trash_pause', 0.05))
+        count = 0
+        try:
+            for name in os.listdir(str(self.trash_dir)):
+                freed = 0
+                top = os.path.join(str(self.trash_dir), name)
+                if os.path.islink(top) or not os.path.isdir(top):
+                    os.unlink(top)
+                    continue
+                for dirpath, dirnames, filenames in os.walk(top, topdown=False):
+                    for filename in filenames:
+                        file_path = os.path.join(dirpath, filename)
+                        freed += self._get_file_size(file_path)
+                        os.unlink(file_path)
+                        count += 1
+                        if count % batch_size == 0:
+                            time.sleep(pause)
+                    for dirname in dirnames:
+                        dir_path = os.path.join(dirpath, dirname)
+                        # links to directories are listed, not walked
+                        if os.path.islink(dir_path):
+                            os.unlink(dir_path)
+                        else:
+                            os.rmdir(dir_path)
+                os.rmdir(top)
+                self.add_usage(-freed)
+        finally:
+            shared_cache.delete(lock)
+        return count
+
+    def upload(self, files, parent, **kwargs):
+        """ Streams the uploaded files into parent. With checksums, a file
+            identical to the one it would replace is left alone. The files
+            that could not be written are reported as warnings.
+        """
         added = []
-        parent = self._get_path_object(self._find_path(parent))
-        if parent.is_dir():
+        warnings = []
+        parent_path = self._find_path(parent)
+        if parent_path.is_dir():
             for upload in files.getlist('upload[]'):
-                new_abs_path = self.root / parent.path / upload.name
                 try:
-                    new_file = FileWrapper.mkfile(new_abs_path, self.root, self.fs_driver_url)
-                    new_file.contents = upload.read()
-                    added.append(new_file.get_info())
-                except Exception:
-                    pass
-        return {"added": added}
+                    info = self._get_identical_file(parent_path / upload.name, upload.size,
+                                                    upload.chunks())
+                    if info is None:
+                        info = self.write_chunks(upload.name, parent, upload.chunks())
+                    added.append(info)
+                except Aborted:
+                    raise
+                except QuotaExceeded:
+                    warnings.extend(['errUploadFile', upload.name, 'errUploadTotalSize'])
+                except Exception as e:
+                    warnings.extend(['errUploadFile', upload.name, '%s' % e])
+        result = {"added": added}
+        if warnings:
+            result['warning'] = warnings
+        return result
+
+    def upload_chunked(self, files, target, cid, chunk, bytes_range, **kwargs):
+        """ Stores a chunk of a file uploaded in parts. The response tells
+            how many bytes of the file were received ('_received'), and asks
+            the client to merge the parts once they are all there.
+        """
+        name, start, length, size = parse_chunk(chunk, bytes_range)
+        error = None
+        if self.upload_max_size and size > self.upload_max_size:
+            error = 'errUploadFileSize'
+        elif not self.is_upload_allowed(self.get_upload_mime(name)):
+            error = 'errUploadMime'
+        else:
+            free_space = self.get_free_space()
+            if free_space is not None and size > free_space:
+                error = 'errUploadTotalSize'
+        if error is not None:
+            return {'error': ['errUploadFile', name, error], '_chunkfailure': True}
+
+        key = self._get_chunk_key(cid, name)
+        upload = files.get('upload[]')
+        if upload is not None:
+            self.chunk_store.save(key, start, length, upload.chunks())
+            self.record('bytes_written', length)
+        result = {'added': [], '_received': self.chunk_store.received(key)}
+        if result['_received'] == size and self.chunk_store.claim(key):
+            # The client sends it back as is to merge the parts.
+            result.update({'_chunkmerged': '%s_%s_%d' % (key, cid, size), '_name': name})
+        return result
+
+    def upload_chunked_req(self, files, parent, chunk, **kwargs):
+        """ Merges the parts of a chunked upload (chunk is the _chunkmerged
+            value of the last part), or discards them when the client gave up
+            on the upload. Only the parts of the upload of the same name by
+            the same user can be merged.
+        """
+        if files == ['chunkfail'] and kwargs.get('mimes[]') == ['chunkfail']:
+            name = CHUNK_NAME.match(chunk)
+            if name is None:
+                raise Exception('Invalid chunk: %s' % chunk)
+            self.chunk_store.discard(self._get_chunk_key(kwargs.get('cid'), name.group('name')))
+            return {'added': [],
+                    'warning': ['errUploadFile', name.group('name'), 'errUploadTemp']}
+
+        merged, _, size = chunk.rpartition('_')
+        key, _, cid = merged.partition('_')
+        name = files[0]
+        if '/' in name or '\\' in name:
+            raise Exception('Invalid file name: %s' % name)
+        if not size.isdigit() or key != self._get_chunk_key(cid, name):
+            raise Exception('Invalid chunked upload: %s' % chunk)
+        self.chunk_store.purge()
+        try:
+            parent_path = self._find_path(parent)
+            info = self._get_identical_file(parent_path / name, int(size),
+                                            self.chunk_store.read(key, int(size)))
+            if info is None:
+                info = self.write_chunks(name, parent, self.chunk_store.read(key, int(size)))
+        finally:
+            self.chunk_store.discard(key)
+        return {'added': [info]}
+
+    def _get_chunk_key(self, cid, name):
+        user = get_request_user(self.request) if self.request is not None else ''
+        return ChunkStore.get_key(self.get_volume_key(), user, cid, name)
+
+    def _get_identical_file(self, path, size, chunks):
+        """ Returns the info of the file path if it has a checksum and the
+            size and checksum of chunks (only read then).
+        """
+        if not self.checksums or self._get_file_size(str(path)) != size or not path.is_file():
+            return None
+        checksum = get_file_checksum(str(path))
+        if checksum is None:
+            return None
+        hasher = new_hasher()
+        for chunk in checksum_chunks(chunks, hasher):
+            pass
+        if format_checksum(hasher) != checksum:
+            return None
+        return self._get_path_info(path)
 
     # private methods
 
     @staticmethod
     def _path_safe_resolution(path):
-        return pathlib.Path(WrapperBase.bytes_safe_decode(str(path)))
+        path = str(path)
+        return pathlib.Path(WrapperBase.bytes_safe_decode(
+            path, directory=os.path.dirname(path)))
 
     def _find_path(self, fhash, root=None, resolution=False):
         if root is None:
             root = self.root
-        final_path = None
-
         if not fhash:
             return root
 
+        final_path = None
+        if root == self.root:
+            final_path = self._find_indexed_path(fhash)
+        if final_path is None:
+            final_path = self._walk_for_path(fhash, root)
+        if final_path is not None and resolution:
+            try:
+                final_path = self._path_safe_resolution(final_path)
+            except:
+                pass
+        return final_path
+
+    def _find_indexed_path(self, fhash):
+        self._sync_cache()
+        path = self.cache.get_path(fhash)
+        if path is not None and not os.path.lexists(str(path)):
+            self.cache.forget_path(fhash)
+            path = None
+        return path
+
+    def _walk_for_path(self, fhash, root):
+        """ Walks root until the entry with the hash fhash is found, indexing
+            the hashes of the entries visited on the way. Only the path found
+            goes to the shared cache; `warm` shares the whole index.
+        """
+        index = {}
+        try:
+            for path_hash, path in self._walk_hashes(root):
+                index[path_hash] = path
+                if path_hash == fhash:
+                    self.cache.set_paths({fhash: path}, shared=True)
+                    return path
+        finally:
+            self.cache.set_paths(index)
+        return None
+
+    def _walk_hashes(self, root):
+        """ Yields (hash, path) for the entries under root. """
         for dirpath, dirnames, filenames in os.walk(str(root)):
+            self.check_aborted()
+            self.record('fs_scanned', len(dirnames) + len(filenames))
             for filename in filenames:
                 filepath = self.root.joinpath(dirpath, filename)
                 f_obj = FileWrapper(filepath, self.root,
                                     fs_driver_url=self.fs_driver_url)
-                if fhash == f_obj.get_hash():
-                    final_path = filepath
-                    if resolution:
-                        try:
-                            final_path = self._path_safe_resolution(final_path)
-                        except:
-                            pass
-                    return final_path
+                yield f_obj.get_hash(), filepath
 
             for dirname in dirnames:
                 child_dirpath = self.root.joinpath(dirpath, dirname)
                 d_obj = DirectoryWrapper(child_dirpath, self.root, **self.kwargs)
-                if fhash == d_obj.get_hash():
-                    final_path = child_dirpath
-                    if resolution:
-                        try:
-                            final_path = self._path_safe_resolution(final_path)
-                        except:
-                            pass
-                    return final_path
+                yield d_obj.get_hash(), child_dirpath
 
             dirpath = pathlib.Path(dirpath).resolve()
             d_obj = DirectoryWrapper(dirpath, self.root, **self.kwargs)
-            if fhash == d_obj.get_hash():
-                final_path = dirpath
-                if resolution:
-                    try:
-                        final_path = self._path_safe_resolution(final_path)
-                    except:
-                        pass
-                return final_path
-
-        return final_path
+            yield d_obj.get_hash(), dirpath
 
     def _get_path_object(self, path):
         if path.is_dir():
@@ -459,4 +1380,29 @@ class FileSystemVolumeDriver(BaseVolumeDriver):
                                fs_driver_url=self.fs_driver_url)
 
     def _get_path_info(self, path):
-        return self._get_path_object(path).get_info()
+        info = self._get_path_object(path).get_info()
+        self.cache.set_paths({info['hash']: path})
+        if self.checksums and info['mime'] != 'directory':
+            checksum = get_file_checksum(str(path))
+            if checksum is not None:
+                info['checksum'] = checksum
+        return info
+
+    @staticmethod
+    def _get_file_size(path):
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            # removed while walking
+            return 0
+
+    def _map(self, func, items):
+        """ Returns [func(item) for item in items], issuing the calls
+            concurrently when the volume sets 'stat_workers' (useful on
+            network filesystems, where every stat is a round trip).
+        """
+        workers = int(self.kwargs.get('stat_workers') or 0)
+        if workers < 2 or len(items) < 2:
+            return [func(item) for item in items]
+        executor = get_thread_pool('stat:%s' % self.kwargs.get('volume_driver_name'), workers)
+        return list(executor.map(func, items))
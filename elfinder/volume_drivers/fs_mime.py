@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+""" MIME types of the files of the filesystem driver.
+
+MimeResolver guesses a type from the file extension, caching the answer
+per extension, with ELFINDER_MIME_TYPES overriding the mimetypes module.
+With ELFINDER_MIME_SNIFF, files without a known extension (or known only
+as application/octet-stream) are identified by their first bytes; the
+result is cached by device, inode and modification time.
+"""
+import mimetypes
+import os
+import threading
+
+from elfinder.conf import settings as elfinder_settings
+
+try:
+    import magic
+except ImportError:
+    magic = None
+
+# bytes read from a file to identify it
+SNIFF_SIZE = 512
+# files whose sniffed type is remembered
+SNIFF_CACHE_SIZE = 4096
+
+# (offset, signature, mime)
+SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (8, b'WEBP', 'image/webp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'%!PS', 'application/postscript'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BZh', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/x-rar-compressed'),
+    (257, b'ustar', 'application/x-tar'),
+    (0, b'\x7fELF', 'application/x-executable'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'ID3', 'audio/mpeg'),
+    (8, b'WAVE', 'audio/wav'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+)
+
+# (prefix of the lowercased, stripped text, mime)
+TEXT_SIGNATURES = (
+    (b'<?xml', 'text/xml'),
+    (b'<svg', 'image/svg+xml'),
+    (b'<!doctype html', 'text/html'),
+    (b'<html', 'text/html'),
+    (b'#!', 'text/x-script'),
+)
+
+
+def sniff(head):
+    """ Returns the MIME type of the bytes starting a file, or None. """
+    for offset, signature, mime in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return mime
+    if b'\x00' in head:
+        return magic.from_buffer(head, mime=True) if magic is not None else None
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # the read may have cut the last character in half
+        if e.start < len(head) - 3:
+            return magic.from_buffer(head, mime=True) if magic is not None else None
+    text = head.lstrip().lower()
+    for prefix, mime in TEXT_SIGNATURES:
+        if text.startswith(prefix):
+            return mime
+    return 'text/plain'
+
+
+class MimeResolver(object):
+    def __init__(self, overrides=None, sniff=False):
+        self.overrides = dict(('.' + extension.lower().lstrip('.'), mime)
+                              for extension, mime in (overrides or {}).items())
+        self.sniff = sniff
+        self._extensions = {}
+        self._sniffed = {}
+        self._lock = threading.Lock()
+
+    def guess(self, path):
+        """ Returns the MIME type of the file at path, or None. """
+        mime = self.guess_extension(os.path.basename(path))
+        if self.sniff and mime in (None, 'application/octet-stream'):
+            mime = self.guess_contents(path) or mime
+        return mime
+
+    def guess_extension(self, name):
+        extension = self._get_extension(name)
+        if not extension:
+            return None
+        try:
+            return self._extensions[extension]
+        except KeyError:
+            pass
+        mime = self.overrides.get(extension)
+        if mime is None:
+            mime = mimetypes.guess_type('file' + extension)[0]
+        self._extensions[extension] = mime
+        return mime
+
+    def guess_contents(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+        try:
+            return self._sniffed[key]
+        except KeyError:
+            pass
+        try:
+            with open(path, 'rb') as fp:
+                mime = sniff(fp.read(SNIFF_SIZE)) if stat.st_size else None
+        except (IOError, OSError):
+            return None
+        with self._lock:
+            if len(self._sniffed) >= SNIFF_CACHE_SIZE:
+                self._sniffed.clear()
+            self._sniffed[key] = mime
+        return mime
+
+    @staticmethod
+    def _get_extension(name):
+        """ Returns the lowercased extension of name, keeping the type
+            extension of compressed files ('.tar.gz').
+        """
+        base, extension = os.path.splitext(name.lower())
+        if extension in mimetypes.encodings_map:
+            extension = os.path.splitext(base)[1] + extension
+        return extension
+
+
+_resolver = None
+
+
+def get_mime_resolver():
+    """ Returns the resolver configured by the elFinder settings. """
+    global _resolver
+    if _resolver is None:
+        _resolver = MimeResolver(elfinder_settings.ELFINDER_MIME_TYPES,
+                                 elfinder_settings.ELFINDER_MIME_SNIFF)
+    return _resolver
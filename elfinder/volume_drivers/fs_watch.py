@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+""" Change feed of the filesystem driver, for volumes changed outside
+elFinder (rsync jobs, other applications).
+
+InotifyWatcher watches every directory of a volume with Linux inotify and
+records the paths that changed in a ChangeJournal, which the driver
+consumes to invalidate its caches. The journal is bounded: when it, or the
+kernel queue, overflows, the driver drops all its caches instead.
+
+The directories are walked to be watched by the thread of the watcher,
+never by the requests: the watcher is `ready` once the whole volume is
+watched (again, after a kernel queue overflow), and the driver only caches
+directory sizes while it is.
+"""
+import collections
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    name = ctypes.util.find_library('c')
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class ChangeJournal(object):
+    """ Bounded queue of changed paths. When more than `size` changes are
+        pending, they are dropped and the journal reports an overflow.
+    """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._paths = collections.OrderedDict()
+        self._overflowed = False
+        self._lock = threading.Lock()
+
+    def add(self, path):
+        with self._lock:
+            if self._overflowed:
+                return
+            if len(self._paths) >= self.size and path not in self._paths:
+                self._paths.clear()
+                self._overflowed = True
+            else:
+                self._paths[path] = None
+
+    def overflow(self):
+        with self._lock:
+            self._paths.clear()
+            self._overflowed = True
+
+    def consume(self):
+        """ Returns (paths, overflowed) and empties the journal. When
+            overflowed is True, paths is empty and anything may have changed.
+        """
+        with self._lock:
+            paths, overflowed = list(self._paths), self._overflowed
+            self._paths.clear()
+            self._overflowed = False
+        return paths, overflowed
+
+
+class InotifyWatcher(object):
+    """ Feeds the changes made under root to a ChangeJournal. Events are
+        read by a daemon thread, and by `poll`, which callers use to pick
+        up the changes the kernel has queued but the thread not yet read.
+        The thread also walks the directories to watch.
+    """
+
+    def __init__(self, root, journal):
+        self.root = root
+        self.journal = journal
+        self.ready = threading.Event()
+        self._fd = None
+        self._directories = {}
+        # directories whose trees are to be watched, by the thread
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._fd = fd
+        self._pending.append(self.root)
+        self._thread = threading.Thread(target=self._run,
+                                        name='elfinder-inotify %s' % self.root)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def poll(self):
+        """ Reads the pending events without blocking. """
+        with self._lock:
+            while True:
+                try:
+                    data = os.read(self._fd, READ_SIZE)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        return
+                    raise
+                self._handle(data)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._watch_pending()
+                readable = select.select([self._fd], [], [], 1.0)[0]
+                if readable:
+                    self.poll()
+            except Exception:
+                logger.exception('Reading inotify events of %s failed', self.root)
+                self.journal.overflow()
+                self._stopped.wait(1.0)
+
+    def _watch_pending(self):
+        while self._pending and not self._stopped.is_set():
+            path = self._pending.popleft()
+            self._watch_tree(path)
+            if path != self.root:
+                # what changed in the tree before it was watched
+                self.journal.add(path)
+        if not self._pending:
+            self.ready.set()
+
+    def _watch_tree(self, path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            if self._stopped.is_set():
+                return
+            self._watch(dirpath)
+
+    def _watch(self, path):
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error not in (errno.ENOENT, errno.ENOTDIR):
+                # ENOSPC: fs.inotify.max_user_watches is too low.
+                logger.warning('Cannot watch %s: %s', path, os.strerror(error))
+                self.journal.overflow()
+            return
+        self._directories[wd] = path
+
+    def _handle(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, including creations of directories to
+                # watch: the thread watches the whole tree again.
+                self.ready.clear()
+                self.journal.overflow()
+                self._pending.append(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._pending.append(path)
+            self.journal.add(path)
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def get_watcher(root, queue_size=10000):
+    """ Returns the process-wide watcher of root, starting it on first use,
+        or None if inotify is not available. Starting it does not walk the
+        volume (see InotifyWatcher.ready).
+    """
+    with _watchers_lock:
+        if root not in _watchers:
+            watcher = InotifyWatcher(root, ChangeJournal(queue_size))
+            try:
+                watcher.start()
+            except OSError as e:
+                logger.warning('Cannot watch %s for changes: %s', root, e)
+                watcher = None
+            _watchers[root] = watcher
+        return _watchers[root]
@@ -1,13 +1,67 @@
+from django.core.cache import cache as shared_cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.signals import post_delete, post_save
 from django.shortcuts import render_to_response
 from django.template import RequestContext
-from elfinder.volume_drivers.base import BaseVolumeDriver
+from django.utils.functional import cached_property
+from elfinder.checksums import checksum_data
+from elfinder.volume_drivers.base import BaseVolumeDriver, check_name
 from elfinder import models
+import copy
 import logging
+import threading
+import uuid
 
 
 logger = logging.getLogger(__name__)
 
+# Collections, and the id and tree_id of their root directories, by
+# (model, id), so that drivers don't query them on every request. Both are
+# stored with the stamp they were fetched under (see _get_collection_stamp).
+_collections = {}
+_root_ids = {}
+_watched_models = set()
+_cache_lock = threading.Lock()
+
+
+def _get_collection_stamp_key(model, pk):
+    return 'elfinder:collection:%s:%s' % (model._meta.label_lower, pk)
+
+
+def _get_collection_stamp(model, pk):
+    """ The token replaced in the Django cache whenever the collection is
+        saved, so that the other processes refetch it.
+    """
+    return shared_cache.get(_get_collection_stamp_key(model, pk))
+
+
+def _forget_collection(sender, instance, **kwargs):
+    _collections.pop((sender, str(instance.pk)), None)
+    shared_cache.set(_get_collection_stamp_key(sender, instance.pk), uuid.uuid4().hex, None)
+
+
+def _forget_root_id(sender, instance, **kwargs):
+    # trashed directories are roots too, but never the root of a collection
+    if instance.parent_id is None and not getattr(instance, 'deleted', False):
+        for key, cached in list(_root_ids.items()):
+            if cached[1] == instance.pk:
+                _root_ids.pop(key, None)
+        collection_model = sender._meta.get_field('collection').related_model
+        shared_cache.set(_get_collection_stamp_key(collection_model, instance.collection_id),
+                         uuid.uuid4().hex, None)
+
+
+def _watch(model, receiver):
+    """ Connects receiver to the changes of model, once. """
+    with _cache_lock:
+        if (model, receiver) in _watched_models:
+            return
+        _watched_models.add((model, receiver))
+    for signal in (post_save, post_delete):
+        signal.connect(receiver, sender=model, weak=False)
+
 
 class ModelVolumeDriver(BaseVolumeDriver):
     def __init__(self, collection_id,
@@ -21,16 +75,123 @@ class ModelVolumeDriver(BaseVolumeDriver):
         self.collection_model = collection_model
         self.directory_model = directory_model
         self.file_model = file_model
+        self.collection_id = collection_id
 
-        self.collection = self.collection_model.objects.get(pk=collection_id)
+    @cached_property
+    def collection(self):
+        """ The collection, fetched once per process until it is saved, by
+            any process sharing the Django cache. Changes made with
+            queryset updates are not seen.
+        """
+        key = (self.collection_model, str(self.collection_id))
+        stamp = _get_collection_stamp(self.collection_model, self.collection_id)
+        cached = _collections.get(key)
+        if cached is not None and cached[0] == stamp:
+            collection = cached[1]
+        else:
+            _watch(self.collection_model, _forget_collection)
+            collection = self.collection_model.objects.get(pk=self.collection_id)
+            _collections[key] = (stamp, collection)
+        # The cached instance is shared by the threads of the process.
+        return copy.copy(collection)
+
+    @cached_property
+    def root_ids(self):
+        """ The id and tree_id of the root directory, fetched once per
+            process until a root directory of the collection is saved or
+            deleted, or the collection is saved.
+        """
+        key = (self.directory_model, str(self.collection_id))
+        stamp = _get_collection_stamp(self.collection_model, self.collection_id)
+        cached = _root_ids.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1:]
+        _watch(self.directory_model, _forget_root_id)
+        roots = self.directory_model.objects.filter(parent=None,
+                                                    collection=self.collection_id)
+        if self.has_trash:
+            # trashed directories are roots too
+            roots = roots.filter(deleted=False)
+        root_id, tree_id = roots.values_list('pk', 'tree_id').get()
+        _root_ids[key] = (stamp, root_id, tree_id)
+        return root_id, tree_id
+
+    @cached_property
+    def root_directory(self):
+        """ The root directory of the collection, fetched by its cached id. """
+        root = self.directory_model.objects.get(pk=self.root_ids[0])
+        root.collection = self.collection
+        return root
 
     def get_volume_id(self):
-        return 'fc%s' % self.collection.id
+        return 'fc%s' % self.collection_id
+
+    def get_volume_key(self):
+        return '%s_%s' % (self.collection_model._meta.label_lower, self.collection_id)
+
+    @cached_property
+    def has_trash(self):
+        """ Whether the models have the deleted flag of the trash. """
+        return (issubclass(self.directory_model, models.Directory) and
+                issubclass(self.file_model, models.File))
+
+    @cached_property
+    def counts_usage(self):
+        """ Whether the models maintain FileCollection.usage. """
+        return (issubclass(self.collection_model, models.FileCollection) and
+                issubclass(self.file_model, models.File))
+
+    def get_free_space(self):
+        """ The quota of the collection, or the 'quota' options when it has
+            none. The quota and the usage are read fresh, in one query.
+        """
+        if not self.counts_usage:
+            return super(ModelVolumeDriver, self).get_free_space()
+        quota, usage = self.collection_model.objects.filter(
+            pk=self.collection_id).values_list('quota', 'usage').get()
+        if quota is None:
+            quota = self.quota
+        if quota is None:
+            return None
+        return max(quota - usage, 0)
+
+    def get_usage(self):
+        if not self.counts_usage:
+            raise NotImplementedError
+        return self.collection_model.objects.filter(
+            pk=self.collection_id).values_list('usage', flat=True).get()
+
+    def add_usage(self, delta):
+        if self.counts_usage:
+            models.add_usage(self.collection_id, delta)
+
+    def reconcile_usage(self):
+        if not self.counts_usage:
+            return None
+        self.collection_model.reconcile_usage(self.collection_id)
+        return self.get_usage()
+
+    def _get_size(self, object):
+        """ Returns the bytes held by a file, or by the files under a
+            directory (one query).
+        """
+        if isinstance(object, self.directory_model):
+            return self.file_model.objects.filter(
+                parent__tree_id=object.tree_id, parent__lft__gte=object.lft,
+                parent__rght__lte=object.rght).aggregate(size=Sum('size'))['size'] or 0
+        return object.size
 
     def get_info(self, hash):
         return self.get_object(hash).get_info()
 
-    def get_tree(self, target, ancestors=False, siblings=False):
+    def get_version(self, target, ancestors=False):
+        """ Any change in the collection invalidates all its listings. """
+        get_tree_version = getattr(self.collection, 'get_tree_version', None)
+        if get_tree_version is None:
+            return None
+        return '%s:%s' % (self.get_volume_id(), get_tree_version())
+
+    def get_tree(self, target, ancestors=False, siblings=False, **kwargs):
         """ Returns a list of dicts describing children/ancestors/siblings of
             the target directory.
 
@@ -41,9 +202,9 @@ class ModelVolumeDriver(BaseVolumeDriver):
         tree = []
 
         # Add children to the tree first
-        for item in dir.get_children():
+        for item in dir.get_children().select_related('collection', 'parent__collection'):
             tree.append(item.get_info())
-        for item in dir.files.all():
+        for item in self._for_listing(dir.files.all()):
             tree.append(item.get_info())
 
         # Add ancestors next, if required
@@ -62,6 +223,52 @@ class ModelVolumeDriver(BaseVolumeDriver):
 
         return tree
 
+    def search(self, text, target, reqid=None):
+        """ Returns the directories and files under target whose name
+            contains one of the words of text. A substring match cannot use
+            an index on the names: the entries of the subtree of target,
+            found with the MPTT index, are scanned.
+        """
+        dir = self.get_object(target)
+        names = Q()
+        for word in text.split():
+            names |= Q(name__icontains=word)
+        if not names:
+            return []
+        dirs = self.directory_model.objects.filter(
+            names, collection=self.collection, tree_id=dir.tree_id,
+            lft__gt=dir.lft, rght__lt=dir.rght)
+        files = self.file_model.objects.filter(
+            names, collection=self.collection, parent__tree_id=dir.tree_id,
+            parent__lft__gte=dir.lft, parent__rght__lte=dir.rght)
+        return ([item.get_info() for item in
+                 dirs.select_related('collection', 'parent__collection')] +
+                [item.get_info() for item in self._for_listing(files)])
+
+    def _for_listing(self, files):
+        """ Returns the files queryset, without their contents when the
+            file model stores their size.
+        """
+        files = files.select_related('collection', 'parent__collection')
+        field_names = [field.name for field in self.file_model._meta.get_fields()]
+        if 'size' in field_names:
+            files = files.defer('content')
+        return files
+
+    def get_parents(self, target, **kwargs):
+        """ Returns the target directory, its ancestors and their siblings
+            in one query: the directories of its tree, down to its level,
+            that are the root or whose parent is an ancestor of the target.
+        """
+        dir = self.get_object(target)
+        directories = self.directory_model.objects.filter(
+            Q(parent__isnull=True) |
+            Q(parent__lft__lt=dir.lft, parent__rght__gt=dir.rght),
+            tree_id=dir.tree_id,
+            level__lte=dir.level,
+        ).select_related('collection', 'parent__collection')
+        return [directory.get_info() for directory in directories]
+
     def get_object(self, hash):
         """ Returns the object specified by the given hash.
 
@@ -82,8 +289,7 @@ class ModelVolumeDriver(BaseVolumeDriver):
         """
         if hash == '':
             # No target has been specified so return the root directory.
-            return self.directory_model.objects.get(parent=None,
-                                                    collection=self.collection)
+            return self.root_directory
 
         try:
             volume_id, object_hash = hash.split('_')
@@ -103,11 +309,21 @@ class ModelVolumeDriver(BaseVolumeDriver):
         else:
             raise Exception('Invalid target hash: %s' % object_hash)
 
+        objects = model.objects.filter(collection=self.collection_id)
+        if self.has_trash:
+            # Only the deleted flag of the trashed directory is set, so its
+            # descendants are told apart by their tree.
+            tree_id = self.root_ids[1]
+            if model is self.directory_model:
+                objects = objects.filter(tree_id=tree_id)
+            else:
+                objects = objects.filter(parent__tree_id=tree_id)
         try:
-            object = model.objects.get(pk=object_id,
-                                       collection=self.collection.id)
+            # get_info() needs the parent hash
+            object = objects.select_related('parent__collection').get(pk=object_id)
         except ObjectDoesNotExist:
             raise Exception('Could not open target')
+        object.collection = self.collection
 
         return object
 
@@ -135,6 +351,48 @@ class ModelVolumeDriver(BaseVolumeDriver):
                                   {'file': file},
                                   RequestContext(request))
 
+    def read_chunks(self, target, chunk_size=64 * 1024):
+        content = self.get_object(target).content.encode(self.content_encoding)
+        self.record('bytes_read', len(content))
+        return (content[i:i + chunk_size]
+                for i in range(0, len(content), chunk_size))
+
+    def write_chunks(self, name, parent_hash, chunks):
+        """ The content field holds text, so the chunks are joined and
+            decoded before the file is saved. Contents that are not text
+            in content_encoding (e.g. images) are refused.
+        """
+        check_name(name)
+        parent = self.get_object(parent_hash)
+        content = b''.join(chunks)
+        try:
+            content = content.decode(self.content_encoding)
+        except UnicodeDecodeError:
+            raise Exception("'%s' is not %s text" % (name, self.content_encoding))
+        self.record('bytes_written', len(content))
+        existing = self.file_model.objects.filter(name=name, parent=parent,
+                                                  collection=self.collection).first()
+        self.check_free_space(len(content) - (len(existing.content) if existing else 0))
+        if existing is None:
+            new_file = self.file_model.objects.create(name=name, parent=parent,
+                                                      collection=self.collection,
+                                                      content=content)
+        else:
+            new_file = existing
+            new_file.content = content
+            new_file.save()
+        return new_file.get_info()
+
+    def get(self, target, conv=None):
+        return {'content': self.get_object(target).content}
+
+    def putfile(self, target, content, **kwargs):
+        object = self.get_object(target)
+        self.check_free_space(len(content) - len(object.content))
+        object.content = content
+        object.save()
+        return object.get_info()
+
     def mkdir(self, name, parent_hash):
         """ Creates a new directory. """
         return self._create_object(name, parent_hash, self.directory_model)
@@ -158,13 +416,79 @@ class ModelVolumeDriver(BaseVolumeDriver):
             items.append(object['name'])
         return items
 
-    def paste(self, targets, dest, cut):
+    def duplicate(self, targets):
+        """ Copies are created next to their originals. The files of
+            duplicated directories are inserted with bulk_create.
+        """
+        added = []
+        # names used in each parent directory, listed once
+        names = {}
+        for target in targets:
+            self.check_aborted()
+            object = self.get_object(target)
+            if object.parent_id not in names:
+                names[object.parent_id] = self._get_names(object.parent_id)
+            is_dir = isinstance(object, self.directory_model)
+            new_name = self.get_duplicate_name(object.name, names[object.parent_id], is_dir)
+            self.check_free_space(self._get_size(object))
+            if is_dir:
+                new_object = self._copy_directory(object, new_name)
+            else:
+                new_object = self.file_model.objects.create(name=new_name,
+                                                            parent=object.parent,
+                                                            collection=self.collection,
+                                                            content=object.content)
+            added.append(new_object.get_info())
+        return {'added': added}
+
+    def _get_names(self, parent_id):
+        names = set(self.directory_model.objects.filter(
+            parent_id=parent_id).values_list('name', flat=True))
+        names.update(self.file_model.objects.filter(
+            parent_id=parent_id).values_list('name', flat=True))
+        return names
+
+    @transaction.atomic
+    def _copy_directory(self, directory, name):
+        """ Copies directory (named name) and its whole subtree. """
+        new_dir = self.directory_model.objects.create(name=name,
+                                                      parent=directory.parent,
+                                                      collection=self.collection)
+        # Descendants come in tree order, so parents are copied first.
+        copies = {directory.id: new_dir}
+        for child in directory.get_descendants():
+            # an abort rolls the whole copy back
+            self.check_aborted()
+            copies[child.id] = self.directory_model.objects.create(
+                name=child.name, parent=copies[child.parent_id],
+                collection=self.collection)
+        files = self.file_model.objects.filter(parent_id__in=list(copies))
+        new_files = []
+        for file in files:
+            new_file = self.file_model(name=file.name, parent=copies[file.parent_id],
+                                       collection=self.collection, content=file.content)
+            # bulk_create does not call save()
+            new_file.size = len(new_file.content)
+            new_file.checksum = checksum_data(new_file.content)
+            new_files.append(new_file)
+        self.file_model.objects.bulk_create(new_files)
+        self.add_usage(sum(new_file.size for new_file in new_files))
+        # bulk_create sends no post_save signals
+        touch_tree_version = getattr(self.collection, 'touch_tree_version', None)
+        if touch_tree_version is not None:
+            touch_tree_version(self.collection.id)
+        return new_dir
+
+    def paste(self, targets, dest, cut, **kwargs):
         """ Moves/copies target files/directories from source to dest. """
         dest_dir = self.get_object(dest)
         added = []
         removed = []
         for target in targets:
+            self.check_aborted()
             object = self.get_object(target)
+            if not cut and isinstance(object, self.file_model):
+                self.check_free_space(object.size)
             object.parent = dest_dir
             if not cut:
                 # This is a copy so the original object should not be changed.
@@ -182,12 +506,13 @@ class ModelVolumeDriver(BaseVolumeDriver):
                                                    parent=object.parent)
             files = self.file_model.objects.filter(name=object.name,
                                                   parent=object.parent)
-            for dir in dirs:
-                removed.append(dir.get_hash())
-                dir.delete()
-            for file in files:
-                removed.append(file.get_hash())
-                file.delete()
+            with transaction.atomic(), models.batch_usage():
+                for dir in dirs:
+                    removed.append(dir.get_hash())
+                    dir.delete()
+                for file in files:
+                    removed.append(file.get_hash())
+                    file.delete()
 
             object.save()
             added.append(object.get_info())
@@ -197,17 +522,83 @@ class ModelVolumeDriver(BaseVolumeDriver):
         return {'added': added,
                 'removed': removed}
 
+    def _get_identical_file(self, new_file):
+        """ Returns the file with the name and content of new_file in its
+            parent, or None.
+        """
+        if not issubclass(self.file_model, models.File):
+            return None
+        return self._for_listing(self.file_model.objects.filter(
+            parent=new_file.parent, name=new_file.name,
+            checksum=checksum_data(new_file.content))).first()
+
     def remove(self, target):
-        """ Delete a File or Directory object. """
+        """ Delete a File or Directory object. With the 'trash' option, it
+            is only flagged and detached from the tree, to be deleted by
+            purge_trash.
+        """
         object = self.get_object(target)
-        object.delete()
+        if self.kwargs.get('trash') and self.has_trash:
+            self._move_to_trash(object)
+            self.schedule_purge()
+            return
+        # The files of a directory are counted out of the usage at once.
+        with transaction.atomic(), models.batch_usage():
+            object.delete()
+
+    def _move_to_trash(self, object):
+        """ Flags object as deleted and detaches it: a directory becomes
+            the root of a tree of its own, which takes its subtree out of the
+            collection with a couple of updates. It counts in the usage of
+            the collection until purged.
+        """
+        if isinstance(object, self.directory_model):
+            object.deleted = True
+            # move_node, unlike setting the parent, does not renumber the
+            # trees to keep the roots in name order
+            self.directory_model._tree_manager.move_node(object, None)
+        else:
+            self.file_model.objects.filter(pk=object.pk).update(parent=None, deleted=True)
+            touch_tree_version = getattr(self.collection, 'touch_tree_version', None)
+            if touch_tree_version is not None:
+                touch_tree_version(self.collection.id)
+
+    def purge_trash(self):
+        """ Deletes the trashed files and directories of the collection,
+            'trash_batch_size' rows per transaction.
+        """
+        if not self.has_trash:
+            return 0
+        batch_size = int(self.kwargs.get('trash_batch_size', 1000))
+        trees = list(self.directory_model.objects.filter(
+            collection=self.collection_id, deleted=True).values_list('tree_id', flat=True))
+        files = self.file_model.objects.filter(
+            Q(deleted=True) | Q(parent__tree_id__in=trees), collection=self.collection_id)
+        count = 0
+        while True:
+            pks = list(files.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic(), models.batch_usage():
+                self.file_model.objects.filter(pk__in=pks).delete()
+            count += len(pks)
+        # deepest first, so that no directory is left with a deleted parent
+        directories = self.directory_model.objects.filter(tree_id__in=trees).order_by('-level')
+        while True:
+            pks = list(directories.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                self.directory_model.objects.filter(pk__in=pks).delete()
+        return count
 
     def upload(self, files, parent_hash, **kwargs):
         """ For now, this uses a very naive way of storing files - the entire
             file is read in to the File model's content field in one go.
 
             This should be updated to use read_chunks to add the file one
-            chunk at a time.
+            chunk at a time. Uploading a file identical to an existing one
+            (same name and checksum) leaves it alone.
         """
         added = []
         parent = self.get_object(parent_hash)
@@ -219,9 +610,14 @@ class ModelVolumeDriver(BaseVolumeDriver):
             try:
                 new_file.validate_unique()
             except ValidationError as e:
+                identical = self._get_identical_file(new_file)
+                if identical is not None:
+                    added.append(identical.get_info())
+                    continue
                 logger.exception(e)
                 raise Exception("\n".join(e.messages))
 
             new_file.save()
+            self.record('bytes_written', len(new_file.content))
             added.append(new_file.get_info())
         return {'added': added}
@@ -43,12 +43,14 @@ setup(
     author_email='bohacekm@gmail.com',
     url='https://github.com/bohyn/django-elfinder/',
     download_url='https://github.com/bohyn/django-elfinder/tarball/v0.3-ext',
-    packages=['elfinder', 'elfinder.volume_drivers'],
+    packages=['elfinder', 'elfinder.management', 'elfinder.management.commands',
+              'elfinder.migrations', 'elfinder.volume_drivers'],
     include_package_data=True,
     install_requires=[
         'django>=1.11',
         'django-mptt>=0.9.0',
         'pathlib2; python_version <"3.0"',
+        'scandir; python_version <"3.5"',
         'chardet',
         'patool'
     ],